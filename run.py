@@ -1,17 +1,25 @@
 #!/usr/bin/env python
+import time
+STARTUP = time.perf_counter()
+import os
+import sys
 import argparse
-from src import data_cleaning
-from src import rfq_similarity
-from src import ablation_analysis
-from src import alternative_metrics
-from src import clustering
+from src import instrumentation
+from src import warm_worker
 
-def run_scenario_a():
+# Scenario modules (and pandas / scikit-learn behind them) are imported on first
+# use, so e.g. `--run A` never loads scikit-learn; --import-report prints the cost
+def load(module):
+    return instrumentation.timed_import(f"src.{module}")
+
+def run_scenario_a(jobs=None):
+    data_cleaning = load("data_cleaning")
     print("Running Scenario A: Supplier Data Cleaning...")
-    data_cleaning.run_supplier_cleaning(input_dir="data", output_dir="outputs")
+    data_cleaning.run_supplier_cleaning(input_dir="data", output_dir="outputs", jobs=jobs)
     print("✅ Scenario A complete: outputs/inventory_dataset.csv generated.")
 
 def run_scenario_b():
+    rfq_similarity = load("rfq_similarity")
     print("Running Scenario B: RFQ Similarity...")
     rfq_similarity.compute_top3(
         rfq_file="data/rfq.csv",
@@ -22,12 +30,11 @@ def run_scenario_b():
     print("✅ Scenario B complete: outputs/top3.csv generated.")
 
 def run_ablation():
+    ablation_analysis = load("ablation_analysis")
     print("Running Ablation Analysis...")
-    from src import ablation_analysis
     ablation_analysis.compute_and_report(
         rfq_file="data/rfq.csv",
         reference_file="data/reference_properties.tsv",
-        inventory_file="outputs/inventory_dataset.csv",
         output_dir="outputs",
         ablation=True
     )
@@ -35,6 +42,7 @@ def run_ablation():
 
 
 def run_alternative_metrics():
+    alternative_metrics = load("alternative_metrics")
     print("Running Scenario C: Alternative Metrics (cosine vs hybrid)...")
     alternative_metrics.compute_alternative_metrics(
         rfq_file="data/rfq.csv",
@@ -43,37 +51,274 @@ def run_alternative_metrics():
     )
     print("✅ Scenario C complete: outputs/top3_baseline.csv & outputs/top3_hybrid.csv generated.")
 
-def run_clustering():
+def run_clustering(mode="full"):
+    clustering = load("clustering")
     print("Running Clustering Analysis...")
     clustering.cluster_rfqs(
         rfq_file="data/rfq.csv",
         reference_file="data/reference_properties.tsv",
         output_dir="outputs",
-        n_clusters=4
+        n_clusters=4,
+        mode=mode
     )
     print("✅ Clustering complete: outputs/rfq_clusters.csv generated.")
 
-def main():
+def run_cluster_assign(new_rfq_file=None):
+    clustering = load("clustering")
+    print("Running Cluster Assignment...")
+    clustering.assign_rfqs(
+        rfq_file=new_rfq_file or "data/rfq.csv",
+        reference_file="data/reference_properties.tsv",
+        output_dir="outputs"
+    )
+    print("✅ Cluster Assignment complete: outputs/rfq_clusters_assigned.csv generated.")
+
+def run_cluster_sweep(k_values, mode="full", n_jobs=None):
+    clustering = load("clustering")
+    print("Running Cluster Count Sweep...")
+    clustering.sweep_n_clusters(
+        rfq_file="data/rfq.csv",
+        reference_file="data/reference_properties.tsv",
+        output_dir="outputs",
+        k_values=k_values,
+        mode=mode,
+        n_jobs=n_jobs
+    )
+    print("✅ Cluster Count Sweep complete: outputs/cluster_sweep.csv generated.")
+
+def run_inventory_matching():
+    inventory_matching = load("inventory_matching")
+    print("Running Inventory Matching...")
+    inventory_matching.compute_inventory_matches(
+        rfq_file="data/rfq.csv",
+        reference_file="data/reference_properties.tsv",
+        inventory_file="outputs/inventory_dataset.csv",
+        output_dir="outputs"
+    )
+    print("✅ Inventory Matching complete: outputs/top3_inventory.csv generated.")
+
+def run_incremental(new_rfq_file=None):
+    incremental = load("incremental")
+    print("Running Incremental RFQ Similarity...")
+    incremental.compute_top3_incremental(
+        rfq_file="data/rfq.csv",
+        reference_file="data/reference_properties.tsv",
+        new_rfq_file=new_rfq_file,
+        output_file="top3_incremental.csv",
+        output_dir="outputs"
+    )
+    print("✅ Incremental update complete: outputs/top3_incremental.csv generated.")
+
+def run_weight_sweep(step=0.1, n_samples=None, n_jobs=None):
+    ablation_analysis = load("ablation_analysis")
+    print("Running Weight Sweep...")
+    ablation_analysis.run_weight_sweep(
+        rfq_file="data/rfq.csv",
+        reference_file="data/reference_properties.tsv",
+        output_dir="outputs",
+        step=step,
+        n_samples=n_samples,
+        n_jobs=n_jobs
+    )
+    print("✅ Weight Sweep complete: outputs/weight_sweep.csv generated.")
+
+def run_ann_search(nprobe=4, n_lists=None):
+    ann_index = load("ann_index")
+    print("Running Approximate (IVF) RFQ Similarity...")
+    ann_index.compute_top3_ann(
+        rfq_file="data/rfq.csv",
+        reference_file="data/reference_properties.tsv",
+        output_dir="outputs",
+        nprobe=nprobe,
+        n_lists=n_lists
+    )
+    print("✅ IVF search complete: outputs/top3_ann.csv and outputs/ann_recall.csv generated.")
+
+def run_sharded_similarity(keys=None, cross_below=None, n_jobs=None):
+    sharding = load("sharding")
+    print("Running Sharded RFQ Similarity...")
+    sharding.compute_top3_sharded(
+        rfq_file="data/rfq.csv",
+        reference_file="data/reference_properties.tsv",
+        output_dir="outputs",
+        keys=keys,
+        cross_below=sharding.CROSS_BELOW if cross_below is None else cross_below,
+        n_jobs=n_jobs
+    )
+    print("✅ Sharded similarity complete: outputs/top3_sharded.csv and outputs/shard_report.csv generated.")
+
+def run_benchmarks(sizes="1k,10k", stages=None, save_baseline=False):
+    benchmark = load("benchmark")
+    print("Running Synthetic-Scale Benchmarks...")
+    benchmark.run_benchmarks(
+        sizes=benchmark.parse_sizes(sizes),
+        stages=stages,
+        input_dir="data",
+        output_dir="outputs",
+        save_baseline=save_baseline
+    )
+    print("✅ Benchmarks complete: outputs/benchmark_results.csv generated.")
+
+def run_service(port=None, socket_path=None, max_wait_ms=None):
+    similarity_service = load("similarity_service")
+    print("Running Similarity Service (Ctrl+C to stop)...")
+    similarity_service.run_service(
+        rfq_file="data/rfq.csv",
+        reference_file="data/reference_properties.tsv",
+        inventory_file="outputs/inventory_dataset.csv",
+        output_dir="outputs",
+        port=similarity_service.DEFAULT_PORT if port is None else port,
+        socket_path=socket_path,
+        max_wait_ms=similarity_service.MAX_WAIT_MS if max_wait_ms is None else max_wait_ms
+    )
+    print("✅ Similarity Service stopped.")
+
+def build_feature_store():
+    feature_store = load("feature_store")
+    print("Building shared feature store...")
+    feature_store.load_feature_frame(
+        rfq_file="data/rfq.csv",
+        reference_file="data/reference_properties.tsv",
+        output_dir="outputs"
+    )
+
+RFQ_INPUTS = ["data/rfq.csv", "data/reference_properties.tsv"]
+INVENTORY = "outputs/inventory_dataset.csv"
+
+# Scenario graph: inputs / outputs drive up-to-date checks, deps drive ordering.
+# FS builds the shared feature store once so parallel scenarios never race on it.
+# Paths that come from a scenario module are callables, resolved only when planned.
+SCENARIOS = {
+    "A": {"run": run_scenario_a, "module": "data_cleaning",
+          "inputs": lambda: [f"data/{a['file']}" for a in load("data_cleaning").SUPPLIER_ADAPTERS.values()],
+          "outputs": [INVENTORY]},
+    "FS": {"run": build_feature_store, "module": "feature_store", "inputs": RFQ_INPUTS, "always": True},
+    "B": {"run": run_scenario_b, "module": "rfq_similarity", "deps": ["FS"],
+          "inputs": RFQ_INPUTS, "outputs": ["outputs/top3.csv"]},
+    "AB": {"run": run_ablation, "module": "ablation_analysis", "deps": ["FS"],
+           "inputs": RFQ_INPUTS,
+           "outputs": lambda: [f"outputs/top3_{s['name']}.csv" for s in load("ablation_analysis").SCENARIOS]},
+    "C": {"run": run_alternative_metrics, "module": "alternative_metrics", "deps": ["FS"],
+          "inputs": RFQ_INPUTS, "outputs": ["outputs/top3_baseline.csv", "outputs/top3_hybrid.csv"]},
+    "CL": {"run": run_clustering, "module": "clustering", "deps": ["FS"],
+           "inputs": RFQ_INPUTS, "outputs": ["outputs/rfq_clusters.csv"]},
+    "CLA": {"run": run_cluster_assign, "module": "clustering", "deps": ["CL"], "always": True},
+    "CLS": {"run": run_cluster_sweep, "module": "clustering", "deps": ["FS"],
+            "inputs": RFQ_INPUTS, "outputs": ["outputs/cluster_sweep.csv"]},
+    "ANN": {"run": run_ann_search, "module": "ann_index", "deps": ["B"],
+            "inputs": RFQ_INPUTS + ["outputs/top3.csv"], "outputs": ["outputs/top3_ann.csv", "outputs/ann_recall.csv"]},
+    "SH": {"run": run_sharded_similarity, "module": "sharding", "deps": ["B"],
+           "inputs": RFQ_INPUTS + ["outputs/top3.csv"], "outputs": ["outputs/top3_sharded.csv", "outputs/shard_report.csv"]},
+    "BENCH": {"run": run_benchmarks, "module": "benchmark", "always": True},
+    "M": {"run": run_inventory_matching, "module": "inventory_matching", "deps": ["A", "FS"],
+          "inputs": RFQ_INPUTS + [INVENTORY], "outputs": ["outputs/top3_inventory.csv"]},
+    "SW": {"run": run_weight_sweep, "module": "ablation_analysis", "deps": ["FS"],
+           "inputs": RFQ_INPUTS, "outputs": ["outputs/weight_sweep.csv"]},
+    "INC": {"run": run_incremental, "module": "incremental", "deps": ["FS"], "always": True,
+            "outputs": ["outputs/top3_incremental.csv"]},
+    "SRV": {"run": run_service, "module": "similarity_service", "deps": ["FS"], "always": True, "inline": True},
+}
+
+# "2-10" -> [2, ..., 10]; "3,5,8" -> [3, 5, 8]
+def parse_range(text):
+    if "-" in text:
+        lo, hi = text.split("-")
+        return list(range(int(lo), int(hi) + 1))
+    return [int(part) for part in text.split(",") if part.strip()]
+
+# use_warm: hand the invocation to a running warm worker (run.py --warm) if there is one
+def main(argv=None, use_warm=True):
     parser = argparse.ArgumentParser(description="Vanilla Steel Assessment Runner")
     parser.add_argument(
         "--run",
         type=str,
-        required=True,
-        help="Comma-separated scenarios to run: A,B,AB,C,CL"
-    )
-    args = parser.parse_args()
-    scenarios = [s.strip().upper() for s in args.run.split(",")]
-
-    if "A" in scenarios:
-        run_scenario_a()
-    if "B" in scenarios:
-        run_scenario_b()
-    if "AB" in scenarios:
-        run_ablation()
-    if "C" in scenarios:
-        run_alternative_metrics()
-    if "CL" in scenarios:
-        run_clustering()
+        default=None,
+        help="Comma-separated scenarios to run: A,B,AB,C,CL,CLA,CLS,ANN,SH,M,SW,INC,BENCH,SRV"
+    )
+    parser.add_argument("--sweep-step", type=float, default=0.1, help="Grid step for the weight sweep (SW)")
+    parser.add_argument("--sweep-samples", type=int, default=None, help="Random weight samples instead of a grid (SW)")
+    parser.add_argument("--new-rfqs", type=str, default=None, help="CSV of newly arrived RFQs to add (INC) or assign (CLA)")
+    parser.add_argument("--cluster-mode", choices=["full", "minibatch"], default="full", help="KMeans on the whole corpus or streamed mini-batches (CL, CLS)")
+    parser.add_argument("--cluster-range", type=str, default="2-10", help="n_clusters values for the sweep, e.g. 2-10 or 3,5,8 (CLS)")
+    parser.add_argument("--nprobe", type=int, default=4, help="Inverted lists probed per query (ANN)")
+    parser.add_argument("--n-lists", type=int, default=None, help="Inverted lists in the IVF index, default sqrt(n) (ANN)")
+    parser.add_argument("--shard-keys", type=str, default=None, help="Comma-separated blocking keys, default Category,form (SH)")
+    parser.add_argument("--cross-shard-below", type=float, default=None, help="Re-search rows whose within-shard k-th score is below this across shards (default 0.9); =-inf turns it off, inf is exact (SH)")
+    parser.add_argument("--bench-sizes", type=str, default="1k,10k", help="Synthetic corpus sizes, e.g. 1k,10k,100k,1m (BENCH)")
+    parser.add_argument("--bench-stages", type=str, default=None, help="Comma-separated stages to benchmark (BENCH)")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the benchmark results as the new baseline (BENCH)")
+    parser.add_argument("--jobs", type=int, default=None, help="Worker processes (default: all cores, 1 = sequential)")
+    parser.add_argument("--port", type=int, default=None, help="HTTP port of the similarity service, default 8765 (SRV)")
+    parser.add_argument("--socket", type=str, default=None, help="Serve on this Unix socket instead of a TCP port (SRV)")
+    parser.add_argument("--batch-window-ms", type=float, default=None, help="How long the service collects concurrent requests into one batch, default 5 ms (SRV)")
+    parser.add_argument("--force", action="store_true", help="Rerun scenarios even if they are up to date")
+    parser.add_argument("--metrics", type=str, default=None, help="Write per-stage metrics to this .json or .jsonl file")
+    parser.add_argument("--profile-stage", type=str, default=None, help="cProfile every stage with this name, e.g. similarity or scenario.B")
+    parser.add_argument("--cache-mb", type=float, default=None, help="Size cap of the similarity result cache in MB (default 512, 0 = off)")
+    parser.add_argument("--parquet", action="store_true", help="Also write top-k results to outputs/topk/scenario=<name>/ as Parquet (needs pyarrow; combine with --force for up-to-date scenarios)")
+    parser.add_argument("--import-report", action="store_true", help="Print the time and packages of every lazy module import")
+    parser.add_argument("--warm", action="store_true", help="Start a warm worker that preloads all modules and runs later invocations (stop with Ctrl+C)")
+    parser.add_argument("--warm-socket", type=str, default=warm_worker.DEFAULT_SOCKET, help="Unix socket of the warm worker")
+    parser.add_argument("--cold", action="store_true", help="Run in this process even if a warm worker is running")
+    args = parser.parse_args(argv)
+
+    if args.warm:
+        modules = sorted({f"src.{s['module']}" for s in SCENARIOS.values()} | {"src.result_cache", "src.topk_output"})
+        warm_worker.serve(lambda argv: main(argv, use_warm=False), modules, args.warm_socket,
+                          root=os.path.dirname(os.path.abspath(__file__)))
+        return
+    if not args.run:
+        parser.error("--run is required (or --warm)")
+    if use_warm and not args.cold:
+        code = warm_worker.run_in_worker(sys.argv[1:] if argv is None else argv, args.warm_socket)
+        if code is not None:
+            raise SystemExit(code)
+    if args.import_report:
+        os.environ[instrumentation.IMPORT_REPORT_ENV] = "1"
+        if use_warm:
+            print(f"[import] run.py startup: {time.perf_counter() - STARTUP:.2f}s, {len(sys.modules)} modules loaded")
+        else:
+            print(f"[import] running in the warm worker: {len(sys.modules)} modules preloaded")
+
+    scenarios = [s.strip().upper() for s in args.run.split(",") if s.strip()]
+
+    params = {
+        "A": {"jobs": args.jobs},
+        "SW": {"step": args.sweep_step, "n_samples": args.sweep_samples, "n_jobs": args.jobs},
+        "INC": {"new_rfq_file": args.new_rfqs},
+        "CL": {"mode": args.cluster_mode},
+        "ANN": {"nprobe": args.nprobe, "n_lists": args.n_lists},
+        "SH": {"keys": [k.strip() for k in args.shard_keys.split(",") if k.strip()] if args.shard_keys else None,
+               "cross_below": args.cross_shard_below, "n_jobs": args.jobs},
+        "BENCH": {
+            "sizes": args.bench_sizes,
+            "stages": args.bench_stages.split(",") if args.bench_stages else None,
+            "save_baseline": args.save_baseline,
+        },
+        "CLA": {"new_rfq_file": args.new_rfqs},
+        "CLS": {"k_values": parse_range(args.cluster_range), "mode": args.cluster_mode, "n_jobs": args.jobs},
+        "SRV": {"port": args.port, "socket_path": args.socket, "max_wait_ms": args.batch_window_ms},
+    }
+    if args.parquet:
+        load("topk_output").enable_parquet_output()
+    if args.cache_mb is not None:
+        os.environ[load("result_cache").CACHE_ENV] = str(args.cache_mb)
+    pipeline = load("pipeline")
+    instrumentation.start_run(args.metrics, args.profile_stage)
+    wall_start, run_start = time.perf_counter(), time.time()
+    results = pipeline.run_dag(
+        SCENARIOS, scenarios, params=params, output_dir="outputs",
+        jobs=args.jobs, force=args.force, extra_files=[os.path.abspath(__file__)]
+    )
+    cache_stats = load("result_cache").print_cache_stats("outputs", since=run_start)
+    instrumentation.finish_run(args.metrics, {
+        "scenarios": {name: {"status": status, "seconds": seconds} for name, (status, seconds) in results.items()},
+        "seconds": time.perf_counter() - wall_start,
+        "peak_rss_mb": instrumentation.peak_rss_mb(),
+        "similarity_cache": cache_stats,
+    })
+    if any(status in ("failed", "blocked") for status, _ in results.values()):
+        raise SystemExit(1)
 
 if __name__ == "__main__":
     main()
@@ -1,97 +1,126 @@
 import os
+import itertools
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
-from sklearn.preprocessing import MinMaxScaler
-from sklearn.metrics.pairwise import cosine_similarity
-from src.rfq_similarity import engineer_features, normalize_grade_keys
+from src.feature_store import load_feature_matrices, open_feature_matrices
+from src.rfq_similarity import family_embeddings, family_tiles, combine_tiles, pair_scores, weighted_topk
+from src.dedupe import spec_groups, expand_topk
+from src.topk import blocked_topk_many, topk_frame
+from src.topk_output import write_topk
+from src.result_cache import cached_topk, lookup_topk, store_topk, cached_family_scores
+from src.instrumentation import stage
+
+DEFAULT_WEIGHTS = {'dimensional':0.4,'grade_properties':0.3,'categorical':0.3}
+DEFAULT_FEATURES = ['dimensional','grade_properties','categorical']
+
+SCENARIOS = [
+    {'name':'all_features','use_features':['dimensional','grade_properties','categorical'],'weights':{'dimensional':0.4,'grade_properties':0.3,'categorical':0.3}},
+    {'name':'dimensions_only','use_features':['dimensional'],'weights':{'dimensional':1.0}},
+    {'name':'grade_only','use_features':['grade_properties'],'weights':{'grade_properties':1.0}},
+    {'name':'categorical_only','use_features':['categorical'],'weights':{'categorical':1.0}},
+    {'name':'adjusted_weights','use_features':['dimensional','grade_properties','categorical'],'weights':{'dimensional':0.5,'grade_properties':0.2,'categorical':0.3}}
+]
+
+# Effective weights of a scenario, in use_features order (missing weights count as 0)
+def scenario_weights(scenario):
+    weights = scenario.get('weights') or DEFAULT_WEIGHTS
+    use_features = scenario.get('use_features') or DEFAULT_FEATURES
+    return {key: weights.get(key, 0) for key in use_features}
+
+# Top-k for several scenarios in one streaming pass: each family's cosine tile is
+# computed once per block and every scenario is a cheap weighted combination of it.
+# Returns {scenario name: (top_idx, top_scores)}. Precomputed embeddings (e.g.
+# the memory-mapped feature matrices) are used instead of encoding feature_df;
+# given the feature matrices themselves, each family's spec-by-spec cosines are
+# kept in the similarity cache and later scenarios only combine them.
+def scenario_topk(feature_df, scenarios, top_n=3, block_size=1024, embeddings=None, matrices=None):
+    scenario_w = [scenario_weights(s) for s in scenarios]
+    families = [f for f in DEFAULT_FEATURES if any(f in w for w in scenario_w)]
+    if embeddings is None:
+        embeddings = matrices['embeddings'] if matrices is not None else family_embeddings(feature_df, families)
+
+    # Scored on unique specs (over every family in use) and expanded per row
+    first_rows, inverse, _ = spec_groups(*(embeddings[f] for f in families))
+    unique = {f: embeddings[f][first_rows] for f in families}
+    specs = np.arange(len(first_rows))
+
+    cached = {}
+    if matrices is not None:
+        for f in families:
+            scores = cached_family_scores(matrices, f, families, len(specs),
+                                          lambda f=f: family_tiles(unique, [f], specs, specs)[f])
+            if scores is not None:
+                cached[f] = scores
+
+    def tiles(rows, cols):
+        fam_tiles = family_tiles(unique, [f for f in families if f not in cached], rows, cols)
+        fam_tiles.update({f: np.asarray(scores[rows, cols]) for f, scores in cached.items()})
+        return [combine_tiles(fam_tiles, w) for w in scenario_w]
+
+    state = blocked_topk_many(
+        tiles, len(scenarios), len(specs), top_n,
+        block_size=block_size, symmetric=True, self_score=-np.inf,
+    )
+    return {
+        s['name']: expand_topk(spec_idx, spec_scores, pair_scores(unique, w, specs, specs), inverse, top_n)
+        for s, w, (spec_idx, spec_scores) in zip(scenarios, scenario_w, state)
+    }
 
 # computig weighted cosine similarity for different feature sets
-def vectorized_similarity(feature_df, top_n=3, weights=None, use_features=None):
-    if weights is None:
-        weights = {'dimensional':0.4,'grade_properties':0.3,'categorical':0.3}
-    if use_features is None:
-        use_features = ['dimensional','grade_properties','categorical']
-
-    df = feature_df.copy()
-    n = len(df)
-    sim_matrices = {}
-
-    # Dimensional similarity
-    if 'dimensional' in use_features:
-        dim_cols = ['thickness_min','thickness_max','width_min','width_max','weight_min','weight_max']
-        dim_matrix = df[dim_cols].fillna(0).values
-        dim_matrix = MinMaxScaler().fit_transform(dim_matrix)
-        sim_matrices['dimensional'] = cosine_similarity(dim_matrix)
-    else:
-        sim_matrices['dimensional'] = np.zeros((n,n))
-
-    # Grade similarity
-    if 'grade_properties' in use_features:
-        grade_cols = [col for col in df.columns if '_mid' in col]
-        grade_matrix = df[grade_cols].fillna(0).values
-        grade_matrix = MinMaxScaler().fit_transform(grade_matrix)
-        sim_matrices['grade_properties'] = cosine_similarity(grade_matrix)
-    else:
-        sim_matrices['grade_properties'] = np.zeros((n,n))
-
-    # Categorical similarity
-    if 'categorical' in use_features:
-        cat_cols = ['coating','finish','form','surface_type','surface_protection']
-        cat_matrix = pd.get_dummies(df[cat_cols], dummy_na=True)
-        sim_matrices['categorical'] = cosine_similarity(cat_matrix)
-    else:
-        sim_matrices['categorical'] = np.zeros((n,n))
-
-    # Aggregate similarity
-    aggregate_sim = np.zeros((n,n))
-    for key in use_features:
-        aggregate_sim += sim_matrices[key] * weights.get(key,0)
-
-    np.fill_diagonal(aggregate_sim, 0)
-
-    results = []
-    for i, rfq_id in enumerate(df['id']):
-        top_indices = aggregate_sim[i].argsort()[::-1][:top_n]
-        for idx in top_indices:
-            results.append({
-                'rfq_id': rfq_id,
-                'match_id': df.iloc[idx]['id'],
-                'similarity_score': aggregate_sim[i, idx]
-            })
-    return pd.DataFrame(results)
+def vectorized_similarity(feature_df, top_n=3, weights=None, use_features=None, block_size=1024):
+    scenario = {'name': 'custom', 'use_features': use_features, 'weights': weights}
+    top_idx, top_scores = scenario_topk(feature_df, [scenario], top_n, block_size)['custom']
+    return topk_frame(feature_df['id'].values, top_idx, top_scores)
+
+# scenario_topk over the feature matrices through the similarity cache. Only the
+# scenarios without a cached result are computed; those weighted exactly like the
+# stored weighted embedding are scored by one GEMM, as in rfq_similarity.compute_top3,
+# so they share its cache entry.
+def cached_scenario_topk(matrices, scenarios, top_n=3, block_size=1024):
+    results, missing = {}, []
+    for s in scenarios:
+        weights, label = scenario_weights(s), f"top-{top_n} {s['name']}"
+        if weights == matrices['weights']:
+            results[s['name']] = cached_topk(matrices, weights, top_n,
+                                             lambda: weighted_topk(matrices['weighted'], top_n, block_size), label)
+            continue
+        cached = lookup_topk(matrices, weights, top_n, label)
+        if cached is not None:
+            results[s['name']] = cached
+        else:
+            missing.append(s)
+
+    if missing:
+        computed = scenario_topk(None, missing, top_n, block_size, matrices=matrices)
+        for s in missing:
+            results[s['name']] = computed[s['name']]
+            store_topk(matrices, scenario_weights(s), top_n, *computed[s['name']], label=f"top-{top_n} {s['name']}")
+    return results
 
 # -------------------------
 # Main compute + average similarity (evaluaates different ablation scenarios)
 # -------------------------
-def compute_and_report(rfq_file, reference_file, inventory_file, output_dir='outputs', ablation=False):
+def compute_and_report(rfq_file, reference_file, output_dir='outputs', ablation=False, scenarios=None):
     print("Loading data...")
-    rfqs = pd.read_csv(rfq_file)
-    references = pd.read_csv(reference_file, sep='\t')
-    inventory = pd.read_csv(inventory_file)
+    matrices = load_feature_matrices(rfq_file, reference_file, output_dir=output_dir)
 
-    rfqs['grade_normalized'] = rfqs['grade'].apply(normalize_grade_keys)
-    references['grade_normalized'] = references['Grade/Material'].apply(normalize_grade_keys)
-    merged_df = rfqs.merge(references, on='grade_normalized', how='left', suffixes=('','_ref'))
-
-    feature_df = engineer_features(merged_df)
-
-    scenarios = [
-        {'name':'all_features','use_features':['dimensional','grade_properties','categorical'],'weights':{'dimensional':0.4,'grade_properties':0.3,'categorical':0.3}},
-        {'name':'dimensions_only','use_features':['dimensional'],'weights':{'dimensional':1.0}},
-        {'name':'grade_only','use_features':['grade_properties'],'weights':{'grade_properties':1.0}},
-        {'name':'categorical_only','use_features':['categorical'],'weights':{'categorical':1.0}},
-        {'name':'adjusted_weights','use_features':['dimensional','grade_properties','categorical'],'weights':{'dimensional':0.5,'grade_properties':0.2,'categorical':0.3}}
-    ]
+    if scenarios is None:
+        scenarios = SCENARIOS
 
     os.makedirs(output_dir, exist_ok=True)
 
+    print(f"Calculating top-3 for {len(scenarios)} scenarios: {', '.join(s['name'] for s in scenarios)}...")
+    with stage("similarity", rows_in=matrices['rows'], scenarios=len(scenarios)):
+        results = cached_scenario_topk(matrices, scenarios)
+
     avg_scores = {}
+    ids = matrices['ids']
     for scenario in scenarios:
-        print(f"Calculating top-3 for scenario: {scenario['name']}...")
-        top3_df = vectorized_similarity(feature_df, use_features=scenario['use_features'], weights=scenario['weights'])
+        top_idx, top_scores = results[scenario['name']]
         out_path = os.path.join(output_dir, f"top3_{scenario['name']}.csv")
-        top3_df.to_csv(out_path, index=False)
-        avg_scores[scenario['name']] = top3_df['similarity_score'].mean()
+        write_topk(out_path, ids, top_idx, top_scores)
+        avg_scores[scenario['name']] = top_scores.mean()
 
     print("\nAverage similarity scores:")
     for s, score in avg_scores.items():
@@ -99,6 +128,93 @@ def compute_and_report(rfq_file, reference_file, inventory_file, output_dir='out
 
     return avg_scores
 
+# -------------------------
+# Weight sweep (grid / random search over family weights)
+# -------------------------
+# All (dimensional, grade_properties, categorical) weights on a simplex grid
+def weight_grid(step=0.1):
+    steps = int(round(1 / step))
+    configs = []
+    for d, g in itertools.product(range(steps + 1), repeat=2):
+        if d + g <= steps:
+            configs.append(dict(zip(DEFAULT_FEATURES, [d / steps, g / steps, (steps - d - g) / steps])))
+    return configs
+
+# Random weight vectors drawn uniformly from the simplex
+def random_weights(n_samples, seed=42):
+    samples = np.random.default_rng(seed).dirichlet(np.ones(len(DEFAULT_FEATURES)), size=n_samples)
+    return [dict(zip(DEFAULT_FEATURES, row)) for row in samples]
+
+_SWEEP_STATE = {}
+
+# Workers map the feature matrices themselves (one shared physical copy)
+def _init_sweep_worker(matrix_dir, ref_idx, top_n, block_size):
+    embeddings = open_feature_matrices(matrix_dir)['embeddings']
+    _SWEEP_STATE.update(embeddings=embeddings, ref_idx=ref_idx, top_n=top_n, block_size=block_size)
+
+# Top-k of every weight config: family tiles are computed once per block and each
+# config's score tile is combined from them, so a config scores the same whichever
+# chunk it is evaluated in
+def _sweep_topk(embeddings, configs, top_n, block_size, n_rows):
+    def tiles(rows, cols):
+        fam_tiles = family_tiles(embeddings, DEFAULT_FEATURES, rows, cols)
+        return [combine_tiles(fam_tiles, {f: config.get(f, 0) for f in DEFAULT_FEATURES}) for config in configs]
+
+    return blocked_topk_many(tiles, len(configs), n_rows, top_n, block_size=block_size, symmetric=True, self_score=0.0)
+
+# Evaluate a chunk of weight configs against the reference top-k
+def _sweep_chunk(configs):
+    embeddings, ref_idx = _SWEEP_STATE['embeddings'], _SWEEP_STATE['ref_idx']
+    top_n, block_size = _SWEEP_STATE['top_n'], _SWEEP_STATE['block_size']
+    state = _sweep_topk(embeddings, configs, top_n, block_size, len(ref_idx))
+
+    rows = []
+    for config, (top_idx, top_scores) in zip(configs, state):
+        k = top_idx.shape[1]
+        overlap = (top_idx[:, :, None] == ref_idx[:, None, :]).any(axis=2).sum(axis=1) / max(k, 1)
+        rows.append({
+            **config,
+            'avg_score': top_scores.mean(),
+            'top1_agreement': (top_idx[:, 0] == ref_idx[:, 0]).mean(),
+            'overlap_at_k': overlap.mean(),
+        })
+    return rows
+
+# Average top-k score and rank stability (vs. the default weights) per weight config.
+# The reference is scored by the same engine as the configs, so the default weights
+# agree with it exactly. Configs are spread across a process pool in chunks of chunk_size.
+def weight_sweep(matrices, configs, top_n=3, block_size=256, n_jobs=None, chunk_size=16):
+    (ref_idx, _), = _sweep_topk(matrices['embeddings'], [DEFAULT_WEIGHTS], top_n, block_size, matrices['rows'])
+
+    chunks = [configs[i:i + chunk_size] for i in range(0, len(configs), chunk_size)]
+    initargs = (matrices['path'], ref_idx, top_n, block_size)
+    if n_jobs == 1:
+        _init_sweep_worker(*initargs)
+        results = map(_sweep_chunk, chunks)
+    else:
+        pool = ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_sweep_worker, initargs=initargs)
+        with pool:
+            results = list(pool.map(_sweep_chunk, chunks))
+
+    return pd.DataFrame([row for chunk in results for row in chunk])
+
+def run_weight_sweep(rfq_file, reference_file, output_dir='outputs', step=0.1, n_samples=None, n_jobs=None):
+    print("Loading data...")
+    matrices = load_feature_matrices(rfq_file, reference_file, output_dir=output_dir)
+
+    configs = random_weights(n_samples) if n_samples else weight_grid(step)
+    print(f"Sweeping {len(configs)} weight configurations...")
+    summary = weight_sweep(matrices, configs, n_jobs=n_jobs)
+
+    os.makedirs(output_dir, exist_ok=True)
+    out_path = os.path.join(output_dir, "weight_sweep.csv")
+    summary.to_csv(out_path, index=False)
+
+    print("\nTop configurations by average similarity:")
+    print(summary.sort_values('avg_score', ascending=False).head(10).round(3).to_string(index=False))
+    print(f"[✓] Saved {out_path}")
+    return summary
+
 # -------------------------
 # Run script
 # -------------------------
@@ -106,7 +222,6 @@ if __name__ == "__main__":
     compute_and_report(
         rfq_file="data/rfq.csv",
         reference_file="data/reference_properties.tsv",
-        inventory_file="outputs/inventory_dataset.csv",
         output_dir="outputs",
         ablation=True
     )
@@ -2,9 +2,19 @@
 import os
 import pandas as pd
 import numpy as np
-from sklearn.preprocessing import MinMaxScaler
+from sklearn.preprocessing import MinMaxScaler, normalize
 from sklearn.metrics.pairwise import cosine_similarity
-from src.rfq_similarity import engineer_features, normalize_grade_keys
+from src.feature_store import load_feature_frame, load_feature_matrices
+from src.topk import blocked_topk, topk_frame, pairs_topk, pairs_frame
+from src.interval_index import corpus_candidates
+from src.dedupe import spec_groups, dedupe_topk
+from src.topk_output import write_topk, write_result_frame
+from src.result_cache import cached_topk
+from src.instrumentation import stage, timed
+
+HYBRID_WEIGHTS = {'dimensional': 0.2, 'grade': 0.6, 'categorical': 0.2}
+HYBRID_RANGES = [('thickness_min', 'thickness_max'), ('width_min', 'width_max'), ('weight_min', 'weight_max')]
+HYBRID_CAT_COLS = ['coating', 'finish', 'form', 'surface_type']
 # -------------------------------
 # Alternative metrics
 # -------------------------------
@@ -34,15 +44,28 @@ def iou_range(min1, max1, min2, max2):
 
     return iou
 
+# Broadcast version of iou_range (same overlap / union / midpoint-distance fallback)
+def iou_range_array(min1, max1, min2, max2):
+    overlap = np.maximum(0, np.minimum(max1, max2) - np.maximum(min1, min2))
+    union = np.maximum(max1, max2) - np.minimum(min1, min2)
+    valid = ~(np.isnan(min1) | np.isnan(max1) | np.isnan(min2) | np.isnan(max2)) & (union > 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        iou = overlap / union
+        fallback = 1 / (1 + np.abs((min1 + max1) / 2 - (min2 + max2) / 2))
+    iou = np.where(iou == 0, fallback, iou)
+    return np.where(valid, iou, 0.0)
+
 
 def cosine_numeric_similarity(df, cols):
     matrix = df[cols].fillna(0).values
     matrix = MinMaxScaler().fit_transform(matrix)
     return cosine_similarity(matrix)
 
+# Reference (pairwise Python loop) implementation, kept for parity checks
 def hybrid_similarity(feature_df, top_n=3, weights=None):
     if weights is None:
-        weights = {'dimensional': 0.2, 'grade': 0.6, 'categorical': 0.2}
+        weights = HYBRID_WEIGHTS
 
     n = len(feature_df)
     results = []
@@ -85,37 +108,131 @@ def hybrid_similarity(feature_df, top_n=3, weights=None):
 
     return pd.DataFrame(results)
 
+# Column arrays used by the vectorized hybrid engine
+def hybrid_arrays(feature_df):
+    grade_cols = [c for c in feature_df.columns if '_mid' in c]
+    grade_matrix = MinMaxScaler().fit_transform(feature_df[grade_cols].fillna(0).values)
+
+    # Integer-coded categoricals (-1 = missing, never equal)
+    cat_codes = np.stack([pd.factorize(feature_df[c])[0] for c in HYBRID_CAT_COLS], axis=1)
+
+    return {
+        'ranges': [feature_df[[lo, hi]].to_numpy(dtype=float) for lo, hi in HYBRID_RANGES],
+        'grade': normalize(grade_matrix),
+        'cat_codes': cat_codes,
+    }
+
+# The hybrid arrays restricted to `rows`
+def hybrid_subset(arrays, rows):
+    return {
+        'ranges': [rng[rows] for rng in arrays['ranges']],
+        'grade': arrays['grade'][rows],
+        'cat_codes': arrays['cat_codes'][rows],
+    }
+
+# Hybrid scores for broadcastable row indices `left` / `right` (a tile when they
+# are shaped (b, 1) / (1, m), explicit pairs when both are 1-D)
+def _hybrid_scores(arrays, left, right, grade_cos, weights):
+    with timed("family.dimensional"):
+        dim_iou = 0.0
+        for rng in arrays['ranges']:
+            dim_iou = dim_iou + iou_range_array(rng[left, 0], rng[left, 1], rng[right, 0], rng[right, 1])
+        dim_iou = dim_iou / len(arrays['ranges'])
+
+    with timed("family.categorical"):
+        a, b = arrays['cat_codes'][left], arrays['cat_codes'][right]
+        matches = (a == b) & (a >= 0)
+        cat_jacc = matches.sum(axis=-1) / a.shape[-1]
+
+    with timed("combine"):
+        return (weights['dimensional'] * dim_iou +
+                weights['grade'] * grade_cos +
+                weights['categorical'] * cat_jacc)
+
+# Hybrid scores for one (rows, cols) tile
+def hybrid_tile(arrays, rows, cols, weights):
+    left = np.arange(rows.start, rows.stop)[:, None]
+    right = np.arange(cols.start, cols.stop)[None, :]
+    with timed("family.grade"):
+        grade_cos = arrays['grade'][rows] @ arrays['grade'][cols].T
+    return _hybrid_scores(arrays, left, right, grade_cos, weights)
+
+# Hybrid scores for explicit (row, col) pairs
+def hybrid_pairs(arrays, rows, cols, weights):
+    with timed("family.grade"):
+        grade_cos = np.einsum('ij,ij->i', arrays['grade'][rows], arrays['grade'][cols])
+    return _hybrid_scores(arrays, rows, cols, grade_cos, weights)
+
+# Vectorized hybrid_similarity: broadcast IoU / equality over block tiles and a
+# running argpartition top-k (self excluded), same scores and tie order as the reference.
+# With tolerance set, only interval-index candidates (overlapping ranges) are scored.
+def vectorized_hybrid_similarity(feature_df, top_n=3, weights=None, block_size=512, tolerance=None, dedupe=True):
+    if weights is None:
+        weights = HYBRID_WEIGHTS
+
+    with stage("embed", rows_in=len(feature_df), metric="hybrid"):
+        arrays = hybrid_arrays(feature_df)
+
+    with stage("similarity", rows_in=len(feature_df), metric="hybrid") as record:
+        if tolerance is not None:
+            rows, cols = corpus_candidates(feature_df, tolerance)
+            record["pairs"] = len(rows)
+            scores = hybrid_pairs(arrays, rows, cols, weights)
+            result = pairs_frame(feature_df['id'].values, *pairs_topk(rows, cols, scores, top_n))
+        else:
+            # Rows with identical ranges, grade vector and codes are scored once
+            first_rows, inverse, _ = spec_groups(*arrays['ranges'], arrays['grade'], arrays['cat_codes']) \
+                if dedupe else (None, None, None)
+            if first_rows is not None and len(first_rows) < len(feature_df):
+                record["unique_specs"] = len(first_rows)
+                unique = hybrid_subset(arrays, first_rows)
+                specs = np.arange(len(first_rows))
+                top_idx, top_scores = dedupe_topk(
+                    lambda rows, cols: hybrid_tile(unique, rows, cols, weights),
+                    hybrid_pairs(unique, specs, specs, weights), inverse, top_n,
+                    block_size=block_size, self_score=-np.inf,
+                )
+            else:
+                top_idx, top_scores = blocked_topk(
+                    lambda rows, cols: hybrid_tile(arrays, rows, cols, weights),
+                    len(feature_df), top_n, block_size=block_size, symmetric=True, self_score=-np.inf,
+                )
+            result = topk_frame(feature_df['id'].values, top_idx, top_scores)
+        record["rows_out"] = len(result)
+    return result
+
 # -------------------------------
 # Main Scenario C Function
 # -------------------------------
-def compute_alternative_metrics(rfq_file, reference_file, output_dir="outputs"):
+# Returns the baseline and hybrid top-3 frames; with as_arrays=True the baseline
+# comes back as its (top_idx, top_scores) arrays instead
+def compute_alternative_metrics(rfq_file, reference_file, output_dir="outputs", as_arrays=False):
     print("Loading data...")
-    rfqs = pd.read_csv(rfq_file)
-    references = pd.read_csv(reference_file, sep='\t')
-
-    rfqs['grade_normalized'] = rfqs['grade'].apply(normalize_grade_keys)
-    references['grade_normalized'] = references['Grade/Material'].apply(normalize_grade_keys)
-
-    merged_df = rfqs.merge(references, on='grade_normalized', how='left', suffixes=('', '_ref'))
-    feature_df = engineer_features(merged_df)
+    feature_df = load_feature_frame(rfq_file, reference_file, output_dir=output_dir)
 
-    # Baseline cosine similarity
+    # Baseline cosine similarity (the scenario B result, usually from the similarity cache)
     print("Calculating baseline cosine similarity...")
-    from src.rfq_similarity import vectorized_similarity
-    baseline_df = vectorized_similarity(feature_df)
-    baseline_df.to_csv(os.path.join(output_dir, "top3_baseline.csv"), index=False)
+    from src.rfq_similarity import weighted_topk
+    matrices = load_feature_matrices(rfq_file, reference_file, output_dir=output_dir)
+    with stage("similarity", rows_in=matrices['rows'], mode="exact") as record:
+        top_idx, top_scores = cached_topk(matrices, matrices['weights'], 3,
+                                          lambda: weighted_topk(matrices['weighted']), label="top-3 baseline")
+        record["rows_out"] = top_idx.size
+    write_topk(os.path.join(output_dir, "top3_baseline.csv"), matrices['ids'], top_idx, top_scores)
 
     # Hybrid alternative similarity
     print("Calculating hybrid similarity (Cosine + Jaccard + IoU)...")
-    hybrid_df = hybrid_similarity(feature_df)
-    hybrid_df.to_csv(os.path.join(output_dir, "top3_hybrid.csv"), index=False)
+    hybrid_df = vectorized_hybrid_similarity(feature_df)
+    write_result_frame(hybrid_df, os.path.join(output_dir, "top3_hybrid.csv"))
 
     # Compare average scores
     print("\nAverage similarity scores:")
-    print(f"Baseline (cosine only): {baseline_df['similarity_score'].mean():.3f}")
+    print(f"Baseline (cosine only): {top_scores.mean():.3f}")
     print(f"Hybrid (cosine+jaccard+IoU): {hybrid_df['similarity_score'].mean():.3f}")
 
-    return baseline_df, hybrid_df
+    if as_arrays:
+        return (top_idx, top_scores), hybrid_df
+    return topk_frame(matrices['ids'], top_idx, top_scores), hybrid_df
 
 # -------------------------------
 # Script entry point
@@ -0,0 +1,229 @@
+import os
+import time
+import pickle
+import numpy as np
+import pandas as pd
+from sklearn.cluster import KMeans
+from src.feature_store import load_feature_matrices, feature_key
+from src.rfq_similarity import transform_families, weighted_embedding, gemm_tile
+from src.topk import select_topk, merge_topk
+from src.topk_output import write_topk
+from src.instrumentation import stage
+
+# -------------------------------
+# IVF approximate nearest neighbours
+# -------------------------------
+# The corpus is partitioned with KMeans into n_lists inverted lists. Partitions
+# live in the weighted embedding space (rfq_similarity.weighted_embedding: family
+# blocks scaled by sqrt(weight) and concatenated), where the squared distance to
+# a centroid tracks the weighted cosine score. A query is scored exactly, one
+# matrix product per probed list, against the members of its nprobe nearest
+# lists only; nprobe = n_lists is an exhaustive search. The index (encoders,
+# centroids, list-ordered weighted embedding) is persisted in
+# <output_dir>/.ann_index and tagged with the feature store key it was built from.
+
+ANN_INDEX_DIRNAME = ".ann_index"
+DEFAULT_NPROBE = 4
+RECALL_NPROBES = [1, 2, 4, 8, 16]
+
+
+def default_n_lists(n_rows):
+    return max(1, int(round(np.sqrt(n_rows))))
+
+
+# Built from the feature matrices (load_feature_matrices): their encoders and
+# stored weighted embedding (re-weighted when other weights are asked for)
+def build_ivf_index(matrices, n_lists=None, weights=None, key=None):
+    n = matrices["rows"]
+    n_lists = min(n_lists or default_n_lists(n), n)
+
+    if weights is None or weights == matrices["weights"]:
+        weights, weighted = matrices["weights"], np.asarray(matrices["weighted"])
+    else:
+        weighted = weighted_embedding(matrices["embeddings"], matrices["encoders"], weights)
+    encoders = {family: matrices["encoders"][family] for family in weights}
+
+    kmeans = KMeans(n_clusters=n_lists, random_state=42, n_init="auto")
+    assignment = kmeans.fit_predict(weighted)
+
+    # Members of each list are contiguous and keep corpus order inside the list,
+    # so ties inside a list still break by the lower corpus row
+    order = np.argsort(assignment, kind="stable")
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(assignment, minlength=n_lists))))
+    return {
+        "key": key,
+        "weights": weights,
+        "encoders": encoders,
+        "ids": np.array(matrices["ids"]),
+        "centroids": kmeans.cluster_centers_,
+        "order": order,
+        "offsets": offsets,
+        "weighted": weighted[order],
+    }
+
+
+def save_index(index, index_dir):
+    os.makedirs(index_dir, exist_ok=True)
+    tmp_path = os.path.join(index_dir, f"arrays.{os.getpid()}.tmp.npz")
+    np.savez(tmp_path, centroids=index["centroids"], order=index["order"], offsets=index["offsets"],
+             weighted=index["weighted"])
+    os.replace(tmp_path, os.path.join(index_dir, "arrays.npz"))
+
+    meta = {key: index[key] for key in ["key", "weights", "encoders", "ids"]}
+    with open(os.path.join(index_dir, "index.pkl"), "wb") as fh:
+        pickle.dump(meta, fh)
+
+
+def load_index(index_dir):
+    meta_path = os.path.join(index_dir, "index.pkl")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, "rb") as fh:
+        index = pickle.load(fh)
+    with np.load(os.path.join(index_dir, "arrays.npz")) as arrays:
+        if "weighted" not in arrays.files:  # built by an older version
+            return None
+        for name in ["centroids", "order", "offsets", "weighted"]:
+            index[name] = arrays[name]
+    return index
+
+
+# Weighted embedding of new rows under the index's fitted encoders
+def encode_queries(index, query_df):
+    return weighted_embedding(transform_families(query_df, index["encoders"]), index["encoders"], index["weights"])
+
+
+# nprobe nearest lists per query (squared L2 to the centroids)
+def probe_lists(index, query_weighted, nprobe):
+    centroids = index["centroids"]
+    nprobe = min(nprobe, len(centroids))
+    distances = (centroids ** 2).sum(axis=1) - 2.0 * query_weighted @ centroids.T
+    if nprobe == len(centroids):
+        return np.broadcast_to(np.arange(len(centroids)), distances.shape)
+    return np.argpartition(distances, nprobe - 1, axis=1)[:, :nprobe]
+
+
+# Top-k corpus rows for each query, scoring only the probed lists. self_rows[i]
+# is the corpus row of query i (or -1); self pairs score 0.0 as in the exact
+# engine. Unfilled slots hold index n with score -inf. Returns
+# (top_idx, top_scores, n_scored_pairs).
+def search(index, query_weighted, k=3, nprobe=DEFAULT_NPROBE, self_rows=None, block_size=1024):
+    order, offsets = index["order"], index["offsets"]
+    n = len(order)
+    n_queries = len(query_weighted)
+    k = min(k, n)
+    probes = probe_lists(index, query_weighted, nprobe)
+
+    top_idx = np.full((n_queries, k), n, dtype=np.int64)
+    top_scores = np.full((n_queries, k), -np.inf)
+    n_scored = 0
+
+    for q0 in range(0, n_queries, block_size):
+        queries = np.arange(q0, min(q0 + block_size, n_queries))
+        block_probes = probes[queries]
+        for lst in np.unique(block_probes):
+            start, stop = offsets[lst], offsets[lst + 1]
+            members = queries[(block_probes == lst).any(axis=1)]
+            if start == stop or len(members) == 0:
+                continue
+
+            tile = gemm_tile(query_weighted[members], index["weighted"][start:stop])
+            cols = order[start:stop]
+            if self_rows is not None:
+                tile[self_rows[members][:, None] == cols[None, :]] = 0.0
+
+            cand_pos, cand_scores = select_topk(tile, k)
+            top_idx[members], top_scores[members] = merge_topk(
+                top_idx[members], top_scores[members], cols[cand_pos], cand_scores, k
+            )
+            n_scored += tile.size
+
+    return top_idx, top_scores, n_scored
+
+
+# Approximate top-k for every corpus row: (top_idx, top_scores, n_scored_pairs)
+def ann_topk(index, top_n=3, nprobe=DEFAULT_NPROBE, block_size=1024):
+    n = len(index["order"])
+    corpus_weighted = np.empty_like(index["weighted"])
+    corpus_weighted[index["order"]] = index["weighted"]
+    return search(index, corpus_weighted, top_n, nprobe, self_rows=np.arange(n), block_size=block_size)
+
+
+# -------------------------------
+# Recall against the exact top-k
+# -------------------------------
+# Exact results are read positionally from top3.csv (k rows per corpus row, in
+# corpus order). recall@k is tie-aware: an approximate neighbour is a hit when
+# its score reaches the exact k-th score (within tol). id_recall
+# counts exact ids found.
+def exact_topk_lists(exact_df, ids, k):
+    if len(exact_df) != len(ids) * k or not (exact_df["rfq_id"].to_numpy() == np.repeat(ids, k)).all():
+        raise ValueError("exact results do not line up with the corpus; rerun scenario B")
+    return exact_df["match_id"].to_numpy().reshape(-1, k), exact_df["similarity_score"].to_numpy().reshape(-1, k)
+
+
+def recall_at_k(index, top_idx, top_scores, exact_ids, exact_scores, tol=1e-6):
+    found = top_idx < len(index["order"])
+    hits = (found & (top_scores >= exact_scores[:, -1:] - tol)).sum(axis=1)
+    approx_ids = np.where(found, index["ids"][np.minimum(top_idx, len(index["ids"]) - 1)], None)
+    id_hits = (exact_ids[:, :, None] == approx_ids[:, None, :]).any(axis=2).sum(axis=1)
+    k = exact_ids.shape[1]
+    return float(np.minimum(hits, k).mean() / k), float(id_hits.mean() / k)
+
+
+def recall_report(index, exact_df, top_n=3, nprobes=None):
+    exact_ids, exact_scores = exact_topk_lists(exact_df, index["ids"], top_n)
+    n_lists, n = len(index["centroids"]), len(index["order"])
+    nprobes = sorted({p for p in (nprobes or RECALL_NPROBES) if p < n_lists} | {n_lists})
+
+    rows = []
+    for nprobe in nprobes:
+        start = time.perf_counter()
+        top_idx, top_scores, n_scored = ann_topk(index, top_n, nprobe)
+        seconds = time.perf_counter() - start
+        recall, id_recall = recall_at_k(index, top_idx, top_scores, exact_ids, exact_scores)
+        rows.append({
+            "nprobe": nprobe,
+            f"recall@{top_n}": recall,
+            f"id_recall@{top_n}": id_recall,
+            "scored_fraction": n_scored / (n * n),
+            "ms_per_query": 1000 * seconds / n,
+        })
+    return pd.DataFrame(rows)
+
+
+# -------------------------------
+# Main ANN function
+# -------------------------------
+def compute_top3_ann(rfq_file, reference_file, output_dir="outputs", nprobe=DEFAULT_NPROBE, n_lists=None,
+                     exact_file="top3.csv", output_file="top3_ann.csv", rebuild=False, top_n=3):
+    index_dir = os.path.join(output_dir, ANN_INDEX_DIRNAME)
+    key = feature_key(rfq_file, reference_file)
+    index = None if rebuild else load_index(index_dir)
+
+    if index is None or index["key"] != key or (n_lists and len(index["centroids"]) != n_lists):
+        matrices = load_feature_matrices(rfq_file, reference_file, output_dir=output_dir)
+        print(f"Building IVF index ({n_lists or default_n_lists(matrices['rows'])} lists)...")
+        index = build_ivf_index(matrices, n_lists=n_lists, key=key)
+        save_index(index, index_dir)
+        print(f"[✓] Stored IVF index in {index_dir}")
+    else:
+        print(f"Loading IVF index from {index_dir}...")
+
+    print(f"Searching top-{top_n} with nprobe={nprobe}/{len(index['centroids'])}...")
+    with stage("similarity", rows_in=len(index["order"]), mode="ivf", nprobe=nprobe) as record:
+        top_idx, top_scores, record["pairs"] = ann_topk(index, top_n, nprobe)
+    out_path = os.path.join(output_dir, output_file)
+    write_topk(out_path, index["ids"], top_idx, top_scores)
+    print(f"[✓] Saved {out_path}")
+
+    exact_path = os.path.join(output_dir, exact_file)
+    if os.path.exists(exact_path):
+        report = recall_report(index, pd.read_csv(exact_path), top_n)
+        report_path = os.path.join(output_dir, "ann_recall.csv")
+        report.to_csv(report_path, index=False)
+        print(report.round(4).to_string(index=False))
+        print(f"[✓] Saved {report_path}")
+    else:
+        print(f"No exact results at {exact_path}; skipping the recall report")
+    return top_idx, top_scores
@@ -0,0 +1,252 @@
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import resource
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from src.synthetic_data import write_synthetic_dataset
+
+# -------------------------------
+# Synthetic-scale benchmarks
+# -------------------------------
+# Every (stage, size) runs in a fresh worker process with its peak RSS reset,
+# so the measurement is not inflated by earlier runs. Setup (loading inputs,
+# building the feature store) is done before the clock starts and only the
+# stage call itself is timed.
+# Results are compared with a stored baseline; a stage is flagged when it is
+# slower or larger than the baseline by more than the tolerance.
+
+BENCH_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+BENCH_DATA_DIRNAME = ".bench_data"
+BASELINE_FILE = "benchmark_baseline.json"
+TOLERANCE = 0.25
+MIN_SECONDS = 0.05  # differences below this are timer noise
+
+
+# Reset the peak RSS of this process to its current RSS (Linux); a forked
+# worker otherwise inherits the parent's high-water mark
+def _reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as fh:
+            fh.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss_mb():
+    try:
+        with open("/proc/self/status") as fh:
+            for line in fh:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+# --- stage setup / run functions (executed in the benchmark worker) ---
+
+def _feature_frame(paths):
+    from src.feature_store import build_feature_frame
+    return build_feature_frame(paths["rfq_file"], paths["reference_file"])
+
+
+def _run_engineer_features(paths, _):
+    from src.feature_store import build_feature_frame
+    return len(build_feature_frame(paths["rfq_file"], paths["reference_file"]))
+
+
+def _run_vectorized_similarity(paths, feature_df):
+    from src.rfq_similarity import vectorized_similarity
+    vectorized_similarity(feature_df)
+    return len(feature_df)
+
+
+def _feature_matrices(paths):
+    from src.feature_store import load_feature_matrices
+    return load_feature_matrices(paths["rfq_file"], paths["reference_file"], output_dir=paths["output_dir"])
+
+
+def _run_matrix_similarity(paths, matrices):
+    from src.rfq_similarity import weighted_topk
+    weighted_topk(matrices["weighted"])
+    return matrices["rows"]
+
+
+# The same top-k from per-family tiles (one product per family plus weighted adds)
+def _run_family_similarity(paths, matrices):
+    from src.rfq_similarity import embedding_topk
+    embedding_topk(matrices["embeddings"])
+    return matrices["rows"]
+
+
+def _run_hybrid_similarity(paths, feature_df):
+    from src.alternative_metrics import vectorized_hybrid_similarity
+    vectorized_hybrid_similarity(feature_df)
+    return len(feature_df)
+
+
+def _run_hybrid_reference(paths, feature_df):
+    from src.alternative_metrics import hybrid_similarity
+    hybrid_similarity(feature_df)
+    return len(feature_df)
+
+
+def _prepare_store(paths):
+    from src.feature_store import load_feature_frame
+    load_feature_frame(paths["rfq_file"], paths["reference_file"], output_dir=paths["output_dir"])
+
+
+def _run_cluster_rfqs(paths, _):
+    from src.clustering import cluster_rfqs
+    return len(cluster_rfqs(paths["rfq_file"], paths["reference_file"], output_dir=paths["output_dir"]))
+
+
+def _clear_ingest_cache(paths):
+    from src.data_cleaning import INGEST_CACHE_DIRNAME
+    shutil.rmtree(os.path.join(paths["output_dir"], INGEST_CACHE_DIRNAME), ignore_errors=True)
+
+
+def _run_supplier_cleaning(paths, _):
+    from src.data_cleaning import run_supplier_cleaning
+    run_supplier_cleaning(input_dir=paths["data_dir"], output_dir=paths["output_dir"])
+    return paths["rows"]
+
+
+# name -> (setup, run, largest size to run); run returns the rows processed.
+# The pairwise stages are quadratic, so they stop at smaller sizes.
+BENCH_STAGES = {
+    "engineer_features": (None, _run_engineer_features, None),
+    "vectorized_similarity": (_feature_frame, _run_vectorized_similarity, 100_000),
+    "matrix_similarity": (_feature_matrices, _run_matrix_similarity, 100_000),
+    "family_similarity": (_feature_matrices, _run_family_similarity, 100_000),
+    "hybrid_similarity": (_feature_frame, _run_hybrid_similarity, 10_000),
+    "hybrid_similarity_reference": (_feature_frame, _run_hybrid_reference, 1_000),
+    "cluster_rfqs": (_prepare_store, _run_cluster_rfqs, None),
+    "run_supplier_cleaning": (_clear_ingest_cache, _run_supplier_cleaning, None),
+    "run_supplier_cleaning_cached": (None, _run_supplier_cleaning, None),
+}
+
+# The pairwise reference loop takes minutes even at 1k rows; run it explicitly
+DEFAULT_STAGES = [stage for stage in BENCH_STAGES if stage != "hybrid_similarity_reference"]
+
+
+def _bench_worker(stage, paths):
+    setup, run, _ = BENCH_STAGES[stage]
+    _reset_peak_rss()
+    with contextlib.redirect_stdout(io.StringIO()):
+        state = setup(paths) if setup else None
+        start = time.perf_counter()
+        rows = run(paths, state)
+        seconds = time.perf_counter() - start
+    return {"seconds": seconds, "rows": rows, "peak_rss_mb": _peak_rss_mb()}
+
+
+def run_stage(stage, paths):
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        return pool.submit(_bench_worker, stage, paths).result()
+
+
+# "1k,10k,1m" -> [1000, 10000, 1000000]
+def parse_sizes(text):
+    units = {"k": 1_000, "m": 1_000_000}
+    sizes = []
+    for part in text.lower().split(","):
+        part = part.strip()
+        if part:
+            sizes.append(int(float(part[:-1]) * units[part[-1]]) if part[-1] in units else int(part))
+    return sizes
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as fh:
+        return json.load(fh)
+
+
+# Flag runs slower (or larger) than baseline * (1 + tolerance)
+def flag_regressions(results, baseline, tolerance=TOLERANCE):
+    flags = []
+    for row in results.itertuples():
+        ref = baseline.get(f"{row.stage}@{row.rows}")
+        if ref is None or row.status != "ok":
+            flags.append("")
+            continue
+        reasons = []
+        if row.seconds > ref["seconds"] * (1 + tolerance) and row.seconds - ref["seconds"] > MIN_SECONDS:
+            reasons.append(f"time +{row.seconds / ref['seconds'] - 1:.0%}")
+        if row.peak_rss_mb > ref["peak_rss_mb"] * (1 + tolerance):
+            reasons.append(f"rss +{row.peak_rss_mb / ref['peak_rss_mb'] - 1:.0%}")
+        flags.append(", ".join(reasons))
+    return flags
+
+
+# -------------------------------
+# Main benchmark function
+# -------------------------------
+def run_benchmarks(sizes=None, stages=None, input_dir="data", output_dir="outputs", baseline_file=None,
+                   save_baseline=False, tolerance=TOLERANCE, seed=42):
+    sizes = sizes or BENCH_SIZES[:2]
+    stages = stages or DEFAULT_STAGES
+    bench_dir = os.path.join(output_dir, BENCH_DATA_DIRNAME)
+    baseline_path = baseline_file or os.path.join(output_dir, BASELINE_FILE)
+
+    records = []
+    for size in sizes:
+        data_dir = write_synthetic_dataset(size, os.path.join(bench_dir, f"data-{size}"), input_dir, seed)
+        paths = {
+            "rows": size,
+            "data_dir": data_dir,
+            "rfq_file": os.path.join(data_dir, "rfq.csv"),
+            "reference_file": os.path.join(data_dir, "reference_properties.tsv"),
+            "output_dir": os.path.join(bench_dir, f"out-{size}"),
+        }
+        os.makedirs(paths["output_dir"], exist_ok=True)
+
+        for stage in stages:
+            limit = BENCH_STAGES[stage][2]
+            record = {"stage": stage, "rows": size, "status": "ok", "seconds": float("nan"),
+                      "peak_rss_mb": float("nan"), "rows_per_second": float("nan")}
+            if limit is not None and size > limit:
+                record["status"] = f"skipped (> {limit} rows)"
+            else:
+                try:
+                    result = run_stage(stage, paths)
+                    record.update(seconds=result["seconds"], peak_rss_mb=result["peak_rss_mb"],
+                                  rows_per_second=result["rows"] / max(result["seconds"], 1e-9))
+                except Exception as exc:
+                    record["status"] = f"failed: {exc}"
+            print(f"{stage:<30}{size:>10}  {record['status']:<24}{record['seconds']:>10.3f}s"
+                  f"{record['peak_rss_mb']:>10.1f} MB")
+            records.append(record)
+
+    results = pd.DataFrame(records)
+    baseline = load_baseline(baseline_path)
+    results["regression"] = flag_regressions(results, baseline, tolerance)
+
+    out_path = os.path.join(output_dir, "benchmark_results.csv")
+    results.to_csv(out_path, index=False)
+    print(f"[✓] Saved {out_path}")
+
+    regressions = results[results["regression"] != ""]
+    for row in regressions.itertuples():
+        print(f"[!] Regression in {row.stage} @ {row.rows} rows: {row.regression}")
+    if baseline and regressions.empty:
+        print(f"No regressions against {baseline_path}")
+
+    if save_baseline:
+        ok = results[results["status"] == "ok"]
+        baseline.update({
+            f"{row.stage}@{row.rows}": {"seconds": row.seconds, "peak_rss_mb": row.peak_rss_mb}
+            for row in ok.itertuples()
+        })
+        with open(baseline_path, "w") as fh:
+            json.dump(baseline, fh, indent=2, sort_keys=True)
+        print(f"[✓] Saved baseline {baseline_path}")
+    return results
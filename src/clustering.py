@@ -1,70 +1,300 @@
 import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
+from scipy import sparse
 from sklearn.preprocessing import MinMaxScaler
-from sklearn.cluster import KMeans
-from src.rfq_similarity import engineer_features, normalize_grade_keys
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.metrics import silhouette_score
+from src.feature_store import (
+    load_feature_frame, load_feature_matrices, build_feature_frame, feature_frame_path, iter_frame_chunks,
+)
+from src.instrumentation import stage, write_csv
 
-def cluster_rfqs(rfq_file, reference_file, output_dir="outputs", n_clusters=4):
-    print("Loading RFQ and reference data...")
-    rfqs = pd.read_csv(rfq_file)
-    references = pd.read_csv(reference_file, sep="\t")
+# -------------------------------
+# Clustering modes
+# -------------------------------
+# "full" fits KMeans on the whole encoded corpus. "minibatch" streams the
+# feature store in chunks: one pass fits the scaler and categorical levels,
+# n_epochs passes feed MiniBatchKMeans.partial_fit, and a final pass assigns
+# labels, so memory stays O(chunk_rows * d). Either way the fitted encoder and
+# centroids are persisted in <output_dir>/.cluster_model and assign_rfqs puts
+# new RFQs into families (nearest centroid, O(k * d) per RFQ) without refitting.
 
-    # Normalize grades
-    rfqs["grade_normalized"] = rfqs["grade"].apply(normalize_grade_keys)
-    references["grade_normalized"] = references["Grade/Material"].apply(normalize_grade_keys)
+DIM_COLS = ["thickness_min", "thickness_max", "width_min", "width_max", "weight_min", "weight_max"]
+CAT_COLS = ["coating", "finish", "form", "surface_type"]
 
-    # Merge reference properties
-    merged_df = rfqs.merge(references, on="grade_normalized", how="left", suffixes=("", "_ref"))
+CLUSTER_MODEL_DIRNAME = ".cluster_model"
+CHUNK_ROWS = 4096
+N_EPOCHS = 5
 
-    print("Engineering features...")
-    feature_df = engineer_features(merged_df)
 
-    # Select numeric + dimensional + categorical columns
-    num_cols = [c for c in feature_df.columns if c.endswith("_min") or c.endswith("_max") or c.endswith("_mid")]
-    dim_cols = ["thickness_min", "thickness_max", "width_min", "width_max", "weight_min", "weight_max"]
-    cat_cols = ["coating", "finish", "form", "surface_type"]
+def _numeric_cols(columns):
+    return [c for c in columns if c.endswith("_min") or c.endswith("_max") or c.endswith("_mid")]
 
-    # Encode numeric features
-    num_matrix = feature_df[num_cols + dim_cols].fillna(0).values
-    num_matrix = MinMaxScaler().fit_transform(num_matrix)
 
-    # Encode categorical features
-    cat_matrix = pd.get_dummies(feature_df[cat_cols].fillna("unknown")).values
+# Fit the numeric scaler and categorical levels over a stream of chunks
+def fit_cluster_encoder(chunks):
+    scaler, levels, num_cols = MinMaxScaler(), None, None
+    for chunk in chunks:
+        if num_cols is None:
+            num_cols = _numeric_cols(chunk.columns)
+            levels = {col: set() for col in CAT_COLS}
+        scaler.partial_fit(chunk[num_cols + DIM_COLS].fillna(0).values)
+        for col in CAT_COLS:
+            levels[col].update(chunk[col].fillna("unknown").unique())
+    return {"num_cols": num_cols, "scaler": scaler, "levels": {col: sorted(v) for col, v in levels.items()}}
 
-    # Combine numeric + categorical
-    X = pd.DataFrame(
-        MinMaxScaler().fit_transform(
-            pd.concat([pd.DataFrame(num_matrix), pd.DataFrame(cat_matrix)], axis=1)
-        )
-    )
 
-    print(f"Clustering into {n_clusters} families...")
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init="auto")
-    feature_df["cluster"] = kmeans.fit_predict(X)
+# Scaled numeric features + sparse one-hot categoricals (CSR, built from level
+# codes); levels unseen at fit time encode as all zeros
+def encode_clusters(df, encoder):
+    num_matrix = encoder["scaler"].transform(df[encoder["num_cols"] + DIM_COLS].fillna(0).values)
+    codes = [pd.Categorical(df[col].fillna("unknown"), categories=encoder["levels"][col]).codes for col in CAT_COLS]
+    return _cluster_matrix(num_matrix, codes, encoder)
 
-    os.makedirs(output_dir, exist_ok=True)
-    out_path = os.path.join(output_dir, "rfq_clusters.csv")
-    feature_df[["id", "cluster"]].to_csv(out_path, index=False)
-    print(f"[✓] Saved clustering results to {out_path}\n")
 
-    # -------------------------
-    # Insights
-    # -------------------------
+def _cluster_matrix(num_matrix, codes, encoder):
+    rows, cols, offset = [], [], num_matrix.shape[1]
+    for col, col_codes in zip(CAT_COLS, codes):
+        col_codes = np.asarray(col_codes, dtype=np.int64)
+        known = np.flatnonzero(col_codes >= 0)
+        rows.append(known)
+        cols.append(offset + col_codes[known])
+        offset += len(encoder["levels"][col])
+
+    num_rows, num_cols = np.nonzero(num_matrix)
+    rows = np.concatenate([num_rows] + rows)
+    cols = np.concatenate([num_cols] + cols)
+    data = np.concatenate([num_matrix[num_rows, num_cols], np.ones(len(rows) - len(num_rows), dtype=num_matrix.dtype)])
+    return sparse.csr_matrix((data, (rows, cols)), shape=(num_matrix.shape[0], offset))
+
+
+# Encoder and KMeans input straight from the feature matrices
+# (feature_store.load_feature_matrices); the categorical levels and codes are
+# the stored ones, so new RFQs still encode through encode_clusters
+def encode_feature_matrices(matrices):
+    num_cols = matrices["numeric_cols"]
+    numeric = matrices["numeric"][:, [num_cols.index(col) for col in num_cols + DIM_COLS]]
+    cat_enc = matrices["encoders"]["categorical"]
+    encoder = {
+        "num_cols": num_cols,
+        "scaler": MinMaxScaler().fit(numeric),
+        "levels": {col: list(cat_enc["levels"][col]) for col in CAT_COLS},
+    }
+    stored_codes = matrices["embeddings"]["categorical"]
+    codes = [stored_codes[:, cat_enc["cols"].index(col)] for col in CAT_COLS]
+    return encoder, _cluster_matrix(encoder["scaler"].transform(numeric), codes, encoder)
+
+
+def save_model(model, model_dir):
+    os.makedirs(model_dir, exist_ok=True)
+    tmp_path = os.path.join(model_dir, f"model.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as fh:
+        pickle.dump(model, fh)
+    os.replace(tmp_path, os.path.join(model_dir, "model.pkl"))
+
+
+def load_model(model_dir):
+    path = os.path.join(model_dir, "model.pkl")
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as fh:
+        return pickle.load(fh)
+
+
+# Nearest centroid by ||x||^2 - 2 x.c + ||c||^2 (||x||^2 is constant per row)
+def assign_to_centroids(X, centroids):
+    distances = (centroids ** 2).sum(axis=1) - 2.0 * X @ centroids.T
+    return distances.argmin(axis=1)
+
+
+# -------------------------
+# Insights
+# -------------------------
+def print_insights(cluster_counts, cluster_avg, cluster_cat_summary):
     print("Generating cluster insights...\n")
 
     # 1. Cluster sizes
-    cluster_counts = feature_df['cluster'].value_counts().sort_index()
     print("Number of RFQs per cluster:")
     print(cluster_counts, "\n")
 
     # 2. Average numeric features per cluster
-    cluster_avg = feature_df.groupby('cluster')[num_cols + dim_cols].mean().round(2)
     print("Average numeric features per cluster:")
     print(cluster_avg, "\n")
 
     # 3. Most common categorical features per cluster
-    cluster_cat_summary = feature_df.groupby('cluster')[cat_cols].agg(lambda x: x.mode()[0])
     print("Most common categorical features per cluster:")
     print(cluster_cat_summary, "\n")
 
+
+# Per-cluster counts, numeric sums and categorical level counts, accumulated chunk by chunk
+def _accumulate_insights(stats, chunk, labels, num_cols):
+    chunk = chunk.assign(cluster=labels)
+    grouped = chunk.groupby("cluster")
+    stats["counts"].append(grouped.size())
+    stats["sums"].append(grouped[num_cols + DIM_COLS].sum())
+    stats["non_null"].append(grouped[num_cols + DIM_COLS].count())
+    for col in CAT_COLS:
+        stats["levels"].setdefault(col, []).append(chunk.groupby(["cluster", col]).size())
+
+
+def _finish_insights(stats):
+    cluster_counts = pd.concat(stats["counts"]).groupby(level=0).sum().sort_index().rename("count")
+    cluster_counts.index.name = "cluster"
+    sums = pd.concat(stats["sums"]).groupby(level=0).sum()
+    non_null = pd.concat(stats["non_null"]).groupby(level=0).sum()
+    cluster_avg = (sums / non_null.replace(0, np.nan)).round(2)
+
+    modes = {}
+    for col, parts in stats["levels"].items():
+        counts = pd.concat(parts).groupby(level=[0, 1]).sum().rename("n").reset_index()
+        # Most frequent level, ties to the smallest level (as Series.mode()[0])
+        counts = counts.sort_values(["cluster", "n", col], ascending=[True, False, True])
+        modes[col] = counts.drop_duplicates("cluster").set_index("cluster")[col]
+    cluster_cat_summary = pd.DataFrame(modes)[CAT_COLS]
+    return cluster_counts, cluster_avg, cluster_cat_summary
+
+
+def _fit_full(matrices, n_clusters):
+    encoder, X = encode_feature_matrices(matrices)
+
+    print(f"Clustering into {n_clusters} families...")
+    kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init="auto")
+    labels = kmeans.fit_predict(X)
+    return encoder, kmeans.cluster_centers_, labels
+
+
+def _fit_minibatch(data_path, n_clusters, chunk_rows, n_epochs):
+    encoder = fit_cluster_encoder(iter_frame_chunks(data_path, chunk_rows))
+
+    print(f"Clustering into {n_clusters} families (mini-batch, {n_epochs} epochs of {chunk_rows}-row chunks)...")
+    kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, batch_size=chunk_rows, n_init=3)
+    pending = None
+    for _ in range(n_epochs):
+        for chunk in iter_frame_chunks(data_path, chunk_rows):
+            X = encode_clusters(chunk, encoder)
+            # partial_fit needs at least n_clusters rows; carry short chunks over
+            if pending is not None:
+                X, pending = sparse.vstack([pending, X], format="csr"), None
+            if X.shape[0] < n_clusters:
+                pending = X
+                continue
+            kmeans.partial_fit(X)
+    if pending is not None and hasattr(kmeans, "cluster_centers_"):
+        kmeans.partial_fit(pending)
+    if not hasattr(kmeans, "cluster_centers_"):
+        raise ValueError(f"Need at least {n_clusters} RFQs to form {n_clusters} clusters")
+    return encoder, kmeans.cluster_centers_
+
+
+def cluster_rfqs(rfq_file, reference_file, output_dir="outputs", n_clusters=4, mode="full",
+                 chunk_rows=CHUNK_ROWS, n_epochs=N_EPOCHS):
+    os.makedirs(output_dir, exist_ok=True)
+    out_path = os.path.join(output_dir, "rfq_clusters.csv")
+
+    if mode == "full":
+        feature_df = load_feature_frame(rfq_file, reference_file, output_dir=output_dir)
+        matrices = load_feature_matrices(rfq_file, reference_file, output_dir=output_dir)
+        with stage("cluster_fit", rows_in=len(feature_df), mode=mode, n_clusters=n_clusters):
+            encoder, centroids, labels = _fit_full(matrices, n_clusters)
+        feature_df["cluster"] = labels
+        write_csv(feature_df[["id", "cluster"]], out_path, index=False)
+
+        num_cols = encoder["num_cols"]
+        insights = (
+            feature_df['cluster'].value_counts().sort_index(),
+            feature_df.groupby('cluster')[num_cols + DIM_COLS].mean().round(2),
+            feature_df.groupby('cluster')[CAT_COLS].agg(lambda x: x.mode()[0]),
+        )
+    elif mode == "minibatch":
+        data_path = feature_frame_path(rfq_file, reference_file, output_dir=output_dir)
+        with stage("cluster_fit", mode=mode, n_clusters=n_clusters):
+            encoder, centroids = _fit_minibatch(data_path, n_clusters, chunk_rows, n_epochs)
+
+        # Final pass: assign labels and stream them out
+        stats = {"counts": [], "sums": [], "non_null": [], "levels": {}}
+        tmp_path = f"{out_path}.{os.getpid()}.tmp"
+        for i, chunk in enumerate(iter_frame_chunks(data_path, chunk_rows)):
+            labels = assign_to_centroids(encode_clusters(chunk, encoder), centroids)
+            chunk.assign(cluster=labels)[["id", "cluster"]].to_csv(tmp_path, mode="w" if i == 0 else "a",
+                                                                  header=i == 0, index=False)
+            _accumulate_insights(stats, chunk, labels, encoder["num_cols"])
+        os.replace(tmp_path, out_path)
+        insights = _finish_insights(stats)
+        feature_df = None
+    else:
+        raise ValueError(f"Unknown clustering mode: {mode}")
+
+    save_model({"mode": mode, "n_clusters": n_clusters, "encoder": encoder, "centroids": centroids},
+               os.path.join(output_dir, CLUSTER_MODEL_DIRNAME))
+    print(f"[✓] Saved clustering results to {out_path}\n")
+
+    print_insights(*insights)
     return feature_df
+
+
+# -------------------------------
+# Assign new RFQs with the persisted model
+# -------------------------------
+def assign_rfqs(rfq_file, reference_file, output_dir="outputs", output_file="rfq_clusters_assigned.csv"):
+    model = load_model(os.path.join(output_dir, CLUSTER_MODEL_DIRNAME))
+    if model is None:
+        raise FileNotFoundError(f"No cluster model in {output_dir}; run the clustering first")
+
+    feature_df = build_feature_frame(rfq_file, reference_file)
+    with stage("cluster_assign", rows_in=len(feature_df)):
+        feature_df["cluster"] = assign_to_centroids(encode_clusters(feature_df, model["encoder"]), model["centroids"])
+
+    out_path = os.path.join(output_dir, output_file)
+    write_csv(feature_df[["id", "cluster"]], out_path, index=False)
+    print(f"Assigned {len(feature_df)} RFQs to {model['n_clusters']} families")
+    print(f"[✓] Saved {out_path}")
+    return feature_df
+
+
+# -------------------------------
+# n_clusters sweep
+# -------------------------------
+_SWEEP_X = None
+
+
+def _init_sweep_worker(X):
+    global _SWEEP_X
+    _SWEEP_X = X
+
+
+def _sweep_one(n_clusters, mode, sample_size):
+    X = _SWEEP_X
+    if mode == "minibatch":
+        kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, batch_size=CHUNK_ROWS, n_init=3)
+    else:
+        kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init="auto")
+    labels = kmeans.fit_predict(X)
+    inertia = float(-kmeans.score(X))
+    n_labels = len(np.unique(labels))
+    silhouette = (silhouette_score(X, labels, sample_size=min(sample_size, X.shape[0]), random_state=42)
+                  if 1 < n_labels < X.shape[0] else np.nan)
+    return {"n_clusters": n_clusters, "inertia": inertia, "silhouette": silhouette}
+
+
+def sweep_n_clusters(rfq_file, reference_file, output_dir="outputs", k_values=range(2, 11), mode="full",
+                     sample_size=2000, n_jobs=None):
+    _, X = encode_feature_matrices(load_feature_matrices(rfq_file, reference_file, output_dir=output_dir))
+    k_values = [k for k in k_values if k < X.shape[0]]
+
+    print(f"Sweeping n_clusters over {k_values} ({mode})...")
+    if n_jobs == 1:
+        _init_sweep_worker(X)
+        rows = [_sweep_one(k, mode, sample_size) for k in k_values]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_sweep_worker, initargs=(X,)) as pool:
+            rows = list(pool.map(_sweep_one, k_values, [mode] * len(k_values), [sample_size] * len(k_values)))
+
+    results = pd.DataFrame(rows)
+    out_path = os.path.join(output_dir, "cluster_sweep.csv")
+    results.to_csv(out_path, index=False)
+    print(results.round(4).to_string(index=False))
+    print(f"[✓] Saved {out_path}")
+    return results
@@ -1,107 +1,259 @@
 import os
+import json
+import shutil
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
-import numpy as np
+from src.feature_store import file_digest, read_frame, write_frame, STORE_FORMAT
+from src.instrumentation import stage
 
-def run_supplier_cleaning(input_dir="data", output_dir="outputs"):
-    """
-    Clean and join supplier datasets into inventory_dataset.csv
-    """
+# -------------------------------
+# Supplier adapters
+# -------------------------------
+# Each supplier is described by an adapter: its workbook, the sheets to read,
+# the mapping from its column names to the unified inventory columns and which
+# columns are numeric (optionally with decimal commas) or normalized strings.
+# New suppliers are onboarded with register_supplier, without touching the
+# cleaning code.
 
-    # Load supplier files
-    s1 = pd.read_excel(os.path.join(input_dir, "supplier_data1.xlsx"))
-    s2 = pd.read_excel(os.path.join(input_dir, "supplier_data2.xlsx"))
-
-    # --- Supplier 1 ---
-    s1["Thickness (mm)"] = (
-        s1["Thickness (mm)"].replace(",", ".", regex=True).astype(float)
-    )
-    s1["Width (mm)"] = (
-        s1["Width (mm)"].replace(",", ".", regex=True).astype(float)
-    )
-    s1["Gross weight (kg)"] = s1["Gross weight (kg)"].astype(float)
-
-    s1_clean = s1.rename(
-        columns={
-            "Quality/Choice": "quality_choice",
-            "Grade": "grade",
-            "Finish": "finish",
-            "Thickness (mm)": "thickness_mm",
-            "Width (mm)": "width_mm",
-            "Description": "description",
-            "Gross weight (kg)": "gross_weight_kg",
-            "Quantity": "quantity",
-            "RP02": "RP02",
-            "RM": "RM",
-            "AG": "AG",
-            "AI": "AI",
-        }
-    )
+SUPPLIER_ADAPTERS = {}
+
+# Unified inventory layout (column order of inventory_dataset.csv)
+COMMON_COLUMNS = [
+    "source",
+    "article_id",
+    "quality_choice",
+    "grade",
+    "finish",
+    "thickness_mm",
+    "width_mm",
+    "description",
+    "gross_weight_kg",
+    "quantity",
+    "reserved",
+    "RP02",
+    "RM",
+    "AG",
+    "AI",
+]
+# Numeric inventory columns are written as float, whatever the supplier's dtype
+FLOAT_COLUMNS = ["article_id", "thickness_mm", "width_mm", "gross_weight_kg", "quantity", "RP02", "RM", "AG", "AI"]
+
+INGEST_CACHE_DIRNAME = ".ingest_cache"
+INGEST_CACHE_VERSION = 2
+CHUNK_ROWS = 50_000
+
+
+def register_supplier(name, file, columns, decimal_comma=(), numeric=(), upper=(), sheets=(0,)):
+    SUPPLIER_ADAPTERS[name] = {
+        "file": file,
+        "sheets": list(sheets),
+        "columns": dict(columns),
+        "decimal_comma": list(decimal_comma),
+        "numeric": list(numeric),
+        "upper": list(upper),
+    }
+
+
+register_supplier(
+    "supplier1",
+    file="supplier_data1.xlsx",
+    columns={
+        "Quality/Choice": "quality_choice",
+        "Grade": "grade",
+        "Finish": "finish",
+        "Thickness (mm)": "thickness_mm",
+        "Width (mm)": "width_mm",
+        "Description": "description",
+        "Gross weight (kg)": "gross_weight_kg",
+        "Quantity": "quantity",
+        "RP02": "RP02",
+        "RM": "RM",
+        "AG": "AG",
+        "AI": "AI",
+    },
+    decimal_comma=["thickness_mm", "width_mm"],
+    numeric=["gross_weight_kg"],
+    upper=["quality_choice", "grade", "finish"],
+)
+
+register_supplier(
+    "supplier2",
+    file="supplier_data2.xlsx",
+    columns={
+        "Material": "grade",
+        "Description": "description",
+        "Article ID": "article_id",
+        "Weight (kg)": "gross_weight_kg",
+        "Quantity": "quantity",
+        "Reserved": "reserved",
+    },
+    numeric=["gross_weight_kg"],
+    upper=["grade", "reserved"],
+)
 
-    # String normalization
-    for col in ["quality_choice", "grade", "finish"]:
-        if col in s1_clean.columns:
-            s1_clean[col] = s1_clean[col].astype(str).str.strip().str.upper()
-
-    s1_clean["source"] = "supplier1"
-
-    # --- Supplier 2 ---
-    s2["Weight (kg)"] = s2["Weight (kg)"].astype(float)
-    s2_clean = s2.rename(
-        columns={
-            "Material": "grade",
-            "Description": "description",
-            "Article ID": "article_id",
-            "Weight (kg)": "gross_weight_kg",
-            "Quantity": "quantity",
-            "Reserved": "reserved",
-        }
-    )
+
+# Apply an adapter to one parsed sheet: rename, numeric parsing, string
+# normalization, then align to the unified columns
+def apply_adapter(name, adapter, raw):
+    clean = raw.rename(columns=adapter["columns"])
+
+    for col in adapter["decimal_comma"]:
+        clean[col] = clean[col].replace(",", ".", regex=True).astype(float)
+    for col in adapter["numeric"]:
+        clean[col] = clean[col].astype(float)
 
     # String normalization
-    for col in ["grade", "reserved"]:
-        if col in s2_clean.columns:
-            s2_clean[col] = s2_clean[col].astype(str).str.strip().str.upper()
-
-    # Add missing columns for Supplier 2
-    s2_clean["thickness_mm"] = np.nan
-    s2_clean["width_mm"] = np.nan
-    s2_clean["finish"] = np.nan
-    s2_clean["quality_choice"] = np.nan
-    s2_clean["RP02"] = np.nan
-    s2_clean["RM"] = np.nan
-    s2_clean["AG"] = np.nan
-    s2_clean["AI"] = np.nan
-    s2_clean["source"] = "supplier2"
-
-    # Align columns
-    common_cols = [
-        "source",
-        "article_id",
-        "quality_choice",
-        "grade",
-        "finish",
-        "thickness_mm",
-        "width_mm",
-        "description",
-        "gross_weight_kg",
-        "quantity",
-        "reserved",
-        "RP02",
-        "RM",
-        "AG",
-        "AI",
-    ]
-    s1_final = s1_clean.reindex(columns=common_cols)
-    s2_final = s2_clean.reindex(columns=common_cols)
-
-    # Merge datasets
-    inventory = pd.concat([s1_final, s2_final], ignore_index=True)
+    for col in adapter["upper"]:
+        if col in clean.columns:
+            clean[col] = clean[col].astype(str).str.strip().str.upper()
+
+    clean["source"] = name
+    clean = clean.reindex(columns=COMMON_COLUMNS)
+    for col in FLOAT_COLUMNS:
+        if pd.api.types.is_numeric_dtype(clean[col]):
+            clean[col] = clean[col].astype(float)
+    return clean
+
+
+# -------------------------------
+# Cached sheet parsing
+# -------------------------------
+# The adapted frame of every sheet is cached in <output_dir>/.ingest_cache,
+# keyed by the workbook hash, the sheet and the adapter definition, so an
+# unchanged supplier file is never parsed again. Sheets are read row by row
+# with openpyxl in read-only mode and each entry is a directory of part files
+# of at most chunk_rows rows, so neither parsing nor writing the inventory
+# holds more than one chunk of a sheet in memory.
+
+def sheet_key(name, adapter, sheet, path):
+    digest = hashlib.sha256(str(INGEST_CACHE_VERSION).encode())
+    spec = json.dumps({"name": name, "sheet": sheet, "adapter": adapter}, sort_keys=True)
+    for part in [spec, file_digest(path), file_digest(__file__), STORE_FORMAT]:
+        digest.update(part.encode())
+    return digest.hexdigest()[:16]
+
+
+def _cache_path(cache_dir, name, sheet, key):
+    return os.path.join(cache_dir, f"{name}-{sheet}-{key}")
+
+
+# Rows of one sheet as frames of at most chunk_rows rows (first row is the
+# header; blank rows are skipped, as pd.read_excel does)
+def iter_sheet_chunks(path, sheet, chunk_rows=CHUNK_ROWS):
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        worksheet = workbook.worksheets[sheet] if isinstance(sheet, int) else workbook[sheet]
+        rows = worksheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [f"Unnamed: {i}" if col is None else col for i, col in enumerate(header)]
+        width, buffer = len(columns), []
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            buffer.append((tuple(row) + (None,) * width)[:width])  # read-only rows can be ragged
+            if len(buffer) == chunk_rows:
+                yield pd.DataFrame(buffer, columns=columns)
+                buffer = []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=columns)
+    finally:
+        workbook.close()
+
+
+def _part_paths(entry_dir):
+    return [os.path.join(entry_dir, part) for part in sorted(os.listdir(entry_dir))]
+
+
+# Worker: parse one sheet chunk by chunk, adapt each chunk and store it as a
+# part of the cache entry; returns the entry path
+def _parse_sheet(name, adapter, sheet, path, cache_path, chunk_rows=CHUNK_ROWS):
+    ext = "parquet" if STORE_FORMAT == "parquet" else "pkl"
+    tmp_dir = f"{cache_path}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for i, raw in enumerate(iter_sheet_chunks(path, sheet, chunk_rows)):
+        write_frame(apply_adapter(name, adapter, raw), os.path.join(tmp_dir, f"part-{i:05d}.{ext}"))
+    try:
+        os.replace(tmp_dir, cache_path)
+    except OSError:  # another process stored the same entry first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return cache_path
+
+
+# Remove cached parses of the same supplier sheet that are no longer current
+def _evict_sheets(cache_dir, current_paths):
+    current = {os.path.basename(path) for path in current_paths}
+    prefixes = {name.rsplit("-", 1)[0] + "-" for name in current}
+    for entry in os.listdir(cache_dir):
+        if entry not in current and any(entry.startswith(prefix) for prefix in prefixes):
+            entry_path = os.path.join(cache_dir, entry)
+            if os.path.isdir(entry_path):
+                shutil.rmtree(entry_path, ignore_errors=True)
+            else:
+                os.remove(entry_path)
+
+
+# Parse every registered supplier sheet (cache misses in parallel worker
+# processes); returns the cached frame paths in registry order
+def parse_suppliers(input_dir="data", output_dir="outputs", suppliers=None, jobs=None, chunk_rows=CHUNK_ROWS):
+    cache_dir = os.path.join(output_dir, INGEST_CACHE_DIRNAME)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    tasks, misses = [], []
+    for name in suppliers or list(SUPPLIER_ADAPTERS):
+        adapter = SUPPLIER_ADAPTERS[name]
+        path = os.path.join(input_dir, adapter["file"])
+        for sheet in adapter["sheets"]:
+            cache_path = _cache_path(cache_dir, name, sheet, sheet_key(name, adapter, sheet, path))
+            tasks.append(cache_path)
+            if not os.path.exists(cache_path):
+                misses.append((name, adapter, sheet, path, cache_path, chunk_rows))
+
+    print(f"Supplier sheets: {len(tasks)} total, {len(tasks) - len(misses)} cached, {len(misses)} to parse")
+    if len(misses) == 1 or jobs == 1:
+        for task in misses:
+            _parse_sheet(*task)
+    elif misses:
+        workers = min(jobs or os.cpu_count() or 1, len(misses))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(_parse_sheet, *zip(*misses)))
+
+    _evict_sheets(cache_dir, tasks)
+    return tasks
+
+
+# Stream the cached sheet parts into one CSV, one part at a time, instead of
+# concatenating everything in memory
+def write_inventory(sheet_paths, out_path):
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    # Header with UTF-8 BOM to preserve umlauts and special chars in Excel
+    pd.DataFrame(columns=COMMON_COLUMNS).to_csv(tmp_path, index=False, encoding="utf-8-sig")
+
+    n_rows = 0
+    for entry_dir in sheet_paths:
+        for part in _part_paths(entry_dir):
+            frame = read_frame(part)
+            frame.to_csv(tmp_path, mode="a", header=False, index=False, encoding="utf-8", na_rep="NaN")
+            n_rows += len(frame)
+    os.replace(tmp_path, out_path)
+    return n_rows
+
+
+def run_supplier_cleaning(input_dir="data", output_dir="outputs", jobs=None):
+    """
+    Clean and join supplier datasets into inventory_dataset.csv
+    """
+    with stage("load", suppliers=len(SUPPLIER_ADAPTERS)):
+        sheet_paths = parse_suppliers(input_dir, output_dir, jobs=jobs)
 
     # --- Export ---
     os.makedirs(output_dir, exist_ok=True)
     out_path = os.path.join(output_dir, "inventory_dataset.csv")
+    with stage("write_csv", file=os.path.basename(out_path)) as record:
+        n_rows = record["rows_out"] = write_inventory(sheet_paths, out_path)
 
-    # Save with UTF-8 BOM to preserve umlauts and special chars in Excel
-    inventory.to_csv(out_path, index=False, encoding="utf-8-sig", na_rep="NaN")
-
-    print(f"[✓] Saved {out_path}")
+    print(f"[✓] Saved {out_path} ({n_rows} rows)")
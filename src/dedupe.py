@@ -0,0 +1,84 @@
+import numpy as np
+from src.topk import blocked_topk, round_scores
+from src.instrumentation import timed
+
+# -------------------------------
+# Duplicate-spec canonicalization
+# -------------------------------
+# Many RFQs share one spec and differ only in id. spec_groups collapses rows
+# whose encoded features are byte-identical into unique specs (numbered in
+# order of first appearance) with multiplicities. The pairwise engines then
+# score unique specs only (u^2 instead of n^2 pairs) and dedupe_topk expands
+# the unique-level top-k back to one list per row.
+#
+# Tie handling: duplicates of a spec score the same against everything, so
+# equal scores are ordered by row index within a spec and by the spec's first
+# row across specs. This matches the row-index order of the plain engines
+# except when two *different* specs tie exactly and their rows interleave.
+
+
+# (first_rows, inverse, counts) of the rows of one or more (n, d) arrays;
+# first_rows[g] is the first row of spec g and inverse[i] the spec of row i
+def spec_groups(*arrays):
+    n = len(arrays[0])
+    row_bytes = np.hstack([np.ascontiguousarray(a).view(np.uint8).reshape(n, -1) for a in arrays])
+    keys = np.ascontiguousarray(row_bytes).view(np.dtype((np.void, row_bytes.shape[1]))).ravel()
+    _, first_rows, inverse, counts = np.unique(keys, return_index=True, return_inverse=True, return_counts=True)
+
+    # Renumber specs by first appearance, so spec order follows row order
+    order = np.argsort(first_rows, kind="stable")
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return first_rows[order], rank[inverse.ravel()], counts[order]
+
+
+# First `width` rows of every spec, ascending (padded with n); one extra
+# all-padding row at the end stands for "no spec"
+def spec_members(inverse, n_specs, width):
+    n = len(inverse)
+    order = np.argsort(inverse, kind="stable")
+    starts = np.concatenate(([0], np.cumsum(np.bincount(inverse, minlength=n_specs))[:-1]))
+    members = np.full((n_specs + 1, width), n, dtype=np.int64)
+    rank = np.arange(n) - starts[inverse[order]]
+    keep = rank < width
+    members[inverse[order][keep], rank[keep]] = order[keep]
+    return members
+
+
+# Row-level top-k from a unique-level engine. tile_fn(rows, cols) scores spec
+# slices against each other, spec_self[g] is the score between two duplicates
+# of spec g, and self_score is what a row scores against itself (0.0 keeps
+# self as a zero-score candidate like the plain engines, -inf excludes it).
+# Returns (top_idx, top_scores) over rows; unfilled slots hold n / -inf.
+def dedupe_topk(tile_fn, spec_self, inverse, k, block_size=1024, self_score=0.0):
+    spec_idx, spec_scores = blocked_topk(tile_fn, len(spec_self), k, block_size=block_size, symmetric=True,
+                                         self_score=-np.inf)
+    return expand_topk(spec_idx, spec_scores, spec_self, inverse, k, self_score)
+
+
+# Expand a unique-level top-k (self excluded) to rows
+def expand_topk(spec_idx, spec_scores, spec_self, inverse, k, self_score=0.0):
+    n, n_specs = len(inverse), len(spec_self)
+    k = max(0, min(k, n if self_score > -np.inf else n - 1))
+    k_specs = spec_idx.shape[1]
+
+    with timed("expand"):
+        members = spec_members(inverse, n_specs, k + 1)
+        # Candidates per spec: its own duplicates, then the members of its top specs
+        cand_idx = np.hstack([members[:n_specs], members[spec_idx, :k].reshape(n_specs, k_specs * k)])
+        cand_scores = np.hstack([
+            np.repeat(round_scores(np.asarray(spec_self, dtype=float))[:, None], k + 1, axis=1),
+            np.repeat(spec_scores, k, axis=1),
+        ])
+
+        rows = np.arange(n)
+        cand_idx, cand_scores = cand_idx[inverse], cand_scores[inverse]
+        cand_scores[(cand_idx == rows[:, None]) | (cand_idx == n)] = -np.inf
+        cand_idx = np.hstack([cand_idx, rows[:, None]])
+        cand_scores = np.hstack([cand_scores, np.full((n, 1), self_score)])
+
+        order = np.lexsort((cand_idx, -cand_scores), axis=1)[:, :k]
+        top_idx = np.take_along_axis(cand_idx, order, axis=1)
+        top_scores = np.take_along_axis(cand_scores, order, axis=1)
+        top_idx[top_scores == -np.inf] = n
+    return top_idx, top_scores
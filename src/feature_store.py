@@ -0,0 +1,319 @@
+import os
+import json
+import time
+import hashlib
+import pickle
+import shutil
+import importlib.util
+import numpy as np
+import pandas as pd
+from src import rfq_similarity
+from src import grade_resolution
+from src.instrumentation import stage
+from src.pipeline import file_digest
+from src.rfq_similarity import (
+    engineer_features, normalize_grade_keys, fit_family_encoders, transform_family_matrices, embed_matrices,
+    weighted_embedding, SIMILARITY_WEIGHTS,
+)
+from src.grade_resolution import build_grade_index, normalize_grade_column, resolve_grades, resolution_report
+
+# -------------------------------
+# Shared feature store
+# -------------------------------
+# The load -> normalize -> merge -> engineer_features pipeline is built once and
+# persisted under <output_dir>/.feature_store, keyed by a hash of the input
+# files and of the feature code. Every scenario loads the frame from there.
+# Next to each frame, load_feature_matrices keeps the fitted family encoders
+# and the encoded matrices as .npy files that are memory-mapped on load.
+
+FEATURE_STORE_DIRNAME = ".feature_store"
+FEATURE_STORE_VERSION = 1
+MAX_STORE_ENTRIES = 4
+
+# Parquet needs pyarrow; fall back to pickle when it is not installed
+STORE_FORMAT = "parquet" if importlib.util.find_spec("pyarrow") else "pickle"
+
+
+# Hash of the code that shapes the feature frame
+def code_version():
+    digest = hashlib.sha256(str(FEATURE_STORE_VERSION).encode())
+    for path in [rfq_similarity.__file__, grade_resolution.__file__, __file__]:
+        digest.update(file_digest(path).encode())
+    return digest.hexdigest()
+
+
+def feature_key(rfq_file, reference_file):
+    digest = hashlib.sha256()
+    for part in [file_digest(rfq_file), file_digest(reference_file), code_version(), STORE_FORMAT]:
+        digest.update(part.encode())
+    return digest.hexdigest()[:16]
+
+
+def load_references(reference_file):
+    with stage("load", file=os.path.basename(reference_file)) as record:
+        references = pd.read_csv(reference_file, sep="\t")
+        record["rows_out"] = len(references)
+    with stage("normalize_grades", rows_in=len(references)):
+        references["grade_normalized"] = references["Grade/Material"].apply(normalize_grade_keys)
+    return references
+
+
+# Load RFQs + reference properties, normalize grades, merge and engineer features
+def build_feature_frame(rfq_file, reference_file):
+    with stage("load", file=os.path.basename(rfq_file)) as record:
+        rfqs = pd.read_csv(rfq_file)
+        record["rows_out"] = len(rfqs)
+    references = load_references(reference_file)
+
+    feature_df = rfq_features(rfqs, references)
+    report = resolution_report(feature_df, feature_df["grade_normalized"])
+    print("Grade resolution: " + ", ".join(
+        f"{row.method} {row.share:.1%}" for row in report.itertuples() if row.rows
+    ))
+    return feature_df
+
+
+# Normalize grades, resolve them against the reference keys (grade_resolution),
+# merge reference properties and engineer features for raw RFQ rows. Pass a
+# prebuilt grade_index to reuse it (and its memo) across calls.
+def rfq_features(rfqs, references, grade_index=None):
+    if grade_index is None:
+        grade_index = build_grade_index(references)
+
+    with stage("normalize_grades", rows_in=len(rfqs)):
+        rfqs["grade_normalized"] = normalize_grade_column(rfqs["grade"])
+
+    with stage("resolve_grades", rows_in=len(rfqs)) as record:
+        resolved = resolve_grades(grade_index, rfqs["grade_normalized"], rfqs.get("grade_suffix"))
+        for col in resolved.columns:
+            rfqs[col] = resolved[col]
+        record["matched"] = int(resolved["grade_key"].notna().sum())
+
+    with stage("merge", rows_in=len(rfqs)) as record:
+        properties = references.rename(columns={"grade_normalized": "grade_key"})
+        merged_df = rfqs.merge(properties, on="grade_key", how="left", suffixes=("", "_ref"))
+        record["rows_out"] = len(merged_df)
+
+    with stage("engineer_features", rows_in=len(merged_df)) as record:
+        feature_df = engineer_features(merged_df)
+        record["rows_out"] = len(feature_df)
+    return feature_df
+
+
+# Non-exact grade resolutions of a feature frame, one row per unique grade
+def grade_resolution_table(feature_df):
+    fuzzy = feature_df[~feature_df["grade_match"].isin(["exact", "missing"])]
+    keys = [col for col in ["grade_normalized", "grade_suffix"] if col in fuzzy.columns]
+    table = fuzzy.groupby(keys, dropna=False).agg(
+        grade_key=("grade_key", "first"), grade_match=("grade_match", "first"),
+        grade_confidence=("grade_confidence", "first"), rows=("grade_match", "size"),
+    )
+    return table.reset_index().sort_values("rows", ascending=False)
+
+
+def _entry_paths(store_dir, key):
+    ext = "parquet" if STORE_FORMAT == "parquet" else "pkl"
+    return os.path.join(store_dir, f"features-{key}.{ext}"), os.path.join(store_dir, f"features-{key}.json")
+
+
+def _list_entries(store_dir):
+    entries = []
+    for name in os.listdir(store_dir):
+        if name.startswith("features-") and name.endswith(".json"):
+            meta_path = os.path.join(store_dir, name)
+            try:
+                with open(meta_path) as fh:
+                    meta = json.load(fh)
+            except (OSError, ValueError):
+                continue
+            entries.append(meta)
+    return entries
+
+
+def _remove_entry(store_dir, key):
+    for path in _entry_paths(store_dir, key):
+        if os.path.exists(path):
+            os.remove(path)
+    shutil.rmtree(_matrix_dir(store_dir, key), ignore_errors=True)
+
+
+# Drop entries built from older versions of the same inputs, then keep only the
+# max_entries most recently used ones
+def evict(store_dir, keep_key=None, inputs=None, max_entries=MAX_STORE_ENTRIES):
+    entries = _list_entries(store_dir)
+    live = []
+    for meta in entries:
+        if meta["key"] == keep_key:
+            live.append(meta)
+        elif inputs is not None and meta.get("inputs") == inputs:
+            _remove_entry(store_dir, meta["key"])
+        else:
+            live.append(meta)
+
+    data_path = lambda key: _entry_paths(store_dir, key)[0]
+    live = [m for m in live if os.path.exists(data_path(m["key"]))]
+    live.sort(key=lambda m: os.path.getmtime(data_path(m["key"])), reverse=True)
+    for meta in live[max_entries:]:
+        if meta["key"] != keep_key:
+            _remove_entry(store_dir, meta["key"])
+
+
+def read_frame(path, columns=None):
+    if STORE_FORMAT == "parquet":
+        return pd.read_parquet(path, columns=columns)
+    df = pd.read_pickle(path)
+    return df if columns is None else df[columns]
+
+
+# Yield a stored frame in chunks of chunk_rows (parquet row batches, so the
+# whole file is never in memory)
+def iter_frame_chunks(path, chunk_rows=65536):
+    if STORE_FORMAT == "parquet":
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        df = read_frame(path)
+        for start in range(0, len(df), chunk_rows):
+            yield df.iloc[start:start + chunk_rows]
+
+
+def write_frame(df, path):
+    tmp_path = f"{path}.{os.getpid()}.tmp"  # concurrent writers never share a temp file
+    if STORE_FORMAT == "parquet":
+        df.to_parquet(tmp_path, index=False)
+    else:
+        df.to_pickle(tmp_path)
+    os.replace(tmp_path, path)
+
+
+# Engineered feature frame for (rfq_file, reference_file), built at most once per input version
+def load_feature_frame(rfq_file, reference_file, output_dir="outputs", refresh=False):
+    store_dir = os.path.join(output_dir, FEATURE_STORE_DIRNAME)
+    os.makedirs(store_dir, exist_ok=True)
+
+    key = feature_key(rfq_file, reference_file)
+    data_path, meta_path = _entry_paths(store_dir, key)
+
+    if os.path.exists(data_path) and not refresh:
+        os.utime(data_path)  # mark as recently used
+        print(f"Loading features from store ({key})...")
+        with stage("load", file=os.path.basename(data_path)) as record:
+            feature_df = read_frame(data_path)
+            record["rows_out"] = len(feature_df)
+        return feature_df
+
+    print("Loading RFQ and reference data...")
+    feature_df = build_feature_frame(rfq_file, reference_file)
+
+    write_frame(feature_df, data_path)
+    table = grade_resolution_table(feature_df)
+    if len(table):
+        table_path = os.path.join(output_dir, "grade_resolution.csv")
+        table.to_csv(table_path, index=False)
+        print(f"[✓] Saved {table_path} ({len(table)} non-exact grades)")
+    inputs = [os.path.abspath(rfq_file), os.path.abspath(reference_file)]
+    with open(meta_path, "w") as fh:
+        json.dump({"key": key, "inputs": inputs, "rows": len(feature_df), "created": time.time()}, fh)
+    evict(store_dir, keep_key=key, inputs=inputs)
+
+    print(f"[✓] Stored features ({key}) in {store_dir}")
+    return feature_df
+
+
+# Path of the stored feature frame, building the entry first when it is missing
+def feature_frame_path(rfq_file, reference_file, output_dir="outputs"):
+    data_path, _ = _entry_paths(os.path.join(output_dir, FEATURE_STORE_DIRNAME), feature_key(rfq_file, reference_file))
+    if not os.path.exists(data_path):
+        load_feature_frame(rfq_file, reference_file, output_dir=output_dir)
+    return data_path
+
+
+# -------------------------------
+# Memory-mapped feature matrices
+# -------------------------------
+# One directory per store entry with contiguous arrays in row order:
+#   ids.npy                      fixed-width unicode ids (the row index)
+#   <family>.npy                 similarity embeddings: L2-normalised float64
+#                                dimensional / grade blocks, int32 categorical codes
+#   weighted.npy                 the families as one float64 vector per row, scaled
+#                                by sqrt(SIMILARITY_WEIGHTS) (rfq_similarity.weighted_embedding)
+#   numeric.npy                  engineered _min/_max/_mid columns, float64, NaN -> 0
+#   meta.pkl                     fitted family encoders, numeric column names, weights
+# Arrays are opened with mmap_mode="r", so loading costs no parsing and worker
+# processes on the same entry share one copy through the page cache.
+
+MATRIX_DTYPE = np.float64
+
+
+def _matrix_dir(store_dir, key):
+    return os.path.join(store_dir, f"matrices-{key}")
+
+
+def _numeric_columns(feature_df):
+    return [c for c in feature_df.columns if c.endswith(("_min", "_max", "_mid"))]
+
+
+def write_feature_matrices(feature_df, matrix_dir, key=None):
+    encoders = fit_family_encoders(feature_df)
+    embeddings = embed_matrices(transform_family_matrices(feature_df, encoders))
+    numeric_cols = _numeric_columns(feature_df)
+
+    tmp_dir = f"{matrix_dir}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    np.save(os.path.join(tmp_dir, "ids.npy"), feature_df["id"].to_numpy(dtype=str))
+    for family, emb in embeddings.items():
+        dtype = np.int32 if family == "categorical" else MATRIX_DTYPE
+        embeddings[family] = np.ascontiguousarray(emb, dtype=dtype)
+        np.save(os.path.join(tmp_dir, f"{family}.npy"), embeddings[family])
+    np.save(os.path.join(tmp_dir, "weighted.npy"), weighted_embedding(embeddings, encoders, SIMILARITY_WEIGHTS))
+    np.save(os.path.join(tmp_dir, "numeric.npy"), feature_df[numeric_cols].fillna(0).to_numpy(dtype=MATRIX_DTYPE))
+    meta = {"key": key, "rows": len(feature_df), "encoders": encoders, "numeric_cols": numeric_cols,
+            "weights": dict(SIMILARITY_WEIGHTS)}
+    with open(os.path.join(tmp_dir, "meta.pkl"), "wb") as fh:
+        pickle.dump(meta, fh)
+
+    try:
+        os.rename(tmp_dir, matrix_dir)
+    except OSError:  # another process stored the same entry first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+# {"ids", "embeddings": {family: array}, "weighted", "numeric", "numeric_cols", "encoders", "weights", "path"}
+def open_feature_matrices(matrix_dir):
+    with open(os.path.join(matrix_dir, "meta.pkl"), "rb") as fh:
+        meta = pickle.load(fh)
+    load = lambda name: np.load(os.path.join(matrix_dir, f"{name}.npy"), mmap_mode="r")
+    return {
+        **meta,
+        "path": matrix_dir,
+        "ids": load("ids"),
+        "numeric": load("numeric"),
+        "weighted": load("weighted"),
+        "embeddings": {family: load(family) for family in meta["encoders"]},
+    }
+
+
+# Feature matrices for (rfq_file, reference_file), encoded at most once per input version
+def load_feature_matrices(rfq_file, reference_file, output_dir="outputs", refresh=False):
+    store_dir = os.path.join(output_dir, FEATURE_STORE_DIRNAME)
+    key = feature_key(rfq_file, reference_file)
+    matrix_dir = _matrix_dir(store_dir, key)
+
+    data_path, _ = _entry_paths(store_dir, key)
+    if os.path.exists(data_path):
+        os.utime(data_path)  # the entry's recency is tracked on its frame
+
+    if refresh or not os.path.exists(os.path.join(matrix_dir, "meta.pkl")):
+        feature_df = load_feature_frame(rfq_file, reference_file, output_dir=output_dir, refresh=refresh)
+        if refresh:
+            shutil.rmtree(matrix_dir, ignore_errors=True)
+        with stage("encode_matrices", rows_in=len(feature_df)):
+            write_feature_matrices(feature_df, matrix_dir, key)
+        print(f"[✓] Stored feature matrices ({key}) in {matrix_dir}")
+
+    with stage("load", file=os.path.basename(matrix_dir)) as record:
+        matrices = open_feature_matrices(matrix_dir)
+        record["rows_out"] = matrices["rows"]
+    return matrices
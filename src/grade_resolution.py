@@ -0,0 +1,172 @@
+import numpy as np
+import pandas as pd
+from src.rfq_similarity import normalize_grade_keys
+
+# -------------------------------
+# Grade resolution index
+# -------------------------------
+# RFQ grades are joined to reference_properties.tsv on their normalized key.
+# Suffixed or variant spellings ("S250GD+Z", "S355J2G3", "304L") used to miss
+# the exact merge and fell back to an all-zero grade family. The index is built
+# once over the reference keys and resolves each *unique* RFQ grade (memoized
+# across calls) to its best reference key with a confidence:
+#
+#   exact    hash lookup of grade (+ grade_suffix when given)           1.0
+#   suffix   grade without its suffix / "+..." part                     0.95
+#   prefix   trie: longest reference key that prefixes the grade, or
+#            the shortest reference key the grade is a prefix of        len ratio
+#   ngram    character trigram inverted index, Dice coefficient         shared grams
+#
+# Fuzzy candidates (prefix, ngram) are accepted from min_confidence up; equal
+# confidences go to the reference key listed first. Work per call is one
+# factorize over the rows plus index lookups for grades not seen before.
+
+NGRAM = 3
+MIN_CONFIDENCE = 0.6
+SUFFIX_CONFIDENCE = 0.95
+METHODS = ["exact", "suffix", "prefix", "ngram", "unmatched", "missing"]
+
+
+def _ngrams(key):
+    padded = f"^{key}$"
+    return {padded[i:i + NGRAM] for i in range(len(padded) - NGRAM + 1)}
+
+
+# Trie nodes are dicts of char -> node; "" holds the id of a key ending at the
+# node and None the (length, id) of the best completion below it
+def _trie_insert(root, key, key_id):
+    node = root
+    for char in key:
+        node[None] = min(node.get(None, (len(key), key_id)), (len(key), key_id))
+        node = node.setdefault(char, {})
+    node[None] = min(node.get(None, (len(key), key_id)), (len(key), key_id))
+    node.setdefault("", key_id)
+
+
+def build_grade_index(references):
+    keys = pd.unique(references["grade_normalized"].dropna())
+    trie, postings = {}, {}
+    for key_id, key in enumerate(keys):
+        _trie_insert(trie, key, key_id)
+        for gram in _ngrams(key):
+            postings.setdefault(gram, []).append(key_id)
+    return {
+        "keys": keys,
+        "ids": {key: key_id for key_id, key in enumerate(keys)},
+        "trie": trie,
+        "postings": {gram: np.array(ids) for gram, ids in postings.items()},
+        "gram_counts": np.array([len(_ngrams(key)) for key in keys]),
+        "memo": {},
+    }
+
+
+# (key_id, confidence) of the best prefix relation between grade and a reference key
+def _prefix_match(index, grade):
+    matches = [(None, 0.0)]
+    node = index["trie"]
+    for depth, char in enumerate(grade):
+        if "" in node and depth:
+            matches.append((node[""], depth / len(grade)))  # a reference key prefixes the grade
+        node = node.get(char)
+        if node is None:
+            break
+    else:
+        length, key_id = node[None]  # the grade prefixes a reference key
+        matches.append((key_id, len(grade) / length))
+    return max(matches, key=lambda match: match[1])
+
+
+def _ngram_match(index, grade):
+    grams = _ngrams(grade)
+    hits = [index["postings"][g] for g in grams if g in index["postings"]]
+    if not hits:
+        return None, 0.0
+    shared = np.bincount(np.concatenate(hits), minlength=len(index["keys"]))
+    dice = 2.0 * shared / (len(grams) + index["gram_counts"])
+    key_id = int(np.argmax(dice))
+    return key_id, float(dice[key_id])
+
+
+# (reference key, method, confidence) for one normalized grade / suffix pair
+def resolve_grade(index, grade, suffix=None, min_confidence=MIN_CONFIDENCE):
+    if grade is None:
+        return None, "missing", 0.0
+    memo_key = (grade, suffix)
+    if memo_key in index["memo"]:
+        return index["memo"][memo_key]
+
+    ids = index["ids"]
+    exact = []
+    if suffix:
+        exact = [grade + suffix] if suffix.startswith("+") else [grade + suffix, f"{grade}+{suffix}"]
+    stripped = [grade.split("+")[0]] if "+" in grade else []
+    if suffix and grade.endswith(suffix) and len(grade) > len(suffix):
+        stripped.append(grade[:-len(suffix)])
+
+    result = None
+    for candidate in exact + [grade]:
+        if candidate in ids:
+            result = candidate, "exact", 1.0
+            break
+    if result is None:
+        for candidate in stripped:
+            if candidate in ids:
+                result = candidate, "suffix", SUFFIX_CONFIDENCE
+                break
+    if result is None:
+        (prefix_id, prefix_conf), (ngram_id, ngram_conf) = _prefix_match(index, grade), _ngram_match(index, grade)
+        method, key_id, confidence = max(
+            [("prefix", prefix_id, prefix_conf), ("ngram", ngram_id, ngram_conf)],
+            key=lambda match: (match[2], match[0] == "prefix"),
+        )
+        if key_id is not None and confidence >= min_confidence:
+            result = index["keys"][key_id], method, confidence
+        else:
+            result = None, "unmatched", confidence
+
+    index["memo"][memo_key] = result
+    return result
+
+
+# Normalize a raw grade column, calling normalize_grade_keys once per unique value
+def normalize_grade_column(grades):
+    codes, uniques = pd.factorize(grades)
+    normalized = np.array([normalize_grade_keys(value) for value in uniques] + [None], dtype=object)
+    return pd.Series(normalized[codes], index=grades.index)
+
+
+# Resolved reference key, method and confidence for every RFQ row
+def resolve_grades(index, grades_normalized, suffixes=None, min_confidence=MIN_CONFIDENCE):
+    if suffixes is None:
+        suffixes = pd.Series(None, index=grades_normalized.index, dtype=object)
+    grade_codes, grade_values = pd.factorize(grades_normalized)
+    suffix_codes, suffix_values = pd.factorize(normalize_grade_column(suffixes))
+
+    # One resolution per unique (grade, suffix) pair; -1 codes are missing values
+    pair_codes = (grade_codes + 1) * (len(suffix_values) + 1) + (suffix_codes + 1)
+    _, first_rows, codes = np.unique(pair_codes, return_index=True, return_inverse=True)
+    resolved = [
+        resolve_grade(
+            index,
+            grade_values[grade_codes[row]] if grade_codes[row] >= 0 else None,
+            suffix_values[suffix_codes[row]] if suffix_codes[row] >= 0 else None,
+            min_confidence,
+        )
+        for row in first_rows
+    ]
+    keys, methods, confidences = (np.array(column, dtype=object) for column in zip(*resolved)) \
+        if resolved else (np.array([], dtype=object),) * 3
+    return pd.DataFrame({
+        "grade_key": keys[codes],
+        "grade_match": methods[codes],
+        "grade_confidence": confidences[codes].astype(float),
+    }, index=grades_normalized.index)
+
+
+# Rows, unique grades and row share per resolution method
+def resolution_report(resolved, grades_normalized):
+    frame = pd.DataFrame({"method": resolved["grade_match"], "grade": grades_normalized})
+    report = frame.groupby("method").agg(rows=("grade", "size"), unique_grades=("grade", "nunique"))
+    report = report.reindex(METHODS, fill_value=0)
+    report["share"] = report["rows"] / max(len(frame), 1)
+    return report.reset_index()
@@ -0,0 +1,219 @@
+import os
+import pickle
+import numpy as np
+import pandas as pd
+from src.feature_store import build_feature_frame, load_feature_frame, feature_key, read_frame, write_frame, STORE_FORMAT
+from src.rfq_similarity import (
+    DIM_COLS, CAT_COLS, SIMILARITY_WEIGHTS, fit_family_encoders, transform_family_matrices,
+    extend_categorical_levels, embed_matrices, weighted_tile,
+)
+from src.topk import blocked_topk, select_topk, merge_topk
+from src.topk_output import write_topk
+
+# -------------------------------
+# Incremental top-k maintenance
+# -------------------------------
+# The fitted encoders, the family embeddings and the per-RFQ top-k lists are
+# persisted in <output_dir>/.incremental. A batch of new RFQs is scored against
+# the corpus once (O(new x n)): the new rows get fresh top-k lists and existing
+# lists are merged with the new candidates wherever a new RFQ beats the k-th score.
+#
+# Scaler drift: scalers stay fitted on the corpus of the last full rebuild, so
+# new rows outside the fitted min/max scale outside [0, 1]. When the share of
+# such rows exceeds max_drift, or after rebuild_every batches, the state is
+# rebuilt from scratch (which equals a plain compute_top3 on the whole corpus).
+#
+# The state records the feature store key of the corpus it was built from; when
+# data/rfq.csv, the reference table or the feature code change, it is rebuilt.
+# Results go to their own top3_incremental.csv, so scenario B's top3.csv (which
+# ANN and SH compare against) always covers exactly the base corpus.
+
+INCREMENTAL_DIRNAME = ".incremental"
+MAX_DRIFT = 0.05
+REBUILD_EVERY = 30
+STATE_VERSION = 2  # 2: categorical embeddings are level codes
+
+
+def _paths(state_dir):
+    ext = "parquet" if STORE_FORMAT == "parquet" else "pkl"
+    return {
+        'meta': os.path.join(state_dir, "state.pkl"),
+        'corpus': os.path.join(state_dir, f"corpus.{ext}"),
+        'arrays': os.path.join(state_dir, "arrays.npz"),
+    }
+
+
+# Columns needed to re-encode the corpus on a rebuild
+def _corpus_columns(feature_df):
+    grade_cols = [col for col in feature_df.columns if '_mid' in col]
+    return ['id'] + DIM_COLS + grade_cols + CAT_COLS
+
+
+def save_state(state, state_dir):
+    os.makedirs(state_dir, exist_ok=True)
+    paths = _paths(state_dir)
+    write_frame(state['corpus'], paths['corpus'])
+
+    arrays = {f"emb_{family}": emb for family, emb in state['embeddings'].items()}
+    tmp_path = paths['arrays'] + ".tmp.npz"
+    np.savez(tmp_path, top_idx=state['top_idx'], top_scores=state['top_scores'], **arrays)
+    os.replace(tmp_path, paths['arrays'])
+
+    meta = {key: state[key] for key in ['encoders', 'weights', 'top_n', 'batches_since_rebuild', 'history']}
+    meta['source_key'] = state.get('source_key')
+    meta['version'] = STATE_VERSION
+    with open(paths['meta'], "wb") as fh:
+        pickle.dump(meta, fh)
+
+
+# Stored state, or None when there is none or it was built from other inputs than source_key
+def load_state(state_dir, source_key=None):
+    paths = _paths(state_dir)
+    if not os.path.exists(paths['meta']):
+        return None
+    with open(paths['meta'], "rb") as fh:
+        state = pickle.load(fh)
+    if state.pop('version', 1) != STATE_VERSION:
+        return None
+    if source_key is not None and state.get('source_key') != source_key:
+        print("RFQ or reference data changed since the incremental state was built")
+        return None
+    state['corpus'] = read_frame(paths['corpus'])
+    with np.load(paths['arrays']) as arrays:
+        state['top_idx'] = arrays['top_idx']
+        state['top_scores'] = arrays['top_scores']
+        state['embeddings'] = {
+            key[len("emb_"):]: arrays[key] for key in arrays.files if key.startswith("emb_")
+        }
+    return state
+
+
+# Full rebuild: refit encoders on the whole corpus and recompute every top-k list
+def rebuild_state(corpus, top_n=3, weights=None, block_size=1024, history=None):
+    if weights is None:
+        weights = SIMILARITY_WEIGHTS
+    corpus = corpus[_corpus_columns(corpus)].reset_index(drop=True)
+
+    encoders = fit_family_encoders(corpus, list(weights))
+    embeddings = embed_matrices(transform_family_matrices(corpus, encoders))
+    top_idx, top_scores = blocked_topk(
+        lambda rows, cols: weighted_tile(embeddings, weights, rows, cols),
+        len(corpus), top_n, block_size=block_size, symmetric=True, self_score=0.0,
+    )
+    return {
+        'corpus': corpus, 'encoders': encoders, 'weights': weights, 'top_n': top_n,
+        'embeddings': embeddings, 'top_idx': top_idx, 'top_scores': top_scores,
+        'batches_since_rebuild': 0, 'history': list(history or []),
+    }
+
+
+# Share of rows with any scaled feature outside the fitted [0, 1] range
+def drift_fraction(matrices, tol=1e-9):
+    outside = np.zeros(len(next(iter(matrices.values()))), dtype=bool)
+    for family, matrix in matrices.items():
+        if family != 'categorical':
+            outside |= ((matrix < -tol) | (matrix > 1 + tol)).any(axis=1)
+    return outside.mean() if len(outside) else 0.0
+
+
+# Score new rows (corpus positions n_old..n_total) against the whole corpus.
+# Each (new block x corpus block) tile updates the new rows' lists and, through
+# its transpose, the lists of the earlier rows it touches. Returns how many
+# existing lists changed.
+def _update_topk(state, n_old, block_size):
+    embeddings, weights = state['embeddings'], state['weights']
+    n_total = len(state['corpus'])
+    k = min(state['top_n'], n_total)
+
+    top_idx = np.vstack([_pad(state['top_idx'], k, n_total), np.full((n_total - n_old, k), n_total)])
+    top_scores = np.vstack([_pad(state['top_scores'], k, -np.inf), np.full((n_total - n_old, k), -np.inf)])
+    kth_before = top_scores[:n_old, -1].copy()
+
+    def update(rows, tile, col_start):
+        cand_idx, cand_scores = select_topk(tile, k, col_offset=col_start)
+        top_idx[rows], top_scores[rows] = merge_topk(top_idx[rows], top_scores[rows], cand_idx, cand_scores, k)
+
+    for r0 in range(n_old, n_total, block_size):
+        rows = slice(r0, min(r0 + block_size, n_total))
+        for c0 in range(0, rows.stop, block_size):
+            cols = slice(c0, min(c0 + block_size, rows.stop))
+            tile = weighted_tile(embeddings, weights, rows, cols)
+
+            lo, hi = max(rows.start, cols.start), min(rows.stop, cols.stop)
+            if lo < hi:
+                diag = np.arange(lo, hi)
+                tile[diag - rows.start, diag - cols.start] = 0.0  # self stays a zero-score candidate
+            update(rows, tile, cols.start)
+
+            earlier = slice(cols.start, min(cols.stop, rows.start))
+            if earlier.start < earlier.stop:
+                update(earlier, tile[:, :earlier.stop - cols.start].T, rows.start)
+
+    state['top_idx'], state['top_scores'] = top_idx, top_scores
+    return int((top_scores[:n_old, -1] != kth_before).sum())
+
+
+# Pad (or trim) stored (n, k) lists to width k
+def _pad(values, k, fill):
+    if values.shape[1] >= k:
+        return values[:, :k]
+    return np.hstack([values, np.full((len(values), k - values.shape[1]), fill, dtype=values.dtype)])
+
+
+# Add a batch of engineered RFQ rows; returns the updated state and a summary dict
+def add_rfqs(state, new_df, max_drift=MAX_DRIFT, rebuild_every=REBUILD_EVERY, block_size=1024):
+    new_df = new_df[~new_df['id'].isin(set(state['corpus']['id']))]
+    new_df = new_df[_corpus_columns(state['corpus'])].reset_index(drop=True)
+    summary = {'new_rows': len(new_df), 'rebuilt': False, 'drift': 0.0, 'updated_rows': 0}
+    if new_df.empty:
+        return state, summary
+
+    extend_categorical_levels(state['encoders'], new_df)
+    matrices = transform_family_matrices(new_df, state['encoders'])
+    summary['drift'] = drift_fraction(matrices)
+    corpus = pd.concat([state['corpus'], new_df], ignore_index=True)
+
+    if summary['drift'] > max_drift or state['batches_since_rebuild'] + 1 >= rebuild_every:
+        source_key = state.get('source_key')
+        state = rebuild_state(corpus, state['top_n'], state['weights'], block_size, state['history'])
+        state['source_key'] = source_key
+        summary['rebuilt'] = True
+    else:
+        n_old = len(state['corpus'])
+        for family, emb in embed_matrices(matrices).items():
+            state['embeddings'][family] = np.vstack([state['embeddings'][family], emb])
+        state['corpus'] = corpus
+        summary['updated_rows'] = _update_topk(state, n_old, block_size)
+        state['batches_since_rebuild'] += 1
+
+    state['history'].append(summary)
+    return state, summary
+
+
+# -------------------------------
+# Main incremental function
+# -------------------------------
+def compute_top3_incremental(rfq_file, reference_file, new_rfq_file=None, output_file='top3_incremental.csv',
+                             output_dir='outputs', max_drift=MAX_DRIFT, rebuild_every=REBUILD_EVERY):
+    state_dir = os.path.join(output_dir, INCREMENTAL_DIRNAME)
+    source_key = feature_key(rfq_file, reference_file)
+    state = load_state(state_dir, source_key)
+
+    if state is None:
+        print("No usable incremental state found, building from the full corpus...")
+        state = rebuild_state(load_feature_frame(rfq_file, reference_file, output_dir=output_dir))
+        state['source_key'] = source_key
+
+    if new_rfq_file is not None:
+        print(f"Adding new RFQs from {new_rfq_file}...")
+        state, summary = add_rfqs(state, build_feature_frame(new_rfq_file, reference_file),
+                                  max_drift=max_drift, rebuild_every=rebuild_every)
+        mode = "full rebuild" if summary['rebuilt'] else f"{summary['updated_rows']} existing lists updated"
+        print(f"Added {summary['new_rows']} RFQs (drift {summary['drift']:.1%}, {mode})")
+
+    save_state(state, state_dir)
+
+    out_path = os.path.join(output_dir, output_file)
+    write_topk(out_path, state['corpus']['id'].values, state['top_idx'], state['top_scores'])
+    print(f"[✓] Saved {out_path} ({len(state['corpus'])} RFQs in corpus)")
+    return state['top_idx'], state['top_scores']
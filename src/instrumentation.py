@@ -0,0 +1,254 @@
+import os
+import sys
+import json
+import time
+import uuid
+import importlib
+import cProfile
+import pstats
+import resource
+import threading
+import contextlib
+
+# -------------------------------
+# Stage instrumentation
+# -------------------------------
+# stage(name) records wall time, peak RSS (sampled by a background thread) and
+# row counts in / out for one pipeline step; stages nest, and each record keeps
+# its path (e.g. "scenario.B/similarity/embed"). timed(name) is a cheap
+# accumulator for hot loops (per-tile family products, top-k selection) that
+# adds its time to the enclosing stage instead of emitting a record per call.
+#
+# Everything is configured through environment variables, so scenario workers
+# started by the pipeline inherit it and no code changes are needed:
+#   RFQ_METRICS_FILE   append one JSON line per finished stage to this file
+#   RFQ_PROFILE_STAGE  run cProfile on every stage with this name
+#   RFQ_PROFILE_DIR    where .prof / .txt profiles go (default outputs/profiles)
+# Without them, stage() and timed() do nothing beyond an environment lookup.
+
+METRICS_FILE_ENV = "RFQ_METRICS_FILE"
+PROFILE_STAGE_ENV = "RFQ_PROFILE_STAGE"
+PROFILE_DIR_ENV = "RFQ_PROFILE_DIR"
+RUN_ID_ENV = "RFQ_RUN_ID"
+SAMPLE_INTERVAL = 0.01
+
+_local = threading.local()
+_open_records = []
+_lock = threading.Lock()
+_sampler = None
+_profile_counter = 0
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+# Peak RSS of this process and of its finished children (whole-run summary)
+def peak_rss_mb():
+    scale = 2**20 if sys.platform == "darwin" else 1024
+    return max(resource.getrusage(who).ru_maxrss for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)) / scale
+
+
+def _sample_forever():
+    while True:
+        time.sleep(SAMPLE_INTERVAL)
+        with _lock:
+            if not _open_records:
+                continue
+            current = rss_mb()
+            for record in _open_records:
+                record["peak_rss_mb"] = max(record["peak_rss_mb"], current)
+
+
+def _ensure_sampler():
+    global _sampler
+    # A forked worker inherits the handle but not the thread
+    if _sampler is None or _sampler[0] != os.getpid():
+        thread = threading.Thread(target=_sample_forever, name="rss-sampler", daemon=True)
+        thread.start()
+        _sampler = (os.getpid(), thread)
+
+
+# A child forked while the sampler holds _lock would inherit it locked for good
+# (the sampler thread itself does not survive the fork), so the child starts over
+# with a fresh lock, no sampler and none of the parent's open records
+def _reset_after_fork():
+    global _lock, _sampler
+    _lock = threading.Lock()
+    _sampler = None
+    _open_records.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def emit(record):
+    path = os.environ.get(METRICS_FILE_ENV)
+    if not path:
+        return
+    record = {"run_id": os.environ.get(RUN_ID_ENV), "pid": os.getpid(), "ts": time.time(), **record}
+    line = json.dumps(record, default=str) + "\n"
+    with open(path, "a", encoding="utf-8") as fh:  # single short appends do not interleave
+        fh.write(line)
+
+
+def _dump_profile(profiler, name):
+    global _profile_counter
+    _profile_counter += 1
+    out_dir = os.environ.get(PROFILE_DIR_ENV) or os.path.join("outputs", "profiles")
+    os.makedirs(out_dir, exist_ok=True)
+    base = os.path.join(out_dir, f"{name.replace('/', '_')}-{os.getpid()}-{_profile_counter}")
+    profiler.dump_stats(base + ".prof")
+    with open(base + ".txt", "w") as fh:
+        pstats.Stats(profiler, stream=fh).sort_stats("cumulative").print_stats(30)
+    print(f"[✓] Saved profile {base}.prof")
+
+
+@contextlib.contextmanager
+def stage(name, rows_in=None, **fields):
+    metrics_on = METRICS_FILE_ENV in os.environ
+    profile_on = os.environ.get(PROFILE_STAGE_ENV) == name
+    if not (metrics_on or profile_on):
+        yield {}
+        return
+
+    stack = _stack()
+    record = {
+        "stage": name,
+        "path": "/".join([r["stage"] for r in stack] + [name]),
+        "rows_in": rows_in,
+        "rows_out": None,
+        **fields,
+        "timers": {},
+    }
+    record["rss_start_mb"] = record["peak_rss_mb"] = rss_mb()
+    _ensure_sampler()
+    with _lock:
+        _open_records.append(record)
+    stack.append(record)
+
+    profiler = cProfile.Profile() if profile_on else None
+    start = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    try:
+        yield record
+    except BaseException as exc:
+        record["error"] = repr(exc)
+        raise
+    finally:
+        if profiler:
+            profiler.disable()
+        record["seconds"] = time.perf_counter() - start
+        stack.pop()
+        with _lock:
+            _open_records.remove(record)
+        record["rss_end_mb"] = rss_mb()
+        record["peak_rss_mb"] = max(record["peak_rss_mb"], record["rss_end_mb"])
+        if profiler:
+            _dump_profile(profiler, name)
+        if metrics_on:
+            emit(record)
+
+
+# Accumulate the time of a hot-loop section into the enclosing stage
+@contextlib.contextmanager
+def timed(name):
+    stack = getattr(_local, "stack", None)
+    if not stack:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timers = stack[-1]["timers"]
+        timers[name] = timers.get(name, 0.0) + time.perf_counter() - start
+
+
+# DataFrame.to_csv as an instrumented stage
+def write_csv(df, path, **kwargs):
+    with stage("write_csv", rows_in=len(df), file=os.path.basename(str(path))) as record:
+        df.to_csv(path, **kwargs)
+        record["rows_out"] = len(df)
+
+
+# -------------------------------
+# Import timing
+# -------------------------------
+# run.py imports scenario modules (and with them pandas, scikit-learn, ...) on
+# first use through timed_import, which records an "import" stage with the
+# number of modules it loaded. With RFQ_IMPORT_REPORT=1 (run.py --import-report)
+# every such import also prints its time and the top-level packages it pulled in.
+
+IMPORT_REPORT_ENV = "RFQ_IMPORT_REPORT"
+
+
+def timed_import(name):
+    if name in sys.modules:
+        return sys.modules[name]
+
+    before = set(sys.modules)
+    start = time.perf_counter()
+    with stage("import", module=name) as record:
+        module = importlib.import_module(name)
+        loaded = set(sys.modules) - before
+        record["rows_out"] = len(loaded)
+    if os.environ.get(IMPORT_REPORT_ENV) == "1":
+        stdlib = set(getattr(sys, "stdlib_module_names", ())) | set(sys.builtin_module_names)
+        packages = sorted({m.split(".")[0] for m in loaded} - stdlib - {"src", "__mp_main__"})
+        packages = [p for p in packages if not p.startswith("_")]
+        print(f"[import] {name}: {time.perf_counter() - start:.2f}s, {len(loaded)} modules"
+              + (f" ({', '.join(packages[:12])}{', ...' if len(packages) > 12 else ''})" if packages else ""))
+    return module
+
+
+# -------------------------------
+# Per-run metrics file
+# -------------------------------
+# A run writes JSON lines to <path> (or to <path>l while running when a .json
+# document is requested); finish_run appends the run summary and, for .json,
+# folds everything into one document.
+
+def start_run(metrics_path=None, profile_stage=None, profile_dir=None):
+    os.environ[RUN_ID_ENV] = uuid.uuid4().hex[:12]
+    if metrics_path:
+        lines_path = metrics_path + "l" if metrics_path.endswith(".json") else metrics_path
+        os.makedirs(os.path.dirname(os.path.abspath(lines_path)), exist_ok=True)
+        if os.path.exists(lines_path):
+            os.remove(lines_path)
+        os.environ[METRICS_FILE_ENV] = lines_path
+    if profile_stage:
+        os.environ[PROFILE_STAGE_ENV] = profile_stage
+    if profile_dir:
+        os.environ[PROFILE_DIR_ENV] = profile_dir
+    return os.environ[RUN_ID_ENV]
+
+
+def finish_run(metrics_path, summary):
+    if not metrics_path:
+        return
+    emit({"stage": "run", **summary})
+    if metrics_path.endswith(".json"):
+        lines_path = os.environ[METRICS_FILE_ENV]
+        with open(lines_path, encoding="utf-8") as fh:
+            records = [json.loads(line) for line in fh if line.strip()]
+        run = records[-1]
+        document = {"run_id": run["run_id"], "summary": run, "stages": records[:-1]}
+        with open(metrics_path, "w", encoding="utf-8") as fh:
+            json.dump(document, fh, indent=2, default=str)
+        os.remove(lines_path)
+    print(f"[✓] Saved metrics {metrics_path}")
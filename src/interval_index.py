@@ -0,0 +1,144 @@
+import numpy as np
+
+# -------------------------------
+# Interval index for dimensional range filtering
+# -------------------------------
+# Answers "which intervals overlap (or come within tolerance of) this range"
+# without scanning the corpus. Intervals are bucketed by length (powers of two);
+# inside a bucket they are sorted by start, so every interval overlapping
+# [lo, hi] has start in [lo - max_length, hi] and is found with two binary
+# searches plus a short scan. Queries are answered in batch with NumPy.
+
+DIMENSION_RANGES = {
+    'thickness': ('thickness_min', 'thickness_max'),
+    'width': ('width_min', 'width_max'),
+    'weight': ('weight_min', 'weight_max'),
+}
+
+SEARCH_SLACK = 1e-12
+
+
+# Expand ragged [starts[i], stops[i]) windows into (owner, position) pairs
+def _expand_windows(starts, stops):
+    counts = np.maximum(stops - starts, 0)
+    owners = np.repeat(np.arange(len(starts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owners, np.repeat(starts, counts) + offsets
+
+
+class SortedIntervalIndex:
+    def __init__(self, lo, hi):
+        lo = np.asarray(lo, dtype=float)
+        hi = np.asarray(hi, dtype=float)
+        self.size = len(lo)
+
+        known = ~(np.isnan(lo) | np.isnan(hi))
+        self.unknown = np.flatnonzero(~known)
+
+        ids = np.flatnonzero(known)
+        lengths = np.maximum(hi[ids] - lo[ids], 0)
+        # Bucket 0 holds points; bucket b holds lengths in [2^(b-1), 2^b) (relative to the smallest)
+        bucket_of = np.zeros(len(ids), dtype=int)
+        positive = lengths > 0
+        if positive.any():
+            scale = lengths[positive].min()
+            bucket_of[positive] = np.floor(np.log2(lengths[positive] / scale)).astype(int) + 1
+
+        self.buckets = []
+        for bucket in np.unique(bucket_of):
+            members = ids[bucket_of == bucket]
+            order = np.argsort(lo[members], kind='stable')
+            members = members[order]
+            self.buckets.append({
+                'ids': members,
+                'starts': lo[members],
+                'ends': hi[members],
+                'max_length': float(np.max(hi[members] - lo[members])),
+            })
+
+    # All (query, item) pairs where item overlaps [q_lo, q_hi]; items with an
+    # unknown range are returned for every query when include_unknown is set
+    def query(self, q_lo, q_hi, include_unknown=True):
+        q_lo = np.atleast_1d(np.asarray(q_lo, dtype=float))
+        q_hi = np.atleast_1d(np.asarray(q_hi, dtype=float))
+
+        queries, items = [], []
+        for bucket in self.buckets:
+            # q_lo - max_length can round above a start it should reach; the
+            # window is widened a little and the end check below stays exact
+            reach = q_lo - bucket['max_length']
+            reach = reach - SEARCH_SLACK * (np.abs(q_lo) + bucket['max_length'])
+            first = np.searchsorted(bucket['starts'], reach, side='left')
+            last = np.searchsorted(bucket['starts'], q_hi, side='right')
+            owners, positions = _expand_windows(first, last)
+            hit = bucket['ends'][positions] >= q_lo[owners]
+            queries.append(owners[hit])
+            items.append(bucket['ids'][positions[hit]])
+
+        if include_unknown and len(self.unknown):
+            queries.append(np.repeat(np.arange(len(q_lo)), len(self.unknown)))
+            items.append(np.tile(self.unknown, len(q_lo)))
+
+        if not queries:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(queries), np.concatenate(items)
+
+
+# Index over several range dimensions (thickness / width / weight). A pair is a
+# candidate when it overlaps in every dimension the query specifies; queries
+# without any known range are reported as unconstrained.
+class DimensionalIndex:
+    def __init__(self, frame, dimensions=None):
+        if dimensions is None:
+            dimensions = list(DIMENSION_RANGES)
+        self.dimensions = dimensions
+        self.size = len(frame)
+        self.indexes = {
+            dim: SortedIntervalIndex(frame[DIMENSION_RANGES[dim][0]], frame[DIMENSION_RANGES[dim][1]])
+            for dim in dimensions
+        }
+
+    # Widened query ranges: [lo * (1 - tolerance), hi * (1 + tolerance)]; a
+    # missing bound is filled from the other one (singleton range)
+    def _query_ranges(self, frame, dim, tolerance):
+        lo_col, hi_col = DIMENSION_RANGES[dim]
+        lo = frame[lo_col].to_numpy(dtype=float)
+        hi = frame[hi_col].to_numpy(dtype=float)
+        lo, hi = np.where(np.isnan(lo), hi, lo), np.where(np.isnan(hi), lo, hi)
+        return lo * (1 - tolerance), hi * (1 + tolerance)
+
+    # Returns (query_rows, item_rows, unconstrained_query_mask)
+    def candidates(self, query_frame, tolerance=0.0, include_unknown=True):
+        n_queries = len(query_frame)
+        keys, n_known = [], np.zeros(n_queries, dtype=np.int64)
+
+        for dim in self.dimensions:
+            lo, hi = self._query_ranges(query_frame, dim, tolerance)
+            known = np.flatnonzero(~np.isnan(lo))
+            n_known[known] += 1
+            q, items = self.indexes[dim].query(lo[known], hi[known], include_unknown)
+            keys.append(known[q] * self.size + items)
+
+        unconstrained = n_known == 0
+        if not keys:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), unconstrained
+
+        # Keep pairs found in every dimension the query constrains
+        pair_keys, counts = np.unique(np.concatenate(keys), return_counts=True)
+        queries, items = np.divmod(pair_keys, self.size)
+        keep = counts == n_known[queries]
+        return queries[keep], items[keep], unconstrained
+
+
+# Candidate pairs within one corpus (self-pairs removed); unconstrained rows are
+# paired with every other row
+def corpus_candidates(frame, tolerance=0.0, dimensions=None, include_unknown=True):
+    index = DimensionalIndex(frame, dimensions)
+    rows, cols, unconstrained = index.candidates(frame, tolerance, include_unknown)
+
+    free = np.flatnonzero(unconstrained)
+    rows = np.concatenate([rows, np.repeat(free, len(frame))])
+    cols = np.concatenate([cols, np.tile(np.arange(len(frame)), len(free))])
+
+    keep = rows != cols
+    return rows[keep], cols[keep]
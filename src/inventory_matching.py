@@ -0,0 +1,221 @@
+import os
+import numpy as np
+import pandas as pd
+from src.feature_store import load_feature_frame, load_references
+from src.rfq_similarity import (
+    engineer_features, normalize_grade_keys, fit_family_encoders, transform_families, SIMILARITY_WEIGHTS,
+)
+from src.interval_index import DimensionalIndex
+from src.topk import pairs_topk
+from src.topk_output import write_result_frame
+from src.instrumentation import stage
+
+# -------------------------------
+# RFQ -> inventory matching
+# -------------------------------
+# Every RFQ is matched against the cleaned supplier inventory
+# (data_cleaning.run_supplier_cleaning). Hard constraints are applied first
+# (grade compatibility, dimensions within range, not reserved) and only the
+# surviving RFQ x stock pairs are scored with the same feature families as the
+# RFQ similarity (dimensions, grade properties, finish). RFQs without a grade
+# cannot be checked against the grade constraint and are left unmatched.
+
+# Stock dimensions (point values) vs. RFQ range columns
+INVENTORY_DIMENSIONS = {
+    'thickness': 'thickness_mm',
+    'width': 'width_mm',
+    'weight': 'gross_weight_kg',
+}
+# Dimensions used as hard range constraints; weight is scored but not filtered
+CONSTRAINED_DIMENSIONS = ['thickness', 'width']
+
+# Supplier finishes (German) translated to the RFQ vocabulary
+FINISH_ALIASES = {
+    'GEBEIZT': 'pickled',
+    'UNGEBEIZT': 'hot rolled',
+    'GEBEIZT UND GEGLÜHT': 'pickled and annealed',
+}
+
+# Reservation values that leave an item available
+AVAILABLE_RESERVED = {'NOT RESERVED', 'NAN', ''}
+
+
+# Base grade without coating suffix, e.g. "DX51D+Z140" -> "DX51D"
+def base_grade(grade_normalized):
+    return grade_normalized.str.split('+').str[0]
+
+
+# Article ids as strings. The column is float as soon as one supplier has no
+# ids, so integral values are written without the decimal part ("23047939",
+# not "23047939.0").
+def article_ids(inv):
+    if 'article_id' not in inv.columns:
+        return pd.Series(None, index=inv.index, dtype=object)
+    ids = inv['article_id']
+    numeric = pd.to_numeric(ids, errors='coerce')
+    if numeric.notna().sum() == ids.notna().sum() and (numeric.dropna() % 1 == 0).all():
+        ids = numeric.astype('Int64')
+    return pd.Series([None if pd.isna(v) else str(v) for v in ids], index=inv.index, dtype=object)
+
+
+# Inventory as an RFQ-shaped frame: point dimensions become [v, v] ranges and
+# reference properties are merged on the base grade
+def inventory_feature_frame(inventory_df, references):
+    inv = inventory_df.reset_index(drop=True)
+    fallback_ids = inv['source'].astype(str) + ':' + inv.index.astype(str)
+
+    frame = pd.DataFrame({
+        'id': article_ids(inv).fillna(fallback_ids),
+        'source': inv['source'],
+        'grade': inv['grade'],
+        'finish': inv['finish'].replace(FINISH_ALIASES),
+        'reserved': inv['reserved'].fillna('').astype(str).str.strip().str.upper(),
+    })
+    for dim, col in INVENTORY_DIMENSIONS.items():
+        frame[f'{dim}_min'] = pd.to_numeric(inv[col], errors='coerce')
+        frame[f'{dim}_max'] = frame[f'{dim}_min']
+
+    frame['grade_normalized'] = frame['grade'].apply(normalize_grade_keys)
+    frame['grade_base'] = base_grade(frame['grade_normalized'])
+
+    props = references.drop_duplicates('grade_normalized').rename(columns={'grade_normalized': 'grade_base'})
+    frame = frame.merge(props, on='grade_base', how='left', suffixes=('', '_ref'))
+    return engineer_features(frame)
+
+
+# Candidate (rfq_idx, inv_idx) pairs that pass grade + availability constraints:
+# a hash join on base grade (RFQs without a grade get no candidates)
+def grade_candidates(rfq_frame, inv_frame):
+    available = inv_frame['reserved'].isin(AVAILABLE_RESERVED).to_numpy()
+    inv_base = inv_frame['grade_base'].to_numpy()
+    rfq_base = base_grade(rfq_frame['grade_normalized']).to_numpy()
+
+    inv_groups = pd.Series(np.flatnonzero(available)).groupby(inv_base[available]).apply(np.asarray).to_dict()
+
+    rfq_rows, inv_rows = [], []
+    for grade, rows in pd.Series(np.arange(len(rfq_frame))).groupby(pd.Series(rfq_base)):
+        items = inv_groups.get(grade)
+        if items is None or len(items) == 0:
+            continue
+        rows = rows.to_numpy()
+        rfq_rows.append(np.repeat(rows, len(items)))
+        inv_rows.append(np.tile(items, len(rows)))
+
+    if not rfq_rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(rfq_rows), np.concatenate(inv_rows)
+
+
+# Keep pairs whose stock dimensions fall inside the RFQ range (+/- tolerance),
+# looked up in an interval index over the stock; unknown values on either side
+# do not exclude a pair. Also returns how many pairs had a dimension to check.
+def dimension_filter(rfq_frame, inv_frame, rfq_rows, inv_rows, tolerance=0.05):
+    index = DimensionalIndex(inv_frame, CONSTRAINED_DIMENSIONS)
+    q, items, unconstrained = index.candidates(rfq_frame, tolerance)
+    in_range = np.isin(rfq_rows * len(inv_frame) + inv_rows, q * len(inv_frame) + items)
+    keep = unconstrained[rfq_rows] | in_range
+
+    checkable = np.zeros(len(rfq_rows), dtype=bool)
+    for dim in CONSTRAINED_DIMENSIONS:
+        rfq_known = rfq_frame[[f'{dim}_min', f'{dim}_max']].notna().any(axis=1).to_numpy()
+        checkable |= rfq_known[rfq_rows] & inv_frame[f'{dim}_min'].notna().to_numpy()[inv_rows]
+    return rfq_rows[keep], inv_rows[keep], int(checkable.sum())
+
+
+# Dimensional closeness of each pair: per dimension, the ratio of the smaller to
+# the larger of the stock value and the RFQ range midpoint (1 at the midpoint,
+# 0.5 at half or twice its size), averaged over the dimensions known on both
+# sides (0 when there are none). Unlike a cosine over the known columns it
+# depends on magnitude, so with only the weight known a 1,000 kg coil still
+# scores far above a 999,999 kg one for a 1,000 kg request.
+def dimension_scores(rfq_frame, inv_frame, rfq_rows, inv_rows):
+    total, n_known = np.zeros(len(rfq_rows)), np.zeros(len(rfq_rows))
+    for dim in INVENTORY_DIMENSIONS:
+        # Midpoint of the known bounds (NaN when neither is known)
+        mid = np.abs(rfq_frame[[f'{dim}_min', f'{dim}_max']].astype(float).mean(axis=1).to_numpy())
+        value = np.abs(inv_frame[f'{dim}_min'].to_numpy(dtype=float))
+
+        a, b = mid[rfq_rows], value[inv_rows]
+        known = ~(np.isnan(a) | np.isnan(b))
+        larger = np.fmax(a, b)
+        closeness = np.divide(np.fmin(a, b), larger, out=np.ones(len(a)), where=larger > 0)
+        total += np.where(known, closeness, 0.0)
+        n_known += known
+    return np.divide(total, n_known, out=np.zeros(len(total)), where=n_known > 0)
+
+
+# Weighted family scores for explicit (rfq, item) pairs
+def score_pairs(rfq_frame, inv_frame, rfq_rows, inv_rows, weights=None):
+    if weights is None:
+        weights = SIMILARITY_WEIGHTS
+
+    # Grade scalers are fitted on the stock alone, so an RFQ scores the same
+    # whichever other RFQs are matched with it (batch run or service micro-batch)
+    grade_cols = [c for c in rfq_frame.columns if '_mid' in c]
+    encoders = fit_family_encoders(inv_frame[grade_cols], ['grade_properties'])
+    rfq_emb = transform_families(rfq_frame, encoders)['grade_properties']
+    inv_emb = transform_families(inv_frame, encoders)['grade_properties']
+    n_rfq = len(rfq_frame)
+
+    family_scores = {'dimensional': dimension_scores(rfq_frame, inv_frame, rfq_rows, inv_rows)}
+    family_scores['grade_properties'] = np.einsum('ij,ij->i', rfq_emb[rfq_rows], inv_emb[inv_rows])
+
+    # Finish equality on shared integer codes ('unknown' never matches)
+    codes, uniques = pd.factorize(pd.concat([rfq_frame['finish'], inv_frame['finish']], ignore_index=True))
+    unknown = np.flatnonzero(uniques == 'unknown')
+    a, b = codes[rfq_rows], codes[n_rfq + inv_rows]
+    family_scores['categorical'] = ((a == b) & ~np.isin(a, unknown)).astype(float)
+
+    scores = np.zeros(len(rfq_rows))
+    for family, weight in weights.items():
+        scores += weight * family_scores[family]
+    return scores
+
+
+# verbose=True prints the candidate funnel (the batch run; the service stays quiet)
+def match_inventory(rfq_frame, inv_frame, top_n=3, tolerance=0.05, weights=None, verbose=False):
+    with stage("candidates", rows_in=len(rfq_frame) * len(inv_frame)) as record:
+        rfq_rows, inv_rows = grade_candidates(rfq_frame, inv_frame)
+        n_grade = len(rfq_rows)
+        rfq_rows, inv_rows, n_checked = dimension_filter(rfq_frame, inv_frame, rfq_rows, inv_rows, tolerance)
+        record["rows_out"] = len(rfq_rows)
+    if verbose:
+        print(f"Candidate pairs: {len(rfq_frame) * len(inv_frame)} total -> "
+              f"{n_grade} grade/availability -> {len(rfq_rows)} within dimension range "
+              f"({n_checked} had a thickness/width on both sides to check)")
+        no_grade = rfq_frame['grade_normalized'].isna().sum()
+        if no_grade:
+            print(f"[!] {no_grade} RFQs without a grade left unmatched (grade constraint cannot be checked)")
+
+    with stage("similarity", rows_in=len(rfq_rows)) as record:
+        scores = score_pairs(rfq_frame, inv_frame, rfq_rows, inv_rows, weights)
+        rfq_rows, inv_rows, scores = pairs_topk(rfq_rows, inv_rows, scores, top_n)
+        record["rows_out"] = len(rfq_rows)
+
+    return pd.DataFrame({
+        'rfq_id': rfq_frame['id'].to_numpy()[rfq_rows],
+        'match_id': inv_frame['id'].to_numpy()[inv_rows],
+        'source': inv_frame['source'].to_numpy()[inv_rows],
+        'similarity_score': scores,
+    })
+
+
+# -------------------------------
+# Main inventory matching function
+# -------------------------------
+def compute_inventory_matches(rfq_file, reference_file, inventory_file, output_dir="outputs", top_n=3, tolerance=0.05):
+    print("Loading data...")
+    rfq_frame = load_feature_frame(rfq_file, reference_file, output_dir=output_dir)
+    inv_frame = inventory_feature_frame(pd.read_csv(inventory_file), load_references(reference_file))
+
+    print("Matching RFQs to inventory...")
+    matches = match_inventory(rfq_frame, inv_frame, top_n=top_n, tolerance=tolerance, verbose=True)
+
+    os.makedirs(output_dir, exist_ok=True)
+    out_path = os.path.join(output_dir, f"top{top_n}_inventory.csv")
+    write_result_frame(matches, out_path)
+
+    matched = matches['rfq_id'].nunique()
+    print(f"RFQs with at least one viable stock item: {matched}/{rfq_frame['id'].nunique()}")
+    print(f"[✓] Saved {out_path}")
+    return matches
@@ -0,0 +1,235 @@
+import os
+import re
+import json
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from src.instrumentation import stage
+
+# -------------------------------
+# Dependency-aware scenario runner
+# -------------------------------
+# Scenarios are stages of a DAG with declared inputs, outputs and upstream
+# stages. Independent stages run concurrently in a process pool, and a stage
+# is skipped (make-style) when the fingerprint of its inputs, code and
+# parameters matches the last successful run and its outputs still exist with
+# the content that run wrote (a digest per output is kept in the run state, so
+# a file rewritten by another stage or by hand makes its stage stale). Two
+# planned stages may not declare the same output.
+# Stages marked "inline" (the long-running similarity service) run in this
+# process instead of a pool worker, so they get the terminal's signals.
+# Inputs and outputs may be given as a callable returning the paths, so that
+# describing a stage does not import its scenario module.
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+RUN_STATE_FILE = ".run_state.json"
+
+_IMPORT_PATTERN = re.compile(r"^\s*(?:from\s+src\.(\w+)\s+import|from\s+src\s+import\s+([\w\s,]+)|import\s+src\.(\w+))", re.M)
+
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def stage_paths(stage, key):
+    paths = stage.get(key, [])
+    return list(paths() if callable(paths) else paths)
+
+
+# Source files of a src module and everything it imports from src (transitively)
+def module_closure(module):
+    seen, todo = set(), [module]
+    while todo:
+        name = todo.pop()
+        path = os.path.join(SRC_DIR, f"{name}.py")
+        if name in seen or not os.path.exists(path):
+            continue
+        seen.add(name)
+        with open(path, encoding="utf-8") as fh:
+            source = fh.read()
+        for match in _IMPORT_PATTERN.finditer(source):
+            if match.group(2):
+                todo.extend(part.strip() for part in match.group(2).split(",") if part.strip())
+            else:
+                todo.append(match.group(1) or match.group(3))
+    return sorted(os.path.join(SRC_DIR, f"{name}.py") for name in seen)
+
+
+def fingerprint(name, stage, params, extra_files=()):
+    digest = hashlib.sha256(name.encode())
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    files = stage_paths(stage, "inputs") + module_closure(stage["module"]) + list(extra_files)
+    for path in files:
+        digest.update(path.encode())
+        digest.update(file_digest(path).encode() if os.path.exists(path) else b"missing")
+    return digest.hexdigest()
+
+
+# {output path: content digest, or None when missing} of a stage
+def output_digests(stage):
+    return {path: file_digest(path) if os.path.exists(path) else None for path in stage_paths(stage, "outputs")}
+
+
+# Stage owning each declared output; raises when two stages write the same file
+def output_owners(stages, order):
+    owners = {}
+    for name in order:
+        for path in stage_paths(stages[name], "outputs"):
+            path = os.path.normpath(path)
+            if path in owners:
+                raise ValueError(f"Scenarios {owners[path]} and {name} both write {path}")
+            owners[path] = name
+    return owners
+
+
+def load_run_state(state_path):
+    if not os.path.exists(state_path):
+        return {}
+    try:
+        with open(state_path) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_run_state(state, state_path):
+    os.makedirs(os.path.dirname(state_path) or ".", exist_ok=True)
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, "w") as fh:
+        json.dump(state, fh, indent=2, sort_keys=True)
+    os.replace(tmp_path, state_path)
+
+
+# Requested stages plus everything upstream of them, in topological order
+def plan(stages, requested):
+    order, visiting = [], set()
+
+    def visit(name):
+        if name in order:
+            return
+        if name in visiting:
+            raise ValueError(f"Cycle in scenario graph at {name}")
+        if name not in stages:
+            raise ValueError(f"Unknown scenario: {name}")
+        visiting.add(name)
+        for dep in stages[name].get("deps", []):
+            visit(dep)
+        visiting.discard(name)
+        order.append(name)
+
+    for name in requested:
+        visit(name)
+    return order
+
+
+def _run_stage(name, func, params):
+    start = time.perf_counter()
+    with stage(f"scenario.{name}"):
+        func(**params)
+    return time.perf_counter() - start
+
+
+# Execute the plan: ready stages are submitted as soon as their upstream stages
+# finish; returns {stage: (status, seconds)} and prints a timing summary
+def run_dag(stages, requested, params=None, output_dir="outputs", jobs=None, force=False, extra_files=()):
+    params = params or {}
+    state_path = os.path.join(output_dir, RUN_STATE_FILE)
+    run_state = load_run_state(state_path)
+    order = plan(stages, requested)
+    output_owners(stages, order)
+    results = {}
+
+    def fresh(name):
+        stage = stages[name]
+        if force or stage.get("always"):
+            return None
+        fp = fingerprint(name, stage, params.get(name, {}), extra_files)
+        last = run_state.get(name)
+        if not isinstance(last, dict) or last.get("fingerprint") != fp:
+            return None
+        outputs = output_digests(stage)
+        if None in outputs.values():
+            return None
+        if outputs != last.get("outputs"):
+            print(f"[!] {name} outputs changed since its last run, rerunning")
+            return None
+        return fp
+
+    def finish(name, seconds):
+        results[name] = ("ran", seconds)
+        if not stages[name].get("always"):
+            # Fingerprint after the run, so the stage's own (re)generated inputs count
+            run_state[name] = {
+                "fingerprint": fingerprint(name, stages[name], params.get(name, {}), extra_files),
+                "outputs": output_digests(stages[name]),
+            }
+            save_run_state(run_state, state_path)
+
+    def ready(name):
+        return all(results.get(dep, ("pending",))[0] in ("ran", "skipped") for dep in stages[name].get("deps", []))
+
+    def blocked(name):
+        return any(results.get(dep, ("pending",))[0] in ("failed", "blocked") for dep in stages[name].get("deps", []))
+
+    pending = list(order)
+    wall_start = time.perf_counter()
+    pool = ProcessPoolExecutor(max_workers=jobs) if (jobs or 0) != 1 else None
+    running = {}
+    try:
+        while pending or running:
+            for name in list(pending):
+                if blocked(name):
+                    results[name] = ("blocked", 0.0)
+                    pending.remove(name)
+                elif ready(name):
+                    pending.remove(name)
+                    # Upstream stages that ran invalidate the skip check via the input hashes
+                    if fresh(name):
+                        print(f"[=] {name} is up to date, skipping")
+                        results[name] = ("skipped", 0.0)
+                        continue
+                    func = stages[name]["run"]
+                    # Resolve callable inputs now, so pool workers forked after this inherit their imports
+                    stage_paths(stages[name], "inputs")
+                    if pool is None or stages[name].get("inline"):
+                        try:
+                            finish(name, _run_stage(name, func, params.get(name, {})))
+                        except Exception as exc:
+                            print(f"[!] {name} failed: {exc}")
+                            results[name] = ("failed", 0.0)
+                    else:
+                        running[pool.submit(_run_stage, name, func, params.get(name, {}))] = name
+
+            if not running:
+                if pending and not any(ready(n) or blocked(n) for n in pending):
+                    raise RuntimeError(f"Scenarios cannot be scheduled: {pending}")
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    finish(name, future.result())
+                except Exception as exc:
+                    print(f"[!] {name} failed: {exc}")
+                    results[name] = ("failed", 0.0)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    print_summary(order, results, time.perf_counter() - wall_start)
+    return results
+
+
+def print_summary(order, results, wall_seconds):
+    print("\nStage timing summary:")
+    print(f"{'stage':<8}{'status':<10}{'seconds':>10}")
+    for name in order:
+        status, seconds = results.get(name, ("pending", 0.0))
+        print(f"{name:<8}{status:<10}{seconds:>10.2f}")
+    busy = sum(seconds for _, seconds in results.values())
+    print(f"{'total':<18}{wall_seconds:>10.2f}  (stage time {busy:.2f}s)")
@@ -0,0 +1,286 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import contextlib
+import numpy as np
+from src.pipeline import file_digest
+from src.instrumentation import stage
+
+try:
+    import fcntl
+except ImportError:  # no advisory locks (Windows): concurrent misses both compute
+    fcntl = None
+
+# -------------------------------
+# Similarity result cache
+# -------------------------------
+# Similarity computations are memoized on disk under <output_dir>/.similarity_cache,
+# one directory per entry:
+#   topk-<key>/     top_idx.npy, top_scores.npy, meta.json
+#   family-<key>/   scores.npy (one family's cosines between unique specs), meta.json
+# Keys hash (feature-matrix fingerprint, metric, families, weights, k). The
+# fingerprint is the feature store key, which covers the input files and the
+# feature code; the engine code (top-k, dedupe, scenario combination) is hashed
+# in as well, so neither new inputs nor new code can hit an old entry.
+#
+# Scenarios run in parallel (B, AB and C all need the default top-3), so a miss
+# takes a lock on the entry: the first process computes it, the others wait and
+# then hit. Entries are written to a temporary directory and renamed. A hit touches the entry's meta.json; after
+# every store the least recently used entries are dropped until the cache fits
+# the size cap. Every lookup appends a line to stats.jsonl, so scenarios run in
+# worker processes are counted too (run.py prints the totals of each run).
+#
+# RFQ_SIMILARITY_CACHE_MB sets the cap (run.py --cache-mb); 0 turns the cache off.
+
+CACHE_DIRNAME = ".similarity_cache"
+CACHE_VERSION = 1
+CACHE_ENV = "RFQ_SIMILARITY_CACHE_MB"
+DEFAULT_CACHE_MB = 512
+MAX_FAMILY_SPECS = 4096  # larger spec sets are scored tile by tile, never stored
+METRIC = "cosine"
+ENGINE_FILES = ["topk.py", "dedupe.py", "ablation_analysis.py", "result_cache.py"]
+STATS_FILE = "stats.jsonl"
+MAX_STATS_BYTES = 1 << 20  # the log keeps its newer half beyond this
+
+_ENGINE_VERSION = []
+
+
+def cache_max_bytes():
+    return int(float(os.environ.get(CACHE_ENV, DEFAULT_CACHE_MB)) * (1 << 20))
+
+
+def cache_enabled():
+    return cache_max_bytes() > 0
+
+
+def cache_dir_for(matrices):
+    # matrices live in <output_dir>/.feature_store/matrices-<key>
+    output_dir = os.path.dirname(os.path.dirname(os.path.abspath(matrices["path"])))
+    return os.path.join(output_dir, CACHE_DIRNAME)
+
+
+def engine_version():
+    if not _ENGINE_VERSION:
+        digest = hashlib.sha256(str(CACHE_VERSION).encode())
+        for name in ENGINE_FILES:
+            digest.update(file_digest(os.path.join(os.path.dirname(__file__), name)).encode())
+        _ENGINE_VERSION.append(digest.hexdigest())
+    return _ENGINE_VERSION[0]
+
+
+# Weights are rounded so that 0.3 and 0.30000000000000004 share an entry
+def cache_key(fingerprint, kind, **parts):
+    parts = {
+        name: {f: round(float(w), 12) for f, w in value.items()} if isinstance(value, dict) else value
+        for name, value in parts.items()
+    }
+    payload = json.dumps({"fingerprint": fingerprint, "kind": kind, "metric": METRIC, "engine": engine_version(),
+                          **parts}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def _entry_dir(cache_dir, kind, key):
+    return os.path.join(cache_dir, f"{kind}-{key}")
+
+
+def _log(cache_dir, event, kind, key, nbytes=0):
+    line = json.dumps({"time": time.time(), "pid": os.getpid(), "event": event, "kind": kind, "key": key,
+                       "bytes": nbytes})
+    with open(os.path.join(cache_dir, STATS_FILE), "a") as fh:
+        fh.write(line + "\n")
+
+
+@contextlib.contextmanager
+def _entry_lock(cache_dir, kind, key):
+    if fcntl is None:
+        yield
+        return
+    with open(f"{_entry_dir(cache_dir, kind, key)}.lock", "a") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _trim_log(cache_dir):
+    stats_path = os.path.join(cache_dir, STATS_FILE)
+    if os.path.exists(stats_path) and os.path.getsize(stats_path) > MAX_STATS_BYTES:
+        with open(stats_path) as fh:
+            lines = fh.readlines()
+        tmp_path = f"{stats_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as fh:
+            fh.writelines(lines[len(lines) // 2:])
+        os.replace(tmp_path, stats_path)
+
+
+def _entry_bytes(entry_dir):
+    return sum(entry.stat().st_size for entry in os.scandir(entry_dir) if entry.is_file())
+
+
+# {name: array} of an entry (memory-mapped), or None on a miss
+def load_entry(cache_dir, kind, key):
+    entry_dir = _entry_dir(cache_dir, kind, key)
+    meta_path = os.path.join(entry_dir, "meta.json")
+    try:
+        with open(meta_path) as fh:
+            names = json.load(fh)["arrays"]
+        arrays = {name: np.load(os.path.join(entry_dir, f"{name}.npy"), mmap_mode="r") for name in names}
+        os.utime(meta_path)  # mark as recently used
+    except (OSError, ValueError, KeyError):
+        _log(cache_dir, "miss", kind, key)
+        return None
+    _log(cache_dir, "hit", kind, key, _entry_bytes(entry_dir))
+    evict(cache_dir, keep=os.path.basename(entry_dir))  # applies a lowered cap
+    return arrays
+
+
+def store_entry(cache_dir, kind, key, arrays, **meta):
+    nbytes = sum(np.asarray(a).nbytes for a in arrays.values())
+    if nbytes > cache_max_bytes():
+        return
+    entry_dir = _entry_dir(cache_dir, kind, key)
+    tmp_dir = f"{entry_dir}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), array)
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as fh:
+        json.dump({"key": key, "kind": kind, "arrays": list(arrays), "created": time.time(), **meta}, fh,
+                  default=str)
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:  # another process stored the same entry first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    evict(cache_dir, keep=os.path.basename(entry_dir))
+    _trim_log(cache_dir)
+
+
+# Drop least recently used entries until the cache fits max_bytes
+def evict(cache_dir, keep=None, max_bytes=None):
+    max_bytes = cache_max_bytes() if max_bytes is None else max_bytes
+    entries = []
+    for entry in os.scandir(cache_dir):
+        meta_path = os.path.join(entry.path, "meta.json")
+        if entry.is_dir() and not entry.name.endswith(".tmp") and os.path.exists(meta_path):
+            entries.append((os.path.getmtime(meta_path), entry.name, _entry_bytes(entry.path)))
+    total = sum(nbytes for *_, nbytes in entries)
+    for _, name, nbytes in sorted(entries):
+        if total <= max_bytes:
+            break
+        if name != keep:
+            shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(cache_dir, f"{name}.lock"))
+            kind, _, key = name.partition("-")
+            _log(cache_dir, "evict", kind, key, nbytes)
+            total -= nbytes
+
+
+# -------------------------------
+# Cached computations
+# -------------------------------
+def _topk_key(matrices, weights, k):
+    return cache_key(matrices["key"], "topk", families=sorted(weights), weights=weights, k=k)
+
+
+# Cached (top_idx, top_scores) of one weighting over the feature matrices, or None
+def lookup_topk(matrices, weights, k, label="top-k"):
+    if not cache_enabled():
+        return None
+    cache_dir = cache_dir_for(matrices)
+    os.makedirs(cache_dir, exist_ok=True)
+    key = _topk_key(matrices, weights, k)
+    with stage("cache_lookup", kind="topk", label=label) as record:
+        entry = load_entry(cache_dir, "topk", key)
+        record["hit"] = entry is not None
+    if entry is None:
+        return None
+    print(f"Loaded {label} from similarity cache ({key})")
+    return np.asarray(entry["top_idx"]), np.asarray(entry["top_scores"])
+
+
+def store_topk(matrices, weights, k, top_idx, top_scores, label="top-k"):
+    if cache_enabled():
+        cache_dir = cache_dir_for(matrices)
+        os.makedirs(cache_dir, exist_ok=True)
+        store_entry(cache_dir, "topk", _topk_key(matrices, weights, k),
+                    {"top_idx": top_idx, "top_scores": top_scores}, label=label, weights=weights, k=k)
+
+
+# Top-k lists of one weighting; compute() runs on a miss and returns (top_idx, top_scores)
+def cached_topk(matrices, weights, k, compute, label="top-k"):
+    if not cache_enabled():
+        return compute()
+    cache_dir = cache_dir_for(matrices)
+    os.makedirs(cache_dir, exist_ok=True)
+    with _entry_lock(cache_dir, "topk", _topk_key(matrices, weights, k)):
+        result = lookup_topk(matrices, weights, k, label)
+        if result is None:
+            result = compute()
+            store_topk(matrices, weights, k, *result, label=label)
+    return result
+
+
+# One family's (u, u) cosines between unique specs (spec_families fixes how rows
+# were grouped into specs); compute() runs on a miss. Returns None, so callers
+# score tile by tile, when the spec set is too large to keep.
+def cached_family_scores(matrices, family, spec_families, n_specs, compute):
+    if not cache_enabled() or n_specs > MAX_FAMILY_SPECS:
+        return None
+    cache_dir = cache_dir_for(matrices)
+    os.makedirs(cache_dir, exist_ok=True)
+    key = cache_key(matrices["key"], "family", family=family, specs=list(spec_families))
+
+    with stage("cache_lookup", kind="family", label=family) as record:
+        entry = load_entry(cache_dir, "family", key)
+        record["hit"] = entry is not None
+    if entry is not None:
+        return entry["scores"]
+
+    scores = compute()
+    store_entry(cache_dir, "family", key, {"scores": scores}, family=family, specs=list(spec_families))
+    return scores
+
+
+# -------------------------------
+# Hit / miss statistics
+# -------------------------------
+# {"hits", "misses", "evictions", "hit_bytes", "entries", "bytes"} for lookups since `since`
+def cache_stats(cache_dir, since=0.0):
+    counts = {"hit": 0, "miss": 0, "evict": 0}
+    hit_bytes = 0
+    stats_path = os.path.join(cache_dir, STATS_FILE)
+    if os.path.exists(stats_path):
+        with open(stats_path) as fh:
+            for line in fh:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if event["time"] >= since:
+                    counts[event["event"]] += 1
+                    hit_bytes += event["bytes"] if event["event"] == "hit" else 0
+    entries = [e for e in os.scandir(cache_dir) if e.is_dir() and not e.name.endswith(".tmp")] \
+        if os.path.isdir(cache_dir) else []
+    return {
+        "hits": counts["hit"],
+        "misses": counts["miss"],
+        "evictions": counts["evict"],
+        "hit_bytes": hit_bytes,
+        "entries": len(entries),
+        "bytes": sum(_entry_bytes(e.path) for e in entries),
+    }
+
+
+def print_cache_stats(output_dir="outputs", since=0.0):
+    cache_dir = os.path.join(output_dir, CACHE_DIRNAME)
+    stats = cache_stats(cache_dir, since)
+    lookups = stats["hits"] + stats["misses"]
+    if lookups:
+        print(f"Similarity cache: {stats['hits']}/{lookups} hits, {stats['misses']} misses, "
+              f"{stats['evictions']} evicted; {stats['entries']} entries, "
+              f"{stats['bytes'] / (1 << 20):.1f} / {cache_max_bytes() / (1 << 20):.0f} MB")
+    return stats
@@ -1,8 +1,16 @@
 import os
 import pandas as pd
 import numpy as np
-from sklearn.preprocessing import MinMaxScaler
-from sklearn.metrics.pairwise import cosine_similarity
+from src.instrumentation import stage, timed
+from src.topk import blocked_topk, topk_frame, pairs_topk, pairs_frame
+from src.interval_index import corpus_candidates
+from src.dedupe import spec_groups, dedupe_topk
+from src.topk_output import write_topk
+
+DIM_COLS = ['thickness_min','thickness_max','width_min','width_max','weight_min','weight_max']
+CAT_COLS = ['coating','finish','form','surface_type','surface_protection']
+SIMILARITY_WEIGHTS = {'dimensional':0.4,'grade_properties':0.3,'categorical':0.3}
+
 # Handels missing data and extract only relevant parts of the grade strings
 def normalize_grade_keys(grade_str):
     if pd.isna(grade_str) or grade_str == '':
@@ -33,6 +41,35 @@ def parse_range_value(value_str):
     except:
         return None, None, None
 
+# Vectorized parse_range_value: each distinct string is parsed once with str.extract /
+# str.replace (handles ≤/≥ prefixes, "a-b" ranges and units) and the results are
+# broadcast back to every row. Returns a frame with min / max / mid columns.
+_RANGE_PATTERN = r'^(?P<lo>[^-]*)-(?P<hi>[^-]*)$'
+
+def _to_number(text):
+    return pd.to_numeric(text.str.replace(r'[^0-9.]', '', regex=True), errors='coerce')
+
+def parse_range_series(series):
+    codes, uniques = pd.factorize(series)
+    raw = pd.Series(uniques, dtype=object)
+    text = raw.astype(str).str.strip()
+
+    parts = text.str.extract(_RANGE_PATTERN)
+    lo, hi = _to_number(parts['lo']), _to_number(parts['hi'])
+    is_range = lo.notna() & hi.notna()
+
+    single = _to_number(text)
+    single[raw.isin(['', '-'])] = np.nan
+
+    parsed = pd.DataFrame({
+        'min': np.where(is_range, lo, single),
+        'max': np.where(is_range, hi, single),
+        'mid': np.where(is_range, (lo + hi) / 2, single),
+    })
+    # Broadcast back to rows (factorize code -1 = missing)
+    values = np.vstack([parsed.to_numpy(dtype=float), np.full((1, 3), np.nan)])
+    return pd.DataFrame(values[codes], columns=['min', 'max', 'mid'], index=series.index)
+
 # Numeric conversion of dimensions and grades, handling missing data, categorical normalization
 def engineer_features(df):
     feature_df = df.copy()
@@ -54,10 +91,10 @@ def engineer_features(df):
     grade_cols = ['Carbon (C)','Manganese (Mn)','Silicon (Si)','Tensile strength (Rm)','Yield strength (Re or Rp0.2)']
     for col in grade_cols:
         if col in feature_df.columns:
-            parsed = feature_df[col].apply(parse_range_value)
-            feature_df[f'{col}_min'] = [x[0] for x in parsed]
-            feature_df[f'{col}_max'] = [x[1] for x in parsed]
-            feature_df[f'{col}_mid'] = [x[2] for x in parsed]
+            parsed = parse_range_series(feature_df[col])
+            feature_df[f'{col}_min'] = parsed['min']
+            feature_df[f'{col}_max'] = parsed['max']
+            feature_df[f'{col}_mid'] = parsed['mid']
 
     # Categorical columns
     cat_cols = ['coating','finish','form','surface_type','surface_protection']
@@ -66,63 +103,281 @@ def engineer_features(df):
             feature_df[col] = feature_df[col].fillna('unknown').str.lower()
 
     return feature_df
-# computig weighted cosine similarity for different feature sets
-def vectorized_similarity(feature_df, top_n=3):
-    df = feature_df.copy()
+# Fitted per-family encoders (MinMax scalers, grade columns, categorical levels).
+# scikit-learn is imported here and in embed_matrices rather than at module level:
+# scenario A reaches this module through the feature store and never encodes.
+def fit_family_encoders(feature_df, families=None):
+    from sklearn.preprocessing import MinMaxScaler
+    if families is None:
+        families = list(SIMILARITY_WEIGHTS)
+    df = feature_df
+    encoders = {}
 
     # Dimensional features
-    dim_cols = ['thickness_min','thickness_max','width_min','width_max','weight_min','weight_max']
-    dim_matrix = df[dim_cols].fillna(0).values
-    dim_matrix = MinMaxScaler().fit_transform(dim_matrix)
-    dim_sim = cosine_similarity(dim_matrix)
+    if 'dimensional' in families:
+        encoders['dimensional'] = {'cols': DIM_COLS, 'scaler': MinMaxScaler().fit(df[DIM_COLS].fillna(0).values)}
 
     # Grade midpoints
-    grade_cols = [col for col in df.columns if '_mid' in col]
-    grade_matrix = df[grade_cols].fillna(0).values
-    grade_matrix = MinMaxScaler().fit_transform(grade_matrix)
-    grade_sim = cosine_similarity(grade_matrix)
+    if 'grade_properties' in families:
+        grade_cols = [col for col in df.columns if '_mid' in col]
+        encoders['grade_properties'] = {'cols': grade_cols, 'scaler': MinMaxScaler().fit(df[grade_cols].fillna(0).values)}
 
-    # Categorical similarity (one-hot)
-    cat_cols = ['coating','finish','form','surface_type','surface_protection']
-    cat_matrix = pd.get_dummies(df[cat_cols], dummy_na=True)
-    cat_sim = cosine_similarity(cat_matrix)
+    # Categorical features (levels per column, in order of appearance)
+    if 'categorical' in families:
+        encoders['categorical'] = {
+            'cols': CAT_COLS,
+            'levels': {col: list(pd.unique(_category_values(df, col))) for col in CAT_COLS},
+        }
+
+    return encoders
+
+# Missing values are a level of their own (as get_dummies(dummy_na=True) had it)
+MISSING_LEVEL = '__missing__'
+
+def _category_values(feature_df, col):
+    values = feature_df[col].astype(object)
+    return values.where(values.notna(), MISSING_LEVEL)
+
+# (n, n_cols) int32 level codes; levels unseen at fit time are -1
+def categorical_codes(feature_df, enc):
+    codes = np.empty((len(feature_df), len(enc['cols'])), dtype=np.int32)
+    for j, col in enumerate(enc['cols']):
+        codes[:, j] = pd.Categorical(_category_values(feature_df, col), categories=enc['levels'][col]).codes
+    return codes
+
+# Unnormalised family matrices under already fitted encoders. Values outside
+# [0, 1] mean the rows lie outside the range the scalers were fitted on.
+# The categorical family is kept as integer codes, never as a dense one-hot.
+def transform_family_matrices(feature_df, encoders):
+    matrices = {}
+    for family, enc in encoders.items():
+        if 'scaler' in enc:
+            matrices[family] = enc['scaler'].transform(feature_df[enc['cols']].fillna(0).values)
+        else:
+            matrices[family] = categorical_codes(feature_df, enc)
+    return matrices
+
+# Grow the categorical levels with values first seen in feature_df (new levels
+# get new codes, so codes of existing rows do not change)
+def extend_categorical_levels(encoders, feature_df):
+    enc = encoders.get('categorical')
+    if enc is None:
+        return []
+    new_levels = []
+    for col in enc['cols']:
+        known = set(enc['levels'][col])
+        added = [level for level in pd.unique(_category_values(feature_df, col)) if level not in known]
+        enc['levels'][col] = enc['levels'][col] + added
+        new_levels += [(col, level) for level in added]
+    return new_levels
+
+# Embeddings from family matrices: numeric families are L2-normalised, so cosine
+# similarity is a plain dot product; categorical codes are used as they are
+def embed_matrices(matrices):
+    from sklearn.preprocessing import normalize
+    return {family: matrix if family == 'categorical' else normalize(matrix) for family, matrix in matrices.items()}
+
+def transform_families(feature_df, encoders):
+    return embed_matrices(transform_family_matrices(feature_df, encoders))
+
+def family_embeddings(feature_df, families=None):
+    return transform_families(feature_df, fit_family_encoders(feature_df, families))
+
+# Categorical cosine from codes: every row has exactly one level per column, so
+# the cosine of the one-hot rows is the share of columns with equal codes.
+# Unseen levels (-1) never match.
+def categorical_tile(codes_a, codes_b):
+    matches = np.zeros((len(codes_a), len(codes_b)), dtype=np.int16)
+    for j in range(codes_a.shape[1]):
+        col_b = np.where(codes_b[:, j] < 0, -2, codes_b[:, j])
+        matches += codes_a[:, j, None] == col_b[None, :]
+    return matches / codes_a.shape[1]
+
+def categorical_pair_scores(codes_a, codes_b):
+    return ((codes_a == codes_b) & (codes_a >= 0)).sum(axis=1) / codes_a.shape[1]
+
+# Normalised one-hot of the codes as a sparse CSR matrix, for consumers that
+# need vectors (KMeans partitions); its dot products equal categorical_tile
+def categorical_onehot(codes, enc):
+    from scipy import sparse
+    widths = np.array([len(enc['levels'][col]) for col in enc['cols']])
+    offsets = np.concatenate(([0], np.cumsum(widths)[:-1]))
+    rows, cols = np.nonzero(codes >= 0)
+    data = np.full(len(rows), 1.0 / np.sqrt(codes.shape[1]))
+    return sparse.csr_matrix((data, (rows, offsets[cols] + codes[rows, cols])), shape=(len(codes), widths.sum()))
+
+# Cosine tile of one family between two sets of embedded rows
+def family_tile(family, emb_a, emb_b):
+    if family == 'categorical':
+        return categorical_tile(emb_a, emb_b)
+    return emb_a @ emb_b.T
+
+# Cosine tile of each family for one (rows, cols) block
+def family_tiles(embeddings, families, rows, cols):
+    tiles = {}
+    for family in families:
+        with timed(f"family.{family}"):
+            tiles[family] = family_tile(family, embeddings[family][rows], embeddings[family][cols])
+    return tiles
+
+# Weighted sum of family tiles (in weights order)
+def combine_tiles(tiles, weights):
+    total = None
+    with timed("combine"):
+        for family, weight in weights.items():
+            part = weight * tiles[family]
+            total = part if total is None else total + part
+    return total
+
+# Weighted sum of the family cosines for one (rows, cols) tile
+def weighted_tile(embeddings, weights, rows, cols):
+    return combine_tiles(family_tiles(embeddings, weights, rows, cols), weights)
+
+# Weighted family cosines for explicit (row, col) pairs
+def pair_scores(embeddings, weights, rows, cols):
+    total = None
+    for family, weight in weights.items():
+        emb = embeddings[family]
+        with timed(f"family.{family}"):
+            if family == 'categorical':
+                part = weight * categorical_pair_scores(emb[rows], emb[cols])
+            else:
+                part = weight * np.einsum('ij,ij->i', emb[rows], emb[cols])
+        total = part if total is None else total + part
+    return total
+
+# Exact top-k over precomputed family embeddings (e.g. the memory-mapped feature
+# matrices) as (top_idx, top_scores); self stays a zero-score candidate. With
+# dedupe, rows with identical embeddings are scored once and the results
+# expanded back per row (src/dedupe.py).
+def embedding_topk(embeddings, top_n=3, block_size=1024, weights=None, dedupe=True):
+    if weights is None:
+        weights = SIMILARITY_WEIGHTS
+    n = len(embeddings[next(iter(weights))])
+    first_rows, inverse, _ = spec_groups(*(embeddings[f] for f in weights)) if dedupe else (None, None, None)
+
+    if first_rows is not None and len(first_rows) < n:
+        unique = {f: embeddings[f][first_rows] for f in weights}
+        specs = np.arange(len(first_rows))
+        return dedupe_topk(
+            lambda rows, cols: weighted_tile(unique, weights, rows, cols),
+            pair_scores(unique, weights, specs, specs), inverse, top_n, block_size=block_size,
+        )
+    return blocked_topk(
+        lambda rows, cols: weighted_tile(embeddings, weights, rows, cols),
+        n, top_n, block_size=block_size, symmetric=True,
+        self_score=0.0,  # Exclude self (zero score, as before)
+    )
+
+# -------------------------------
+# Single-GEMM weighted embedding
+# -------------------------------
+# Every family term is a dot product of L2-normalised blocks (the categorical
+# one-hot scaled by 1/sqrt(C)), so the weighted score equals one dot product over
+# the blocks scaled by sqrt(weight) and concatenated. A score tile is then one
+# float64 matrix product. The feature matrices store this embedding for
+# SIMILARITY_WEIGHTS; the IVF index and the sharded engine use it as well.
+def weighted_embedding(embeddings, encoders, weights=None):
+    if weights is None:
+        weights = SIMILARITY_WEIGHTS
+    blocks = []
+    for family, weight in weights.items():
+        emb = embeddings[family]
+        if family == 'categorical':
+            emb = categorical_onehot(emb, encoders[family]).toarray()
+        blocks.append(np.sqrt(weight) * np.asarray(emb, dtype=np.float64))
+    return np.ascontiguousarray(np.hstack(blocks), dtype=np.float64)
+
+def gemm_tile(weighted_a, weighted_b):
+    with timed("gemm"):
+        return weighted_a @ weighted_b.T
+
+# Scores of explicit (row, col) pairs, in chunks to bound the gathered rows
+def weighted_pair_scores(weighted, rows, cols, chunk_size=1 << 18):
+    scores = np.empty(len(rows), dtype=np.float64)
+    for start in range(0, len(rows), chunk_size):
+        part = slice(start, start + chunk_size)
+        scores[part] = np.einsum('ij,ij->i', weighted[rows[part]], weighted[cols[part]])
+    return scores
 
-    # Weighted aggregate
-    aggregate_sim = 0.4*dim_sim + 0.3*grade_sim + 0.3*cat_sim
-    np.fill_diagonal(aggregate_sim, 0)  # Exclude self
+# Exact top-k over a weighted embedding as (top_idx, top_scores); self stays a
+# zero-score candidate. Identical rows are scored once (src/dedupe.py).
+def weighted_topk(weighted, top_n=3, block_size=1024, dedupe=True):
+    n = len(weighted)
+    first_rows, inverse, _ = spec_groups(weighted) if dedupe else (None, None, None)
 
-    results = []
-    for i, rfq_id in enumerate(df['id']):
-        top_indices = aggregate_sim[i].argsort()[::-1][:top_n]
-        for idx in top_indices:
-            results.append({
-                'rfq_id': rfq_id,
-                'match_id': df.iloc[idx]['id'],
-                'similarity_score': aggregate_sim[i, idx]
-            })
+    if first_rows is not None and len(first_rows) < n:
+        unique = np.ascontiguousarray(weighted[first_rows])
+        return dedupe_topk(
+            lambda rows, cols: gemm_tile(unique[rows], unique[cols]),
+            np.einsum('ij,ij->i', unique, unique), inverse, top_n, block_size=block_size,
+        )
+    return blocked_topk(
+        lambda rows, cols: gemm_tile(weighted[rows], weighted[cols]),
+        n, top_n, block_size=block_size, symmetric=True, self_score=0.0,
+    )
 
-    return pd.DataFrame(results)
+# Top-k corpus rows for rows encoded outside the corpus (e.g. service queries
+# under the corpus encoders), both as weighted embeddings. self_rows[i] is the
+# corpus row of query i or -1; that row is excluded. Returns (top_idx,
+# top_scores), shape (n_queries, k).
+def query_topk(query_weighted, corpus_weighted, top_n=3, block_size=4096, self_rows=None):
+    def tile_fn(rows, cols):
+        tile = gemm_tile(query_weighted[rows], corpus_weighted[cols])
+        if self_rows is not None:
+            tile[self_rows[rows][:, None] == np.arange(cols.start, cols.stop)[None, :]] = -np.inf
+        return tile
 
-def compute_top3(rfq_file, reference_file, output_file='top3.csv', output_dir='outputs'):
-    print("Loading RFQ and reference data...")
-    rfqs = pd.read_csv(rfq_file)
-    references = pd.read_csv(reference_file, sep='\t')
+    return blocked_topk(tile_fn, len(query_weighted), top_n, block_size=block_size, n_cols=len(corpus_weighted))
 
-    # Normalize grades
-    rfqs['grade_normalized'] = rfqs['grade'].apply(normalize_grade_keys)
-    references['grade_normalized'] = references['Grade/Material'].apply(normalize_grade_keys)
+# computig weighted cosine similarity for different feature sets.
+# Works on block_size x block_size tiles of the upper triangle (cosine is
+# symmetric) and keeps a running top-k per row, so memory is O(n*k + block_size^2).
+# Each tile is one matrix product over the weighted embedding.
+# With tolerance set, an interval index over thickness/width/weight generates
+# candidates first and only pairs whose ranges overlap (within tolerance) are scored.
+# A precomputed weighted embedding (in feature_df row order) skips the encoding step.
+def vectorized_similarity(feature_df, top_n=3, block_size=1024, tolerance=None, weighted=None):
+    n = len(feature_df)
+    if weighted is None:
+        with stage("embed", rows_in=n):
+            encoders = fit_family_encoders(feature_df)
+            weighted = weighted_embedding(transform_families(feature_df, encoders), encoders)
 
-    # Merge
-    merged_df = rfqs.merge(references, on='grade_normalized', how='left', suffixes=('','_ref'))
+    with stage("similarity", rows_in=n, mode="exact" if tolerance is None else "candidates") as record:
+        if tolerance is not None:
+            rows, cols = corpus_candidates(feature_df, tolerance)
+            record["pairs"] = len(rows)
+            scores = weighted_pair_scores(weighted, rows, cols)
+            result = pairs_frame(feature_df['id'].values, *pairs_topk(rows, cols, scores, top_n))
+        else:
+            result = topk_frame(feature_df['id'].values, *weighted_topk(weighted, top_n, block_size))
+        record["rows_out"] = len(result)
+    return result
 
-    print("Engineering features...")
-    feature_df = engineer_features(merged_df)
+# Reads the memory-mapped feature matrices; the feature frame itself is not loaded.
+# The result goes through the similarity cache (shared with the ablation
+# all_features scenario and the scenario C baseline). Returns the top-3 frame,
+# or the (top_idx, top_scores) arrays with as_arrays=True.
+def compute_top3(rfq_file, reference_file, output_file='top3.csv', output_dir='outputs', block_size=1024,
+                 as_arrays=False):
+    from src.feature_store import load_feature_matrices
+    from src.result_cache import cached_topk
+    matrices = load_feature_matrices(rfq_file, reference_file, output_dir=output_dir)
 
     print("Calculating top-3 similarities...")
-    top3_df = vectorized_similarity(feature_df)
+    with stage("similarity", rows_in=matrices['rows'], mode="exact") as record:
+        top_idx, top_scores = cached_topk(
+            matrices, matrices['weights'], 3,
+            lambda: weighted_topk(matrices['weighted'], block_size=block_size), label="top-3",
+        )
+        record["rows_out"] = top_idx.size
 
+    # Written block by block from the arrays (see topk_output)
     os.makedirs(output_dir, exist_ok=True)
     out_path = os.path.join(output_dir, output_file)
-    top3_df.to_csv(out_path, index=False)
+    write_topk(out_path, matrices['ids'], top_idx, top_scores)
     print(f"[✓] Saved {out_path}")
-    return top3_df
+    if as_arrays:
+        return top_idx, top_scores
+    return topk_frame(matrices['ids'], top_idx, top_scores)
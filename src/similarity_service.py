@@ -0,0 +1,290 @@
+import os
+import json
+import time
+import signal
+import asyncio
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from src.feature_store import load_feature_matrices, load_references, rfq_features
+from src.grade_resolution import build_grade_index
+from src.rfq_similarity import DIM_COLS, CAT_COLS, transform_families, weighted_embedding, query_topk
+from src.inventory_matching import inventory_feature_frame, match_inventory
+
+# -------------------------------
+# Local similarity service
+# -------------------------------
+# A long-running asyncio HTTP server (TCP or Unix socket) that loads the
+# feature matrices, fitted encoders, reference properties and inventory once.
+# RFQ specs arrive as JSON and go through the same normalize_grade_keys /
+# engineer_features path as the batch pipeline (feature_store.rfq_features).
+#
+# Concurrent requests are micro-batched: the batcher takes the first waiting
+# request, collects more for up to max_wait_ms (or max_batch specs), and scores
+# them in one vectorized call on a worker thread, so the event loop keeps
+# accepting connections meanwhile.
+#
+#   POST /similar  {"specs": [{...}, ...] | "spec": {...}, "k": 3, "target": "rfqs" | "inventory"}
+#   GET  /stats    request / batch counts and latency percentiles (ms)
+#   GET  /health
+
+DEFAULT_PORT = 8765
+MAX_BATCH = 256
+MAX_WAIT_MS = 5.0
+MAX_K = 100
+LATENCY_WINDOW = 10_000
+PERCENTILES = [50, 90, 95, 99]
+TARGETS = ["rfqs", "inventory"]
+
+
+class RequestError(ValueError):
+    pass
+
+
+class SimilarityService:
+    def __init__(self, rfq_file, reference_file, inventory_file=None, output_dir="outputs",
+                 max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS):
+        matrices = load_feature_matrices(rfq_file, reference_file, output_dir=output_dir)
+        self.encoders = matrices["encoders"]
+        self.weighted = matrices["weighted"]
+        self.weights = matrices["weights"]
+        self.ids = matrices["ids"]
+        rows = pd.Series(np.arange(len(self.ids)), index=pd.Index(self.ids))
+        self.id_rows = rows[~rows.index.duplicated()]  # id index: corpus row of each id
+        self.references = load_references(reference_file)
+        self.grade_index = build_grade_index(self.references)  # resolutions are memoized across requests
+
+        self.inventory = None
+        if inventory_file and os.path.exists(inventory_file):
+            self.inventory = inventory_feature_frame(pd.read_csv(inventory_file), self.references)
+
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.counts = collections.Counter()
+
+    # --- scoring (runs on the worker thread) ---
+
+    # JSON specs -> engineered frame, one row per spec in request order
+    def engineer(self, specs):
+        rfqs = pd.DataFrame(specs)
+        for col in ["id", "grade"] + DIM_COLS + CAT_COLS:
+            if col not in rfqs.columns:
+                rfqs[col] = np.nan
+        rfqs["_spec"] = np.arange(len(rfqs))
+        frame = rfq_features(rfqs, self.references, self.grade_index)
+        return frame.drop_duplicates("_spec").sort_values("_spec").reset_index(drop=True)
+
+    def score_rfqs(self, specs, k):
+        frame = self.engineer(specs)
+        query_weighted = weighted_embedding(transform_families(frame, self.encoders), self.encoders, self.weights)
+        query_ids = frame["id"].where(frame["id"].isna(), frame["id"].astype(str))
+        self_rows = self.id_rows.reindex(query_ids).fillna(-1).to_numpy(dtype=np.int64)
+        top_idx, top_scores = query_topk(query_weighted, self.weighted, k, self_rows=self_rows)
+
+        results = []
+        for idx, scores in zip(top_idx, top_scores):
+            keep = np.isfinite(scores)
+            results.append([
+                {"match_id": str(self.ids[i]), "similarity_score": float(s)} for i, s in zip(idx[keep], scores[keep])
+            ])
+        return results
+
+    # Grade scalers are fitted on the stock alone (match_inventory), so answers
+    # do not depend on which requests share the micro-batch
+    def score_inventory(self, specs, k):
+        if self.inventory is None:
+            raise RequestError("no inventory loaded; run scenario A first")
+        frame = self.engineer(specs)
+        frame["id"] = np.arange(len(frame))
+        matches = match_inventory(frame, self.inventory, top_n=k)
+        results = [[] for _ in range(len(frame))]
+        for row in matches.itertuples(index=False):
+            results[row.rfq_id].append(
+                {"match_id": row.match_id, "source": row.source, "similarity_score": float(row.similarity_score)}
+            )
+        return results
+
+    def score(self, target, specs, k):
+        return self.score_rfqs(specs, k) if target == "rfqs" else self.score_inventory(specs, k)
+
+    # --- micro-batching ---
+
+    async def submit(self, target, specs, k):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((target, specs, k, future))
+        return await future
+
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            n_specs = len(batch[0][1])
+            deadline = loop.time() + self.max_wait
+            while n_specs < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                n_specs += len(item[1])
+
+            for target in TARGETS:
+                group = [item for item in batch if item[0] == target]
+                if group:
+                    await self._run_group(loop, target, group)
+
+    # One scoring call for every request of a target; results are split back
+    async def _run_group(self, loop, target, group):
+        specs = [spec for _, item_specs, _, _ in group for spec in item_specs]
+        k = max(item[2] for item in group)
+        self.counts["batches"] += 1
+        self.counts["batched_specs"] += len(specs)
+        try:
+            results = await loop.run_in_executor(self.executor, self.score, target, specs, k)
+        except Exception as exc:
+            for *_, future in group:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        offset = 0
+        for _, item_specs, item_k, future in group:
+            part = [matches[:item_k] for matches in results[offset:offset + len(item_specs)]]
+            offset += len(item_specs)
+            if not future.done():
+                future.set_result(part)
+
+    # --- HTTP ---
+
+    def stats(self):
+        latencies = np.array(self.latencies)
+        pct = lambda q: float(np.percentile(latencies, q)) if len(latencies) else None  # JSON has no NaN
+        return {
+            "requests": self.counts["requests"],
+            "errors": self.counts["errors"],
+            "batches": self.counts["batches"],
+            "mean_batch_specs": self.counts["batched_specs"] / max(self.counts["batches"], 1),
+            "latency_ms": {
+                **{f"p{p}": pct(p) for p in PERCENTILES},
+                "max": pct(100),
+                "window": len(self.latencies),
+            },
+            "corpus_rows": len(self.ids),
+            "inventory_rows": 0 if self.inventory is None else len(self.inventory),
+        }
+
+    async def handle_similar(self, body):
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            raise RequestError("body is not valid JSON")
+        specs = payload.get("specs", [payload["spec"]] if "spec" in payload else None)
+        if not isinstance(specs, list) or not specs or not all(isinstance(s, dict) for s in specs):
+            raise RequestError('expected "specs": [ {...}, ... ] or "spec": {...}')
+        target = payload.get("target", "rfqs")
+        if target not in TARGETS:
+            raise RequestError(f"target must be one of {TARGETS}")
+        k = payload.get("k", 3)
+        if not isinstance(k, int) or not 1 <= k <= MAX_K:
+            raise RequestError(f"k must be an integer in [1, {MAX_K}]")
+        return {"target": target, "k": k, "results": await self.submit(target, specs, k)}
+
+    async def route(self, method, path, body):
+        if method == "POST" and path == "/similar":
+            return 200, await self.handle_similar(body)
+        if method == "GET" and path == "/stats":
+            return 200, self.stats()
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok"}
+        return 404, {"error": f"no route for {method} {path}"}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                start = time.perf_counter()
+                try:
+                    status, payload = await self.route(method, path.split("?")[0], body)
+                except RequestError as exc:
+                    status, payload = 400, {"error": str(exc)}
+                except Exception as exc:
+                    status, payload = 500, {"error": repr(exc)}
+                if path.startswith("/similar"):
+                    self.counts["requests"] += 1
+                    self.counts["errors"] += status != 200
+                    self.latencies.append(1000 * (time.perf_counter() - start))
+
+                data = json.dumps(payload).encode()
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=DEFAULT_PORT, socket_path=None):
+        self.queue = asyncio.Queue()
+        batcher = asyncio.create_task(self._batcher())
+        if socket_path:
+            server = await asyncio.start_unix_server(self.handle_connection, path=socket_path)
+            where = socket_path
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+            where = f"http://{host}:{port}"
+        print(f"[✓] Similarity service listening on {where} "
+              f"(batches of up to {self.max_batch} specs, {self.max_wait * 1000:.1f} ms window)")
+
+        # Ctrl+C / SIGTERM stop the server cleanly
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(sig)
+            batcher.cancel()
+            self.executor.shutdown(wait=False)
+
+
+# -------------------------------
+# Main service function
+# -------------------------------
+def run_service(rfq_file, reference_file, inventory_file=None, output_dir="outputs", host="127.0.0.1",
+                port=DEFAULT_PORT, socket_path=None, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS):
+    print("Loading feature matrices, encoders and references...")
+    service = SimilarityService(rfq_file, reference_file, inventory_file, output_dir, max_batch, max_wait_ms)
+    try:
+        asyncio.run(service.serve(host, port, socket_path))
+    finally:
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+        print(json.dumps(service.stats(), indent=2))
@@ -0,0 +1,107 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+from src.data_cleaning import SUPPLIER_ADAPTERS
+
+# -------------------------------
+# Synthetic RFQs and supplier sheets
+# -------------------------------
+# Rows are bootstrapped from the real files, so categorical distributions and
+# the mix of filled / empty columns follow the sample data. Grades are mostly
+# redrawn from reference_properties.tsv (a share keeps the original RFQ grade,
+# which includes grades without reference properties) and every [min, max]
+# range is rescaled by one log-normal factor per row, keeping min <= max.
+
+GENERATOR_VERSION = 1
+REFERENCE_GRADE_SHARE = 0.8
+RANGE_JITTER = 0.15
+
+
+def _range_pairs(columns):
+    return [(col, col[:-4] + "_max") for col in columns if col.endswith("_min") and col[:-4] + "_max" in columns]
+
+
+def _jitter(rng, n, sigma=RANGE_JITTER):
+    return rng.lognormal(0.0, sigma, n)
+
+
+def _decimals(values):
+    finite = values[np.isfinite(values)]
+    if len(finite) == 0 or np.allclose(finite, np.round(finite)):
+        return 0
+    return 2
+
+
+def generate_rfqs(n_rows, rfq_file="data/rfq.csv", reference_file="data/reference_properties.tsv", seed=42):
+    rng = np.random.default_rng(seed)
+    template = pd.read_csv(rfq_file)
+    grades = pd.read_csv(reference_file, sep="\t")["Grade/Material"].dropna().unique()
+
+    rfqs = template.iloc[rng.integers(0, len(template), n_rows)].reset_index(drop=True)
+    rfqs["id"] = [f"syn-{seed}-{i:08d}" for i in range(n_rows)]
+
+    redraw = rng.random(n_rows) < REFERENCE_GRADE_SHARE
+    rfqs.loc[redraw, "grade"] = grades[rng.integers(0, len(grades), redraw.sum())]
+
+    for lo, hi in _range_pairs(rfqs.columns):
+        factor = _jitter(rng, n_rows)
+        decimals = _decimals(template[[lo, hi]].to_numpy(dtype=float))
+        rfqs[lo] = (rfqs[lo] * factor).round(decimals)
+        rfqs[hi] = np.maximum((rfqs[hi] * factor).round(decimals), rfqs[lo].fillna(-np.inf)).where(rfqs[hi].notna())
+    return rfqs
+
+
+# Raw supplier sheet in the supplier's own layout, bootstrapped from its workbook
+def generate_supplier_sheet(name, n_rows, input_dir="data", reference_file="data/reference_properties.tsv", seed=42):
+    rng = np.random.default_rng([seed, sum(map(ord, name))])
+    adapter = SUPPLIER_ADAPTERS[name]
+    template = pd.read_excel(os.path.join(input_dir, adapter["file"]), sheet_name=adapter["sheets"][0])
+    grades = pd.read_csv(reference_file, sep="\t")["Grade/Material"].dropna().unique()
+
+    sheet = template.iloc[rng.integers(0, len(template), n_rows)].reset_index(drop=True)
+    to_raw = {unified: raw for raw, unified in adapter["columns"].items()}
+
+    grade_col = to_raw.get("grade")
+    if grade_col is not None:
+        redraw = rng.random(n_rows) < 0.5
+        sheet.loc[redraw, grade_col] = grades[rng.integers(0, len(grades), redraw.sum())]
+
+    for unified in ["thickness_mm", "width_mm", "gross_weight_kg"]:
+        col = to_raw.get(unified)
+        if col is not None and pd.api.types.is_numeric_dtype(sheet[col]):
+            decimals = _decimals(template[col].to_numpy(dtype=float))
+            sheet[col] = (sheet[col] * _jitter(rng, n_rows)).round(decimals)
+
+    if "article_id" in to_raw:
+        sheet[to_raw["article_id"]] = 10_000_000 + np.arange(n_rows) * 7 + seed
+    return sheet
+
+
+# Write rfq.csv, reference_properties.tsv and one workbook per supplier
+# (n_rows split across suppliers) into out_dir; reused when already generated
+def write_synthetic_dataset(n_rows, out_dir, input_dir="data", seed=42):
+    marker_path = os.path.join(out_dir, "dataset.json")
+    marker = {"rows": n_rows, "seed": seed, "version": GENERATOR_VERSION, "suppliers": sorted(SUPPLIER_ADAPTERS)}
+    if os.path.exists(marker_path):
+        with open(marker_path) as fh:
+            if json.load(fh) == marker:
+                return out_dir
+
+    os.makedirs(out_dir, exist_ok=True)
+    reference_file = os.path.join(input_dir, "reference_properties.tsv")
+    shutil.copyfile(reference_file, os.path.join(out_dir, "reference_properties.tsv"))
+    generate_rfqs(n_rows, os.path.join(input_dir, "rfq.csv"), reference_file, seed).to_csv(
+        os.path.join(out_dir, "rfq.csv"), index=False
+    )
+
+    names = list(SUPPLIER_ADAPTERS)
+    for name, rows in zip(names, np.array_split(np.arange(n_rows), len(names))):
+        sheet = generate_supplier_sheet(name, len(rows), input_dir, reference_file, seed)
+        sheet.to_excel(os.path.join(out_dir, SUPPLIER_ADAPTERS[name]["file"]), index=False)
+
+    with open(marker_path, "w") as fh:
+        json.dump(marker, fh)
+    print(f"[✓] Generated synthetic dataset ({n_rows} rows) in {out_dir}")
+    return out_dir
@@ -0,0 +1,141 @@
+import numpy as np
+import pandas as pd
+from src.instrumentation import timed
+
+# -------------------------------
+# Top-k helpers shared by the similarity engines
+# -------------------------------
+# Scores are ranked in descending order and ties are broken by the lower
+# column index, so results do not depend on how the work was tiled. Scores are
+# rounded to SCORE_DECIMALS first: two pairs whose scores are equal in exact
+# arithmetic can come out of different tile shapes, BLAS kernels or the dedupe
+# path a few ulps apart, and would otherwise be ordered by that noise. Reported
+# scores are therefore exact to within 5e-13.
+
+SCORE_DECIMALS = 12
+
+
+def round_scores(scores):
+    return np.round(scores, SCORE_DECIMALS)
+
+def _empty_topk(n_rows):
+    return np.empty((n_rows, 0), dtype=np.int64), np.empty((n_rows, 0))
+
+# k best columns of every row of a score tile (col_offset shifts returned indices)
+def select_topk(scores, k, col_offset=0):
+    scores = round_scores(scores)
+    n_rows, n_cols = scores.shape
+    k = min(k, n_cols)
+    if k == 0:
+        return _empty_topk(n_rows)
+
+    if k < n_cols:
+        part = np.argpartition(scores, n_cols - k, axis=1)[:, n_cols - k:]
+        kth = np.take_along_axis(scores, part, axis=1).min(axis=1)
+        # Keep everything tied with the k-th score so tie-breaking stays deterministic
+        rows, cols = np.nonzero(scores >= kth[:, None])
+    else:
+        rows, cols = np.nonzero(np.ones(scores.shape, dtype=bool))
+
+    vals = scores[rows, cols]
+    order = np.lexsort((cols, -vals, rows))
+    rows, cols, vals = rows[order], cols[order], vals[order]
+
+    starts = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=n_rows))[:-1]))
+    take = starts[:, None] + np.arange(k)
+    return cols[take] + col_offset, vals[take]
+
+# Merge two (rows, k) candidate lists into the best k per row
+def merge_topk(idx_a, scores_a, idx_b, scores_b, k):
+    idx = np.concatenate([idx_a, idx_b], axis=1)
+    scores = np.concatenate([scores_a, scores_b], axis=1)
+    order = np.lexsort((idx, -scores), axis=1)[:, :k]
+    return np.take_along_axis(idx, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+# Running top-k over row x column tiles produced by tile_fn(row_slice, col_slice).
+# Only (n, k) state and one block_size x block_size tile are alive at any time.
+# symmetric=True scores each unordered pair once and feeds the tile to both sides.
+# self_score overrides the diagonal (e.g. 0.0 to keep self as a zero-score
+# candidate, -np.inf to exclude it); None leaves the tile untouched.
+def blocked_topk(tile_fn, n_rows, k, block_size=1024, n_cols=None, symmetric=False, self_score=None):
+    [(best_idx, best_scores)] = blocked_topk_many(
+        lambda rows, cols: [tile_fn(rows, cols)], 1, n_rows, k,
+        block_size=block_size, n_cols=n_cols, symmetric=symmetric, self_score=self_score,
+    )
+    return best_idx, best_scores
+
+# Same as blocked_topk, but tile_fn returns a list of n_outputs score tiles per
+# (rows, cols) block (e.g. one per ablation scenario) and a running top-k is kept
+# for each of them, so shared work is done once per tile.
+def blocked_topk_many(tile_fn, n_outputs, n_rows, k, block_size=1024, n_cols=None, symmetric=False, self_score=None):
+    if n_cols is None:
+        n_cols = n_rows
+    if symmetric and n_cols != n_rows:
+        raise ValueError("symmetric top-k needs a square score matrix")
+
+    n_candidates = n_cols - 1 if (self_score == -np.inf and n_cols == n_rows) else n_cols
+    k = max(0, min(k, n_candidates))
+    state = [
+        (np.full((n_rows, k), n_cols, dtype=np.int64), np.full((n_rows, k), -np.inf))
+        for _ in range(n_outputs)
+    ]
+    if k == 0:
+        return state
+
+    def update(best_idx, best_scores, rows, tile, col_start):
+        with timed("topk"):
+            cand_idx, cand_scores = select_topk(tile, k, col_offset=col_start)
+            best_idx[rows], best_scores[rows] = merge_topk(
+                best_idx[rows], best_scores[rows], cand_idx, cand_scores, k
+            )
+
+    for r0 in range(0, n_rows, block_size):
+        rows = slice(r0, min(r0 + block_size, n_rows))
+        col_starts = range(r0, n_cols, block_size) if symmetric else range(0, n_cols, block_size)
+        for c0 in col_starts:
+            cols = slice(c0, min(c0 + block_size, n_cols))
+            tiles = tile_fn(rows, cols)
+
+            diag = None
+            if self_score is not None and n_cols == n_rows:
+                lo, hi = max(rows.start, cols.start), min(rows.stop, cols.stop)
+                if lo < hi:
+                    diag = np.arange(lo, hi)
+
+            for (best_idx, best_scores), tile in zip(state, tiles):
+                if diag is not None:
+                    tile[diag - rows.start, diag - cols.start] = self_score
+                update(best_idx, best_scores, rows, tile, cols.start)
+                if symmetric and c0 != r0:
+                    update(best_idx, best_scores, cols, tile.T, rows.start)
+
+    return state
+
+# Best k columns per row from explicit (row, col, score) candidate pairs, ordered
+# by row, then score desc, then column. Rows may end up with fewer than k entries.
+def pairs_topk(rows, cols, scores, k):
+    with timed("topk"):
+        return _pairs_topk(rows, cols, round_scores(scores), k)
+
+def _pairs_topk(rows, cols, scores, k):
+    order = np.lexsort((cols, -scores, rows))
+    rows, cols, scores = rows[order], cols[order], scores[order]
+    starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]]) if len(rows) else np.empty(0, dtype=np.int64)
+    rank = np.arange(len(rows)) - np.repeat(starts, np.diff(np.r_[starts, len(rows)]))
+    keep = rank < k
+    return rows[keep], cols[keep], scores[keep]
+
+# Long-format frame from (row, col, score) pairs of one corpus
+def pairs_frame(ids, rows, cols, scores):
+    ids = np.asarray(ids)
+    return pd.DataFrame({'rfq_id': ids[rows], 'match_id': ids[cols], 'similarity_score': scores})
+
+# Long-format (rfq_id, match_id, similarity_score) frame from (n, k) top-k arrays
+def topk_frame(ids, top_idx, top_scores):
+    ids = np.asarray(ids)
+    k = top_idx.shape[1]
+    return pd.DataFrame({
+        'rfq_id': np.repeat(ids, k),
+        'match_id': ids[top_idx.ravel()],
+        'similarity_score': top_scores.ravel(),
+    })
@@ -0,0 +1,94 @@
+import os
+import importlib.util
+import numpy as np
+from src.topk import pairs_frame
+from src.instrumentation import stage
+
+# -------------------------------
+# Top-k result output
+# -------------------------------
+# Results are written block by block straight from the (n, k) index / score
+# arrays: each block of block_rows query rows becomes a small frame (ids by
+# fancy indexing, unfilled slots dropped) that is appended to the CSV and,
+# when Parquet output is on, written as one row group of
+#   <output_dir>/topk/scenario=<csv stem>/part-0.parquet
+# so the full long-format frame never exists in memory. The dataset is
+# partitioned by scenario (hive style); readers load one scenario or filter:
+#   pd.read_parquet("outputs/topk", filters=[("scenario", "=", "top3_hybrid")])
+# Parquet output is switched on by RFQ_PARQUET_OUTPUT=1 (run.py --parquet), so
+# scenario workers started by the pipeline inherit it. CSV files are unchanged.
+
+PARQUET_ENV = "RFQ_PARQUET_OUTPUT"
+TOPK_DATASET_DIRNAME = "topk"
+BLOCK_ROWS = 65536
+
+
+def enable_parquet_output():
+    if importlib.util.find_spec("pyarrow") is None:
+        raise RuntimeError("Parquet output needs pyarrow")
+    os.environ[PARQUET_ENV] = "1"
+
+
+def parquet_enabled():
+    return os.environ.get(PARQUET_ENV) == "1"
+
+
+def partition_path(output_dir, scenario):
+    return os.path.join(output_dir, TOPK_DATASET_DIRNAME, f"scenario={scenario}", "part-0.parquet")
+
+
+# Long-format frames of consecutive query-row blocks (at least one, maybe empty)
+def topk_blocks(ids, top_idx, top_scores, block_rows=BLOCK_ROWS):
+    ids = np.asarray(ids)
+    n, k = top_idx.shape
+    for start in range(0, max(n, 1), block_rows):
+        idx, scores = top_idx[start:start + block_rows].ravel(), top_scores[start:start + block_rows].ravel()
+        rows = np.repeat(np.arange(start, min(start + block_rows, n)), k)
+        keep = idx < len(ids)
+        yield pairs_frame(ids, rows[keep], idx[keep], scores[keep])
+
+
+def frame_blocks(df, block_rows=BLOCK_ROWS):
+    for start in range(0, max(len(df), 1), block_rows):
+        yield df.iloc[start:start + block_rows]
+
+
+# Stream result blocks to csv_path (and to the scenario's Parquet partition)
+def write_result_blocks(blocks, csv_path):
+    output_dir, name = os.path.split(str(csv_path))
+    scenario = os.path.splitext(name)[0]
+    tmp_csv = f"{csv_path}.{os.getpid()}.tmp"
+    parquet_path = partition_path(output_dir, scenario) if parquet_enabled() else None
+    writer = None
+
+    with stage("write_results", file=name, parquet=parquet_path is not None) as record:
+        n_rows = 0
+        try:
+            for i, block in enumerate(blocks):
+                block.to_csv(tmp_csv, mode="w" if i == 0 else "a", header=i == 0, index=False)
+                if parquet_path:
+                    import pyarrow as pa
+                    import pyarrow.parquet as pq
+                    if writer is None:
+                        os.makedirs(os.path.dirname(parquet_path), exist_ok=True)
+                        table = pa.Table.from_pandas(block, preserve_index=False)
+                        writer = pq.ParquetWriter(f"{parquet_path}.tmp", table.schema)
+                    else:
+                        table = pa.Table.from_pandas(block, schema=writer.schema, preserve_index=False)
+                    writer.write_table(table)
+                n_rows += len(block)
+        finally:
+            if writer is not None:
+                writer.close()
+        os.replace(tmp_csv, csv_path)
+        if writer is not None:
+            os.replace(f"{parquet_path}.tmp", parquet_path)
+        record["rows_out"] = n_rows
+
+
+def write_topk(csv_path, ids, top_idx, top_scores, block_rows=BLOCK_ROWS):
+    write_result_blocks(topk_blocks(ids, top_idx, top_scores, block_rows), csv_path)
+
+
+def write_result_frame(df, csv_path, block_rows=BLOCK_ROWS):
+    write_result_blocks(frame_blocks(df, block_rows), csv_path)
@@ -0,0 +1,202 @@
+import os
+import io
+import sys
+import glob
+import json
+import time
+import signal
+import socket
+import importlib
+import traceback
+
+# -------------------------------
+# Warm worker
+# -------------------------------
+# `python run.py --warm` starts a long-lived process that imports numpy, pandas,
+# scikit-learn and every scenario module once and then listens on a Unix socket
+# (outputs/.warm.sock by default). A later `python run.py --run ...` finds the
+# socket and hands its whole invocation over instead of running it:
+#
+#   client -> worker   "RFQ1" with the client's stdin / stdout / stderr attached
+#                      (SCM_RIGHTS), then one JSON line {"argv", "cwd", "env"}
+#   worker             forks; the child takes over the three descriptors, the
+#                      working directory and the environment and calls run.py's
+#                      main(argv), so output goes straight to the client's terminal
+#   worker -> client   {"pid": child} and, when the child is done, {"exit": code}
+#
+# Each run is a fresh fork of the preloaded process, so runs cannot leak state
+# into each other; only interpreter and library startup is skipped. Ctrl+C,
+# SIGTERM and SIGHUP sent to the client are forwarded to the child. When a source
+# file has changed since the worker started, it answers {"stale": true} and
+# exits, and the client runs cold. The socket is created owner-only (0600), since
+# a request runs arbitrary argv with the worker's rights, and a client that
+# connects but does not send its request within REQUEST_TIMEOUT is dropped so
+# it cannot hold up the accept loop.
+# This module only imports the standard library, so the client side stays cheap.
+
+DEFAULT_SOCKET = os.path.join("outputs", ".warm.sock")
+MAGIC = b"RFQ1"
+FORWARDED_SIGNALS = [getattr(signal, name) for name in ("SIGINT", "SIGTERM", "SIGHUP") if hasattr(signal, name)]
+PRELOAD = ["numpy", "pandas", "sklearn.preprocessing", "sklearn.cluster", "sklearn.metrics"]
+REQUEST_TIMEOUT = 5.0  # seconds a client may take to send its request
+
+
+# Latest modification time of run.py and src/*.py (a newer one makes the worker stale)
+def source_stamp(root):
+    paths = [os.path.join(root, "run.py")] + glob.glob(os.path.join(root, "src", "*.py"))
+    return max(os.path.getmtime(path) for path in paths if os.path.exists(path))
+
+
+def _send(conn, message):
+    conn.sendall(json.dumps(message).encode() + b"\n")
+
+
+# -------------------------------
+# Client side
+# -------------------------------
+# Exit code of argv run by the warm worker, or None when there is no (usable)
+# worker and the caller should run it itself
+def run_in_worker(argv, socket_path=DEFAULT_SOCKET):
+    if not hasattr(socket, "send_fds") or not os.path.exists(socket_path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        socket.send_fds(sock, [MAGIC], [0, 1, 2])
+        sock.sendall(json.dumps({"argv": list(argv), "cwd": os.getcwd(), "env": dict(os.environ)}).encode() + b"\n")
+    except OSError:
+        sock.close()
+        return None
+
+    # Signals for the client (Ctrl+C, a job scheduler's SIGTERM) go to the child
+    child = {}
+    def forward(signum, _):
+        if "pid" not in child:
+            raise KeyboardInterrupt
+        os.kill(child["pid"], signum)
+    previous = {sig: signal.signal(sig, forward) for sig in FORWARDED_SIGNALS}
+
+    reader = sock.makefile("rb")
+    try:
+        while True:
+            line = reader.readline()
+            if not line:
+                print("Warm worker closed the connection", file=sys.stderr)
+                return 1
+            message = json.loads(line)
+            if message.get("stale"):
+                print("Warm worker is out of date with the source and stopped; running cold", file=sys.stderr)
+                return None
+            if "pid" in message:
+                child["pid"] = message["pid"]
+            if "exit" in message:
+                return message["exit"]
+    finally:
+        for sig, handler in previous.items():
+            signal.signal(sig, handler)
+        sock.close()
+
+
+# -------------------------------
+# Worker side
+# -------------------------------
+def _run_child(conn, fds, request, main, listener):
+    listener.close()
+    for sig in FORWARDED_SIGNALS + [signal.SIGCHLD]:
+        signal.signal(sig, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+    sys.stdin = io.TextIOWrapper(os.fdopen(0, "rb", closefd=False), encoding="utf-8")
+    sys.stdout = io.TextIOWrapper(os.fdopen(1, "wb", closefd=False), encoding="utf-8", line_buffering=True)
+    sys.stderr = io.TextIOWrapper(os.fdopen(2, "wb", closefd=False), encoding="utf-8", line_buffering=True)
+    os.chdir(request["cwd"])
+    os.environ.clear()
+    os.environ.update(request["env"])
+    sys.argv = ["run.py"] + request["argv"]
+
+    code = 0
+    try:
+        _send(conn, {"pid": os.getpid()})
+        main(request["argv"])
+    except SystemExit as exc:
+        code = exc.code if isinstance(exc.code, int) else (0 if exc.code is None else 1)
+    except KeyboardInterrupt:
+        code = 130
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        try:
+            _send(conn, {"exit": code})
+        except OSError:
+            pass
+        os._exit(code)  # skip the worker's own cleanup (it removes the socket)
+
+
+# Preload modules, then fork one child per request that calls main(argv)
+def serve(main, modules=(), socket_path=DEFAULT_SOCKET, root="."):
+    if not hasattr(socket, "send_fds"):
+        raise RuntimeError("the warm worker needs Unix sockets with descriptor passing (Python 3.9+, not Windows)")
+    start = time.perf_counter()
+    for name in PRELOAD + list(modules):
+        importlib.import_module(name)
+    print(f"Preloaded {len(PRELOAD) + len(modules)} modules in {time.perf_counter() - start:.2f}s "
+          f"({len(sys.modules)} loaded)")
+
+    stamp = source_stamp(root)
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o177)  # no window where others can connect
+    try:
+        listener.bind(socket_path)
+    finally:
+        os.umask(umask)
+    os.chmod(socket_path, 0o600)
+    listener.listen()
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)  # children are reaped automatically
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"[✓] Warm worker listening on {socket_path} (Ctrl+C to stop)")
+
+    runs = 0
+    try:
+        while True:
+            conn, _ = listener.accept()
+            fds = []
+            try:
+                conn.settimeout(REQUEST_TIMEOUT)
+                magic, fds, _, _ = socket.recv_fds(conn, len(MAGIC), 3)
+                if magic != MAGIC or len(fds) != 3:
+                    raise ValueError("not a warm worker request")
+                request = json.loads(conn.makefile("rb").readline())
+                conn.settimeout(None)
+            except (OSError, ValueError):
+                conn.close()
+                for fd in fds:
+                    os.close(fd)
+                continue
+            if source_stamp(root) != stamp:
+                _send(conn, {"stale": True})
+                conn.close()
+                for fd in fds:
+                    os.close(fd)
+                break
+
+            runs += 1
+            if os.fork() == 0:
+                _run_child(conn, fds, request, main, listener)
+            conn.close()
+            for fd in fds:
+                os.close(fd)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        print(f"Warm worker stopped after {runs} runs")
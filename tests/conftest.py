@@ -0,0 +1,58 @@
+import os
+import pandas as pd
+import pytest
+from src.feature_store import load_references, rfq_features, load_feature_matrices
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+RFQ_FILE = os.path.join(DATA_DIR, "rfq.csv")
+REFERENCE_FILE = os.path.join(DATA_DIR, "reference_properties.tsv")
+N_RFQS = 40
+N_DUPLICATES = 8
+
+
+# -------------------------------
+# Small corpora cut from the sample data
+# -------------------------------
+# The first N_RFQS RFQs plus N_DUPLICATES copies of some of them under new ids,
+# so the dedupe paths have duplicate specs to collapse
+@pytest.fixture(scope="session")
+def rfq_sample():
+    rfqs = pd.read_csv(RFQ_FILE).head(N_RFQS)
+    copies = rfqs.iloc[::N_RFQS // N_DUPLICATES].head(N_DUPLICATES).copy()
+    copies["id"] = copies["id"].astype(str) + "-copy"
+    return pd.concat([rfqs, copies], ignore_index=True)
+
+
+@pytest.fixture(scope="session")
+def references():
+    return load_references(REFERENCE_FILE)
+
+
+# Engineered feature frame with one row (and a unique id) per RFQ
+@pytest.fixture(scope="session")
+def feature_frame(rfq_sample, references):
+    frame = rfq_features(rfq_sample.copy(), references).drop_duplicates("id").reset_index(drop=True)
+    frame["id"] = [f"rfq-{i:03d}" for i in range(len(frame))]
+    return frame
+
+
+# Input files of the sample in a temporary directory, for the file-based entry points
+@pytest.fixture(scope="session")
+def sample_files(rfq_sample, tmp_path_factory):
+    data_dir = tmp_path_factory.mktemp("data")
+    rfq_file = data_dir / "rfq.csv"
+    rfq_sample.to_csv(rfq_file, index=False)
+    return str(rfq_file), REFERENCE_FILE
+
+
+# Feature store (frame + memory-mapped matrices) of the sample in a temporary output directory
+@pytest.fixture(scope="session")
+def output_dir(sample_files, tmp_path_factory):
+    output_dir = str(tmp_path_factory.mktemp("outputs"))
+    load_feature_matrices(*sample_files, output_dir=output_dir)
+    return output_dir
+
+
+@pytest.fixture(scope="session")
+def matrices(sample_files, output_dir):
+    return load_feature_matrices(*sample_files, output_dir=output_dir)
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+# -------------------------------
+# Top-k comparisons
+# -------------------------------
+# (n, k) match ids and scores of a long-format result frame (k rows per RFQ, in order)
+def frame_topk(df, k):
+    return df["match_id"].to_numpy().reshape(-1, k), df["similarity_score"].to_numpy(dtype=float).reshape(-1, k)
+
+
+# Top-k lists agree up to ties: scores match rank for rank within atol, and the
+# ids scoring strictly above each row's k-th score are the same
+def assert_same_topk(idx, scores, expected_idx, expected_scores, atol=1e-12):
+    idx, scores = np.asarray(idx), np.asarray(scores, dtype=float)
+    expected_idx, expected_scores = np.asarray(expected_idx), np.asarray(expected_scores, dtype=float)
+    assert idx.shape == expected_idx.shape
+    np.testing.assert_allclose(scores, expected_scores, rtol=0, atol=atol)
+    for row in range(len(idx)):
+        kth = expected_scores[row, -1]
+        above = expected_scores[row] > kth + atol
+        assert set(idx[row][scores[row] > kth + atol]) == set(expected_idx[row][above]), f"row {row}"
+
+
+# -------------------------------
+# Reference similarity
+# -------------------------------
+# The original dense formula 0.4·cos(dim) + 0.3·cos(grade) + 0.3·cos(get_dummies),
+# as an (n, n) matrix with self scored 0 (weights: another family weighting,
+# families left out of it are not scored)
+def dense_similarity(feature_df, weights=None):
+    from sklearn.preprocessing import MinMaxScaler
+    from sklearn.metrics.pairwise import cosine_similarity
+    dim_cols = ["thickness_min", "thickness_max", "width_min", "width_max", "weight_min", "weight_max"]
+    grade_cols = [col for col in feature_df.columns if "_mid" in col]
+    cat_cols = ["coating", "finish", "form", "surface_type", "surface_protection"]
+
+    if weights is None:
+        weights = {"dimensional": 0.4, "grade_properties": 0.3, "categorical": 0.3}
+
+    family_sims = {
+        "dimensional": lambda: cosine_similarity(MinMaxScaler().fit_transform(feature_df[dim_cols].fillna(0).values)),
+        "grade_properties": lambda: cosine_similarity(
+            MinMaxScaler().fit_transform(feature_df[grade_cols].fillna(0).values)),
+        "categorical": lambda: cosine_similarity(pd.get_dummies(feature_df[cat_cols], dummy_na=True)),
+    }
+    aggregate = sum(weight * family_sims[family]() for family, weight in weights.items())
+    np.fill_diagonal(aggregate, 0)
+    return aggregate
+
+
+# Top-k of a dense score matrix under the engines' rule: scores rounded to
+# SCORE_DECIMALS, ties to the lower column
+def dense_topk(scores, k):
+    from src.topk import round_scores
+    scores = round_scores(scores)
+    top_idx = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+    return top_idx, np.take_along_axis(scores, top_idx, axis=1)
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+from src.ablation_analysis import SCENARIOS, scenario_topk, scenario_weights
+from tests.helpers import dense_similarity, dense_topk
+
+TOP_N = 3
+
+
+# One streaming pass over all SCENARIOS gives each scenario the top-k of its own
+# dense weighted formula
+@pytest.mark.parametrize("block_size", [5, 1024])
+def test_scenario_topk_matches_each_scenario_formula(feature_frame, block_size):
+    results = scenario_topk(feature_frame, SCENARIOS, TOP_N, block_size)
+    assert set(results) == {s["name"] for s in SCENARIOS}
+    for scenario in SCENARIOS:
+        expected_idx, expected_scores = dense_topk(dense_similarity(feature_frame, scenario_weights(scenario)), TOP_N)
+        top_idx, top_scores = results[scenario["name"]]
+        np.testing.assert_array_equal(top_idx, expected_idx, err_msg=scenario["name"])
+        np.testing.assert_allclose(top_scores, expected_scores, rtol=0, atol=1e-12, err_msg=scenario["name"])
+
+
+# Scored together, through the feature matrices and the family cache, or alone,
+# every scenario gets the same arrays
+def test_scenario_topk_matches_single_scenario_runs(matrices):
+    together = scenario_topk(None, SCENARIOS, TOP_N, block_size=7, matrices=matrices)
+    cached = scenario_topk(None, SCENARIOS, TOP_N, block_size=7, matrices=matrices)
+    for scenario in SCENARIOS:
+        alone = scenario_topk(None, [scenario], TOP_N, embeddings=matrices["embeddings"])[scenario["name"]]
+        for result in [together, cached]:
+            np.testing.assert_array_equal(result[scenario["name"]][0], alone[0])
+            np.testing.assert_array_equal(result[scenario["name"]][1], alone[1])
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from src.alternative_metrics import (
+    hybrid_similarity, vectorized_hybrid_similarity, iou_range, iou_range_array, compute_alternative_metrics,
+)
+from tests.helpers import frame_topk, assert_same_topk
+
+TOP_N = 3
+
+
+@pytest.fixture(scope="module")
+def reference(feature_frame):
+    return frame_topk(hybrid_similarity(feature_frame, top_n=TOP_N), TOP_N)
+
+
+@pytest.mark.parametrize("dedupe", [True, False])
+@pytest.mark.parametrize("block_size", [7, 512])
+def test_vectorized_hybrid_matches_reference(feature_frame, reference, dedupe, block_size):
+    result = vectorized_hybrid_similarity(feature_frame, top_n=TOP_N, block_size=block_size, dedupe=dedupe)
+    assert_same_topk(*frame_topk(result, TOP_N), *reference)
+
+
+# A tolerance wide enough to make every pair a candidate reproduces the full engine
+def test_candidate_path_matches_reference(feature_frame, reference):
+    result = vectorized_hybrid_similarity(feature_frame, top_n=TOP_N, tolerance=1e6)
+    assert_same_topk(*frame_topk(result, TOP_N), *reference)
+
+
+# With a narrow tolerance only overlapping pairs are scored, each with its exact hybrid score
+def test_candidate_path_scores_are_exact(feature_frame):
+    n = len(feature_frame)
+    all_pairs = hybrid_similarity(feature_frame, top_n=n - 1)
+    exact = dict(zip(zip(all_pairs["rfq_id"], all_pairs["match_id"]), all_pairs["similarity_score"]))
+
+    result = vectorized_hybrid_similarity(feature_frame, top_n=TOP_N, tolerance=0.05)
+    assert (result.groupby("rfq_id").size() <= TOP_N).all()
+    assert (result["rfq_id"] != result["match_id"]).all()
+    scores = [exact[pair] for pair in zip(result["rfq_id"], result["match_id"])]
+    np.testing.assert_allclose(result["similarity_score"], scores, rtol=0, atol=1e-12)
+
+
+def test_iou_range_array_matches_scalar():
+    rng = np.random.default_rng(0)
+    lo = rng.integers(0, 10, (2, 200)).astype(float)
+    hi = lo + rng.integers(0, 5, (2, 200))
+    lo[0, ::17] = np.nan
+    expected = [iou_range(*args) for args in zip(lo[0], hi[0], lo[1], hi[1])]
+    np.testing.assert_allclose(iou_range_array(lo[0], hi[0], lo[1], hi[1]), expected, rtol=0, atol=1e-15)
+
+
+# Frames by default, the baseline top-k arrays on request
+def test_compute_alternative_metrics_returns_frames(sample_files, tmp_path):
+    baseline, hybrid = compute_alternative_metrics(*sample_files, output_dir=str(tmp_path))
+    for frame in (baseline, hybrid):
+        assert list(frame.columns) == ["rfq_id", "match_id", "similarity_score"]
+    (top_idx, top_scores), _ = compute_alternative_metrics(*sample_files, output_dir=str(tmp_path), as_arrays=True)
+    np.testing.assert_allclose(top_scores.ravel(), baseline["similarity_score"])
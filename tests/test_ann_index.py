@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+from src.ann_index import build_ivf_index, ann_topk, recall_report, save_index, load_index
+from src.rfq_similarity import weighted_topk
+from src.topk import topk_frame
+from tests.helpers import assert_same_topk
+
+TOP_N = 3
+N_LISTS = 5
+
+
+@pytest.fixture(scope="module")
+def index(matrices):
+    return build_ivf_index(matrices, n_lists=N_LISTS, key="sample")
+
+
+@pytest.fixture(scope="module")
+def exact(matrices):
+    return weighted_topk(np.asarray(matrices["weighted"]), TOP_N, dedupe=False)
+
+
+# Probing every list is an exhaustive search
+def test_all_lists_match_exact(index, exact):
+    top_idx, top_scores, n_scored = ann_topk(index, TOP_N, nprobe=N_LISTS, block_size=7)
+    assert n_scored == len(index["order"]) ** 2
+    assert_same_topk(top_idx, top_scores, *exact)
+
+
+# Fewer lists: never a better score than exact, and every score is the true pair score
+def test_probed_lists_give_true_scores(index, matrices, exact):
+    top_idx, top_scores, n_scored = ann_topk(index, TOP_N, nprobe=1)
+    weighted = np.asarray(matrices["weighted"], dtype=np.float64)
+    found = top_idx < len(weighted)
+    rows = np.nonzero(found)[0]
+    true = np.einsum("ij,ij->i", weighted[rows], weighted[top_idx[found]])
+    true[rows == top_idx[found]] = 0.0
+    np.testing.assert_allclose(top_scores[found], true)
+    assert (top_scores <= exact[1] + 1e-12).all()
+    assert n_scored < len(weighted) ** 2
+
+
+def test_recall_report(index, matrices, exact):
+    report = recall_report(index, topk_frame(matrices["ids"], *exact), TOP_N, nprobes=[1, 2])
+    assert list(report["nprobe"]) == [1, 2, N_LISTS]
+    assert report[f"recall@{TOP_N}"].is_monotonic_increasing
+    assert report[f"recall@{TOP_N}"].iloc[-1] == 1.0
+
+
+def test_index_round_trip(index, tmp_path):
+    save_index(index, tmp_path)
+    loaded = load_index(tmp_path)
+    assert loaded["key"] == "sample"
+    for name in ["centroids", "order", "offsets", "weighted"]:
+        np.testing.assert_array_equal(loaded[name], index[name])
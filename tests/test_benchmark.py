@@ -0,0 +1,63 @@
+import os
+import json
+import pandas as pd
+from src.benchmark import run_benchmarks, flag_regressions, parse_sizes, BASELINE_FILE
+from src.synthetic_data import write_synthetic_dataset
+from src.data_cleaning import SUPPLIER_ADAPTERS
+from tests.conftest import DATA_DIR
+
+N_ROWS = 60
+
+
+def test_synthetic_dataset_is_written_once(tmp_path):
+    out_dir = write_synthetic_dataset(N_ROWS, str(tmp_path / "data"), DATA_DIR)
+    rfqs = pd.read_csv(os.path.join(out_dir, "rfq.csv"))
+    assert len(rfqs) == N_ROWS
+    assert list(rfqs.columns) == list(pd.read_csv(os.path.join(DATA_DIR, "rfq.csv"), nrows=0).columns)
+    sheets = [os.path.join(out_dir, adapter["file"]) for adapter in SUPPLIER_ADAPTERS.values()]
+    assert sum(len(pd.read_excel(path)) for path in sheets) == N_ROWS
+
+    mtime = os.path.getmtime(os.path.join(out_dir, "rfq.csv"))
+    write_synthetic_dataset(N_ROWS, out_dir, DATA_DIR)
+    assert os.path.getmtime(os.path.join(out_dir, "rfq.csv")) == mtime
+
+
+# One stage at a tiny size: the first run stores the baseline, and a run
+# against a baseline with a far smaller footprint is flagged
+def test_benchmark_flags_regressions_against_baseline(tmp_path):
+    output_dir = str(tmp_path)
+    results = run_benchmarks([N_ROWS], ["engineer_features"], input_dir=DATA_DIR, output_dir=output_dir,
+                             save_baseline=True)
+    assert results[["stage", "rows", "status", "regression"]].values.tolist() == \
+        [["engineer_features", N_ROWS, "ok", ""]]
+    assert results["rows_per_second"].gt(0).all()
+
+    baseline_path = os.path.join(output_dir, BASELINE_FILE)
+    with open(baseline_path) as fh:
+        baseline = json.load(fh)
+    assert set(baseline) == {f"engineer_features@{N_ROWS}"}
+    baseline[f"engineer_features@{N_ROWS}"]["peak_rss_mb"] = 1.0
+    with open(baseline_path, "w") as fh:
+        json.dump(baseline, fh)
+
+    results = run_benchmarks([N_ROWS], ["engineer_features"], input_dir=DATA_DIR, output_dir=output_dir)
+    assert results["regression"].iloc[0].startswith("rss +")
+    assert pd.read_csv(os.path.join(output_dir, "benchmark_results.csv"))["regression"].iloc[0].startswith("rss +")
+
+
+def test_flag_regressions_ignores_timer_noise():
+    results = pd.DataFrame({
+        "stage": ["a", "a", "b", "c"], "rows": [1000, 10_000, 1000, 1000], "status": ["ok", "ok", "ok", "failed: x"],
+        "seconds": [0.02, 2.0, 1.0, 9.0], "peak_rss_mb": [100.0, 100.0, 300.0, 100.0],
+    })
+    baseline = {
+        "a@1000": {"seconds": 0.01, "peak_rss_mb": 100.0},              # 2x slower, but by less than MIN_SECONDS
+        "a@10000": {"seconds": 1.0, "peak_rss_mb": 100.0},
+        "b@1000": {"seconds": 1.0, "peak_rss_mb": 100.0},
+        "c@1000": {"seconds": 1.0, "peak_rss_mb": 100.0},
+    }
+    assert flag_regressions(results, baseline) == ["", "time +100%", "rss +200%", ""]
+
+
+def test_parse_sizes():
+    assert parse_sizes("1k, 10k,1.5m,250") == [1_000, 10_000, 1_500_000, 250]
@@ -0,0 +1,46 @@
+import pandas as pd
+import pytest
+from src.clustering import cluster_rfqs, assign_rfqs, sweep_n_clusters, encode_clusters, _fit_minibatch
+from src.feature_store import feature_frame_path, read_frame
+
+N_CLUSTERS = 4
+
+
+def read_labels(path):
+    return pd.read_csv(path, dtype={"id": str}).set_index("id")["cluster"]
+
+
+# Assigning the fitted RFQs with the persisted model reproduces the fitted labels
+@pytest.mark.parametrize("mode, options", [("full", {}), ("minibatch", {"chunk_rows": 5, "n_epochs": 2})])
+def test_assignment_reproduces_fitted_labels(sample_files, tmp_path, mode, options):
+    cluster_rfqs(*sample_files, output_dir=str(tmp_path), n_clusters=N_CLUSTERS, mode=mode, **options)
+    assign_rfqs(*sample_files, output_dir=str(tmp_path))
+
+    fitted = read_labels(tmp_path / "rfq_clusters.csv")
+    assigned = read_labels(tmp_path / "rfq_clusters_assigned.csv")
+    pd.testing.assert_series_equal(assigned, fitted)
+    assert fitted.nunique() > 1 and fitted.between(0, N_CLUSTERS - 1).all()
+
+
+# Chunks shorter than n_clusters are carried over into the next partial_fit
+def test_minibatch_fit_carries_short_chunks(sample_files, tmp_path):
+    data_path = feature_frame_path(*sample_files, output_dir=str(tmp_path))
+    encoder, centroids = _fit_minibatch(data_path, N_CLUSTERS, chunk_rows=N_CLUSTERS - 1, n_epochs=1)
+    assert centroids.shape[0] == N_CLUSTERS
+    frame = read_frame(data_path)
+    assert encode_clusters(frame, encoder).shape[1] == centroids.shape[1]
+
+    with pytest.raises(ValueError, match="at least"):
+        _fit_minibatch(data_path, len(frame) + 1, chunk_rows=16, n_epochs=1)
+
+
+# One row per n_clusters below the corpus size, the same in a process pool
+def test_sweep_writes_one_row_per_n_clusters(sample_files, tmp_path, rfq_sample):
+    k_values = [2, 3, 5, len(rfq_sample) + 1]
+    results = sweep_n_clusters(*sample_files, output_dir=str(tmp_path), k_values=k_values, n_jobs=1)
+    assert results["n_clusters"].tolist() == [2, 3, 5]
+    assert results["inertia"].gt(0).all() and results["silhouette"].between(-1, 1).all()
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / "cluster_sweep.csv"), results)
+
+    pooled = sweep_n_clusters(*sample_files, output_dir=str(tmp_path), k_values=k_values, n_jobs=2)
+    pd.testing.assert_frame_equal(pooled, results)
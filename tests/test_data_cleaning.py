@@ -0,0 +1,32 @@
+import os
+import pandas as pd
+import pytest
+from src.data_cleaning import (
+    SUPPLIER_ADAPTERS, COMMON_COLUMNS, apply_adapter, iter_sheet_chunks, parse_suppliers, write_inventory,
+)
+from tests.conftest import DATA_DIR
+
+
+@pytest.mark.parametrize("name", list(SUPPLIER_ADAPTERS))
+def test_sheet_chunks_match_read_excel(name):
+    path = os.path.join(DATA_DIR, SUPPLIER_ADAPTERS[name]["file"])
+    chunks = list(iter_sheet_chunks(path, 0, chunk_rows=7))
+    assert len(chunks) > 1 and all(len(chunk) <= 7 for chunk in chunks)
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), pd.read_excel(path, sheet_name=0),
+                                  check_dtype=False)
+
+
+# Parsed and written in 7-row chunks, the inventory is the CSV of the whole-sheet parse
+def test_chunked_inventory_matches_whole_sheets(tmp_path):
+    sheet_paths = parse_suppliers(DATA_DIR, str(tmp_path), jobs=1, chunk_rows=7)
+    out_path = tmp_path / "inventory_dataset.csv"
+    n_rows = write_inventory(sheet_paths, str(out_path))
+
+    whole = pd.concat([apply_adapter(name, adapter, pd.read_excel(os.path.join(DATA_DIR, adapter["file"])))
+                       for name, adapter in SUPPLIER_ADAPTERS.items()], ignore_index=True)
+    expected = tmp_path / "expected.csv"
+    pd.DataFrame(columns=COMMON_COLUMNS).to_csv(expected, index=False, encoding="utf-8-sig")
+    whole.to_csv(expected, mode="a", header=False, index=False, encoding="utf-8", na_rep="NaN")
+
+    assert n_rows == len(whole)
+    assert out_path.read_bytes() == expected.read_bytes()
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from src.dedupe import spec_groups, dedupe_topk
+from src.rfq_similarity import embedding_topk, weighted_topk
+from src.topk import blocked_topk
+from tests.helpers import assert_same_topk
+
+
+# Unit vectors where every spec appears 1-4 times, in shuffled row order
+def duplicated_rows(n_specs=15, dim=4, seed=0):
+    rng = np.random.default_rng(seed)
+    specs = rng.random((n_specs, dim))
+    specs /= np.linalg.norm(specs, axis=1, keepdims=True)
+    rows = rng.permutation(np.repeat(np.arange(n_specs), rng.integers(1, 5, n_specs)))
+    return specs[rows]
+
+
+def test_spec_groups():
+    rows = np.array([[1, 2], [3, 4], [1, 2], [5, 6], [3, 4], [1, 2]])
+    first_rows, inverse, counts = spec_groups(rows, rows[:, :1].astype(float))
+    np.testing.assert_array_equal(first_rows, [0, 1, 3])
+    np.testing.assert_array_equal(inverse, [0, 1, 0, 2, 1, 0])
+    np.testing.assert_array_equal(counts, [3, 2, 1])
+
+
+@pytest.mark.parametrize("self_score", [0.0, -np.inf])
+@pytest.mark.parametrize("k", [1, 3, 6])
+def test_dedupe_topk_matches_row_engine(self_score, k):
+    emb = duplicated_rows()
+    first_rows, inverse, _ = spec_groups(emb)
+    unique = emb[first_rows]
+
+    top_idx, top_scores = dedupe_topk(lambda rows, cols: unique[rows] @ unique[cols].T,
+                                      np.einsum("ij,ij->i", unique, unique), inverse, k,
+                                      block_size=4, self_score=self_score)
+    expected = blocked_topk(lambda rows, cols: emb[rows] @ emb[cols].T, len(emb), k,
+                            block_size=4, symmetric=True, self_score=self_score)
+    assert_same_topk(top_idx, top_scores, *expected)
+
+
+# Different specs can tie exactly on the sample data, so the unique-spec path
+# agrees with the row engine up to ties
+def test_embedding_topk_dedupe(matrices):
+    embeddings = {family: np.asarray(emb) for family, emb in matrices["embeddings"].items()}
+    assert_same_topk(*embedding_topk(embeddings, 3, dedupe=True), *embedding_topk(embeddings, 3, dedupe=False),
+                     )
+
+
+def test_weighted_topk_dedupe(matrices):
+    weighted = np.asarray(matrices["weighted"])
+    assert len(spec_groups(weighted)[0]) < len(weighted)
+    assert_same_topk(*weighted_topk(weighted, 3, dedupe=True), *weighted_topk(weighted, 3, dedupe=False))
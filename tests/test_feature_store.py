@@ -0,0 +1,73 @@
+import os
+import shutil
+import time
+from src import feature_store, rfq_similarity
+from src.feature_store import (
+    FEATURE_STORE_DIRNAME, MAX_STORE_ENTRIES, feature_key, load_feature_frame, load_feature_matrices,
+)
+from tests.conftest import REFERENCE_FILE
+
+
+def write_rfqs(rfq_sample, path, n_rows):
+    rfq_sample.head(n_rows).to_csv(path, index=False)
+    return str(path)
+
+
+def store_keys(output_dir):
+    names = os.listdir(os.path.join(output_dir, FEATURE_STORE_DIRNAME))
+    return {
+        "frames": sorted(name.split("-", 1)[1].split(".")[0] for name in names if name.endswith(".json")),
+        "matrices": sorted(name.split("-", 1)[1] for name in names if name.startswith("matrices-")),
+    }
+
+
+# Editing an input file gives a new key; the entry of the old version is dropped
+def test_input_change_rebuilds_and_evicts_the_old_version(rfq_sample, tmp_path):
+    rfq_file = write_rfqs(rfq_sample, tmp_path / "rfq.csv", 20)
+    old_key = feature_key(rfq_file, REFERENCE_FILE)
+    assert len(load_feature_matrices(rfq_file, REFERENCE_FILE, output_dir=str(tmp_path))["ids"]) == 20
+
+    write_rfqs(rfq_sample, tmp_path / "rfq.csv", 12)
+    new_key = feature_key(rfq_file, REFERENCE_FILE)
+    assert new_key != old_key
+    assert len(load_feature_matrices(rfq_file, REFERENCE_FILE, output_dir=str(tmp_path))["ids"]) == 12
+    assert store_keys(str(tmp_path)) == {"frames": [new_key], "matrices": [new_key]}
+
+
+# Editing the feature code (here rfq_similarity.py) gives a new key as well
+def test_feature_code_change_rebuilds(rfq_sample, tmp_path, monkeypatch):
+    rfq_file = write_rfqs(rfq_sample, tmp_path / "rfq.csv", 12)
+    output_dir = str(tmp_path / "outputs")
+    old_key = feature_key(rfq_file, REFERENCE_FILE)
+    load_feature_frame(rfq_file, REFERENCE_FILE, output_dir=output_dir)
+
+    edited = tmp_path / "rfq_similarity.py"
+    shutil.copy(rfq_similarity.__file__, edited)
+    with open(edited, "a") as fh:
+        fh.write("\n# edited\n")
+    monkeypatch.setattr(rfq_similarity, "__file__", str(edited))
+
+    new_key = feature_key(rfq_file, REFERENCE_FILE)
+    assert new_key != old_key
+    load_feature_frame(rfq_file, REFERENCE_FILE, output_dir=output_dir)
+    assert store_keys(output_dir)["frames"] == [new_key]
+
+
+# Entries of different inputs are kept up to MAX_STORE_ENTRIES, least recently used out first
+def test_least_recently_used_entry_is_evicted(rfq_sample, tmp_path):
+    output_dir = str(tmp_path / "outputs")
+    rfq_files = [write_rfqs(rfq_sample, tmp_path / f"rfq-{i}.csv", 10 + i) for i in range(MAX_STORE_ENTRIES + 1)]
+    keys = [feature_key(path, REFERENCE_FILE) for path in rfq_files]
+
+    store_dir = os.path.join(output_dir, FEATURE_STORE_DIRNAME)
+    now = time.time()
+    for i, path in enumerate(rfq_files[:MAX_STORE_ENTRIES]):
+        load_feature_matrices(path, REFERENCE_FILE, output_dir=output_dir)
+        data_path = feature_store._entry_paths(store_dir, keys[i])[0]
+        os.utime(data_path, (now - 100 + i, now - 100 + i))
+    assert store_keys(output_dir)["frames"] == sorted(keys[:MAX_STORE_ENTRIES])
+
+    load_feature_frame(rfq_files[0], REFERENCE_FILE, output_dir=output_dir)  # entry 0 used again
+    load_feature_frame(rfq_files[-1], REFERENCE_FILE, output_dir=output_dir)
+    kept = [keys[0]] + keys[2:]
+    assert store_keys(output_dir) == {"frames": sorted(kept), "matrices": sorted(keys[:1] + keys[2:MAX_STORE_ENTRIES])}
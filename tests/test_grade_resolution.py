@@ -0,0 +1,70 @@
+import pandas as pd
+import pytest
+from src.grade_resolution import (
+    build_grade_index, resolve_grade, resolve_grades, normalize_grade_column, resolution_report, METHODS,
+)
+from src.rfq_similarity import normalize_grade_keys
+
+
+@pytest.fixture
+def index():
+    keys = ["DX51D", "DX51D+Z", "S250GD", "S355J2", "S355MC", "HC420LA", "304"]
+    return build_grade_index(pd.DataFrame({"grade_normalized": keys}))
+
+
+@pytest.mark.parametrize("grade, suffix, expected", [
+    ("DX51D", None, ("DX51D", "exact", 1.0)),
+    ("DX51D", "+Z", ("DX51D+Z", "exact", 1.0)),
+    ("DX51D", "Z", ("DX51D+Z", "exact", 1.0)),
+    ("S250GD+Z", None, ("S250GD", "suffix", 0.95)),
+    ("S250GDZ", "Z", ("S250GD", "suffix", 0.95)),
+    ("S355J2G3", None, ("S355J2", "prefix", 0.75)),
+    ("HC420", None, ("HC420LA", "prefix", 5 / 7)),
+    (None, None, (None, "missing", 0.0)),
+])
+def test_resolve_grade(index, grade, suffix, expected):
+    key, method, confidence = resolve_grade(index, grade, suffix)
+    assert (key, method) == expected[:2]
+    assert confidence == pytest.approx(expected[2])
+
+
+def test_fuzzy_matches_below_threshold_stay_unmatched(index):
+    key, method, confidence = resolve_grade(index, "QQQQ")
+    assert key is None and method == "unmatched"
+    key, method, confidence = resolve_grade(index, "S355J2G3", min_confidence=0.8)
+    assert key is None and method == "unmatched" and confidence == pytest.approx(0.75)
+
+
+def test_ngram_match(index):
+    key, method, confidence = resolve_grade(index, "XS355MC")
+    assert (key, method) == ("S355MC", "ngram")
+    assert 0.6 <= confidence < 1.0
+
+
+def test_resolutions_are_memoized(index):
+    resolve_grade(index, "S355J2G3")
+    index["memo"][("S355J2G3", None)] = ("memo", "exact", 1.0)
+    assert resolve_grade(index, "S355J2G3")[0] == "memo"
+
+
+# The vectorized path resolves every row like resolve_grade does
+def test_resolve_grades_matches_rows(index):
+    grades = pd.Series(["DX51D", "S250GD+Z", None, "DX51D", "S355J2G3", "QQQQ", "DX51D"], index=range(10, 17))
+    suffixes = pd.Series([None, None, None, "+Z", None, None, "+Z"], index=grades.index)
+    resolved = resolve_grades(index, grades, suffixes)
+    assert list(resolved.index) == list(grades.index)
+    for row, (grade, suffix) in enumerate(zip(grades, suffixes)):
+        key, method, confidence = resolve_grade(index, grade, suffix)
+        assert resolved.iloc[row]["grade_key"] == key
+        assert resolved.iloc[row]["grade_match"] == method
+        assert resolved.iloc[row]["grade_confidence"] == pytest.approx(confidence)
+
+    report = resolution_report(resolved, grades).set_index("method")
+    assert list(report.index) == METHODS
+    assert report.loc["exact", "rows"] == 3 and report["rows"].sum() == len(grades)
+
+
+def test_normalize_grade_column():
+    grades = pd.Series(["dx 51-d", None, "S250_GD", "dx 51-d", ""])
+    expected = [normalize_grade_keys(value) for value in grades]
+    assert list(normalize_grade_column(grades)) == expected
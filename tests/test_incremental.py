@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+from src.incremental import rebuild_state, add_rfqs, save_state, load_state
+from tests.helpers import assert_same_topk
+
+N_BASE = 32
+
+
+@pytest.fixture
+def base(feature_frame):
+    return feature_frame.iloc[:N_BASE].reset_index(drop=True)
+
+
+# Copies of corpus rows under new ids (inside the fitted scaler range, so no
+# drift); one of them brings a categorical level the encoders have not seen
+def new_batch(base, rows, tag):
+    batch = base.iloc[rows].copy()
+    batch["id"] = [f"{tag}-{i}" for i in range(len(batch))]
+    batch.iloc[0, batch.columns.get_loc("form")] = "brand-new form"
+    return batch.reset_index(drop=True)
+
+
+def assert_same_state(state, expected):
+    assert list(state["corpus"]["id"]) == list(expected["corpus"]["id"])
+    assert_same_topk(state["top_idx"], state["top_scores"], expected["top_idx"], expected["top_scores"])
+
+
+@pytest.mark.parametrize("block_size", [5, 1024])
+def test_add_rfqs_matches_full_rebuild(base, block_size):
+    batch = new_batch(base, [0, 3, 3, 10, 17], "new")
+    state, summary = add_rfqs(rebuild_state(base, block_size=block_size), batch,
+                              max_drift=1.0, rebuild_every=100, block_size=block_size)
+    assert not summary["rebuilt"]
+    assert summary["drift"] == 0.0
+    assert summary["new_rows"] == len(batch)
+    assert_same_state(state, rebuild_state(pd.concat([base, batch], ignore_index=True), block_size=block_size))
+
+
+def test_batches_accumulate(base):
+    first, second = new_batch(base, [1, 2], "a"), new_batch(base, [5, 8, 13], "b")
+    state, _ = add_rfqs(rebuild_state(base), first, max_drift=1.0, rebuild_every=100, block_size=4)
+    state, _ = add_rfqs(state, second, max_drift=1.0, rebuild_every=100, block_size=4)
+    assert state["batches_since_rebuild"] == 2
+    assert_same_state(state, rebuild_state(pd.concat([base, first, second], ignore_index=True)))
+
+
+def test_known_ids_are_skipped(base):
+    state, summary = add_rfqs(rebuild_state(base), base.iloc[:3])
+    assert summary["new_rows"] == 0
+    assert len(state["corpus"]) == N_BASE
+
+
+# A row outside the fitted scaler range is drift; above max_drift the state is rebuilt
+def test_drift_triggers_rebuild(base):
+    batch = new_batch(base, [0], "far")
+    batch["thickness_min"] = batch["thickness_max"] = base["thickness_max"].max() * 10
+    state, summary = add_rfqs(rebuild_state(base), batch, max_drift=0.05)
+    assert summary["rebuilt"] and summary["drift"] == 1.0
+    assert state["batches_since_rebuild"] == 0
+    assert_same_state(state, rebuild_state(pd.concat([base, batch], ignore_index=True)))
+
+
+def test_state_round_trip_checks_source_key(base, tmp_path):
+    state = rebuild_state(base)
+    state["source_key"] = "inputs-v1"
+    save_state(state, tmp_path)
+
+    loaded = load_state(tmp_path, "inputs-v1")
+    np.testing.assert_array_equal(loaded["top_idx"], state["top_idx"])
+    assert list(loaded["corpus"]["id"]) == list(base["id"])
+    assert load_state(tmp_path, "inputs-v2") is None
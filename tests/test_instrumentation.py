@@ -0,0 +1,29 @@
+import json
+import multiprocessing
+from src import instrumentation
+from src.instrumentation import stage, METRICS_FILE_ENV
+
+fork = multiprocessing.get_context("fork")
+
+
+def _run_stage():
+    with stage("child", rows_in=1) as record:
+        record["rows_out"] = 1
+
+
+# A worker forked while the sampler holds the lock still runs instrumented stages
+def test_fork_while_lock_is_held(tmp_path, monkeypatch):
+    metrics = tmp_path / "metrics.jsonl"
+    monkeypatch.setenv(METRICS_FILE_ENV, str(metrics))
+    with stage("parent"):
+        with instrumentation._lock:
+            child = fork.Process(target=_run_stage)
+            child.start()
+        child.join(timeout=10)
+        if child.is_alive():
+            child.kill()
+    assert child.exitcode == 0
+
+    records = [json.loads(line) for line in metrics.read_text().splitlines()]
+    assert [r["path"] for r in records] == ["parent/child", "parent"]
+    assert records[0]["pid"] != records[1]["pid"]
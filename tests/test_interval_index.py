@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+from src.interval_index import SortedIntervalIndex, DimensionalIndex, corpus_candidates, DIMENSION_RANGES
+
+
+def random_intervals(n, seed):
+    rng = np.random.default_rng(seed)
+    lo = np.round(rng.lognormal(1.0, 1.0, n), 1)
+    hi = lo + np.where(rng.random(n) < 0.3, 0.0, np.round(rng.lognormal(0.0, 1.5, n), 1))
+    unknown = rng.random(n) < 0.1
+    lo[unknown], hi[unknown] = np.nan, np.nan
+    return lo, hi
+
+
+def pair_set(queries, items):
+    return set(zip(queries.tolist(), items.tolist()))
+
+
+def test_interval_query_matches_brute_force():
+    lo, hi = random_intervals(300, 0)
+    q_lo, q_hi = random_intervals(50, 1)
+    q_lo, q_hi = np.nan_to_num(q_lo, nan=2.0), np.nan_to_num(q_hi, nan=2.0)
+    index = SortedIntervalIndex(lo, hi)
+
+    known = ~np.isnan(lo)
+    overlap = (lo[None, :] <= q_hi[:, None]) & (hi[None, :] >= q_lo[:, None]) & known[None, :]
+    assert pair_set(*index.query(q_lo, q_hi, include_unknown=False)) == pair_set(*np.nonzero(overlap))
+    assert pair_set(*index.query(q_lo, q_hi)) == pair_set(*np.nonzero(overlap | ~known[None, :]))
+
+
+def random_frame(n, seed):
+    columns = {}
+    for dim, (lo_col, hi_col) in DIMENSION_RANGES.items():
+        lo, hi = random_intervals(n, seed + len(dim))
+        columns[lo_col], columns[hi_col] = lo, hi
+    return pd.DataFrame(columns)
+
+
+# Brute force over every pair: overlap (after widening by tolerance) in every
+# dimension the query knows; items with an unknown range never exclude a pair
+def brute_candidates(frame, tolerance):
+    n = len(frame)
+    keep = np.ones((n, n), dtype=bool)
+    constrained = np.zeros(n, dtype=bool)
+    for lo_col, hi_col in DIMENSION_RANGES.values():
+        lo, hi = frame[lo_col].to_numpy(), frame[hi_col].to_numpy()
+        q_lo, q_hi = lo * (1 - tolerance), hi * (1 + tolerance)
+        known = ~np.isnan(lo)
+        constrained |= known
+        fits = (lo[None, :] <= q_hi[:, None]) & (hi[None, :] >= q_lo[:, None]) | ~known[None, :]
+        keep &= fits | ~known[:, None]
+    keep[~constrained] = True
+    np.fill_diagonal(keep, False)
+    return np.nonzero(keep)
+
+
+def test_corpus_candidates_match_brute_force():
+    frame = random_frame(120, 3)
+    for tolerance in [0.0, 0.05, 0.5]:
+        assert pair_set(*corpus_candidates(frame, tolerance)) == pair_set(*brute_candidates(frame, tolerance))
+
+
+def test_unconstrained_queries_are_flagged():
+    frame = random_frame(20, 4)
+    query = frame.iloc[:3].copy()
+    query.iloc[1] = np.nan
+    _, _, unconstrained = DimensionalIndex(frame).candidates(query)
+    np.testing.assert_array_equal(unconstrained, [False, True, False])
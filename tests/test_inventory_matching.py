@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+from src.inventory_matching import grade_candidates, dimension_scores, match_inventory, article_ids
+from src.rfq_similarity import DIM_COLS
+
+
+def rfq_frame(rows):
+    frame = pd.DataFrame(rows, columns=DIM_COLS).astype(float)
+    frame.insert(0, "id", [f"rfq-{i}" for i in range(len(frame))])
+    return frame.assign(grade_normalized="DX51D", finish="pickled", tensile_strength_mid=400.0)
+
+
+# Stock frames carry point values in the *_min and *_max columns
+def stock_frame(values):
+    frame = pd.DataFrame({f"{dim}_{bound}": [v[i] for v in values]
+                          for i, dim in enumerate(["thickness", "width", "weight"]) for bound in ["min", "max"]})
+    return frame.astype(float)[DIM_COLS].assign(
+        id=[f"item-{i}" for i in range(len(values))], source="supplier", grade_base="DX51D",
+        reserved="NOT RESERVED", finish="pickled", tensile_strength_mid=400.0,
+    )
+
+
+def test_rfqs_without_grade_get_no_candidates():
+    rfqs = pd.DataFrame({"grade_normalized": ["DX51D", None, "S235JR"]})
+    stock = pd.DataFrame({"grade_base": ["DX51D", "DX51D", "S355MC", "S235JR"],
+                          "reserved": ["NOT RESERVED", "", "NAN", "RESERVED"]})
+    rfq_rows, inv_rows = grade_candidates(rfqs, stock)
+    assert sorted(zip(rfq_rows.tolist(), inv_rows.tolist())) == [(0, 0), (0, 1)]
+
+
+def test_dimension_scores():
+    rfqs = rfq_frame([[1.0, 2.0, 100, 200, 1000, 1000]])
+    stock = stock_frame([
+        (1.5, 150, 1000),               # at every midpoint
+        (1.5, np.nan, 2000),            # width unknown, twice the weight
+        (np.nan, np.nan, np.nan),       # nothing to compare
+        (3.0, 50, 500),
+    ])
+    scores = dimension_scores(rfqs, stock, np.zeros(4, dtype=int), np.arange(4))
+    np.testing.assert_allclose(scores, [1.0, (1.0 + 0.5) / 2, 0.0, (0.5 + 1 / 3 + 0.5) / 3])
+
+
+# With only the weight known, the closer coil ranks first (a cosine over one
+# column scored both 1.0)
+def test_near_weight_ranks_above_far_weight():
+    rfqs = rfq_frame([[np.nan, np.nan, np.nan, np.nan, 1000, 1000]])
+    stock = stock_frame([(np.nan, np.nan, 999_999), (np.nan, np.nan, 1_100), (np.nan, np.nan, 5_000)])
+    matches = match_inventory(rfqs, stock, top_n=3)
+    assert list(matches["match_id"]) == ["item-1", "item-2", "item-0"]
+    assert matches["similarity_score"].is_monotonic_decreasing
+    assert matches["similarity_score"].iloc[0] > matches["similarity_score"].iloc[-1] + 0.3
+
+
+def test_article_ids_drop_the_decimal_part():
+    inv = pd.DataFrame({"article_id": [np.nan, 23047939.0, 7.0]})
+    assert article_ids(inv).tolist() == [None, "23047939", "7"]
+    inv = pd.DataFrame({"article_id": ["A-1", None]})
+    assert article_ids(inv).tolist() == ["A-1", None]
+
+
+# Grade scalers are fitted on the stock, so an RFQ's matches do not change when
+# an RFQ with out-of-range properties is matched in the same call
+def test_scores_do_not_depend_on_the_other_rfqs():
+    rfqs = rfq_frame([[np.nan, np.nan, np.nan, np.nan, 1000, 1000]] * 2)
+    rfqs["tensile_strength_mid"] = [420.0, 2000.0]
+    rfqs["yield_strength_mid"] = [300.0, 1800.0]
+    stock = stock_frame([(np.nan, np.nan, 1000)] * 4)
+    stock["tensile_strength_mid"] = [380.0, 420.0, 450.0, 500.0]
+    stock["yield_strength_mid"] = [260.0, 340.0, 300.0, 280.0]
+
+    alone = match_inventory(rfqs.iloc[:1], stock, top_n=4)
+    together = match_inventory(rfqs, stock, top_n=4)
+    pd.testing.assert_frame_equal(together[together["rfq_id"] == "rfq-0"], alone)
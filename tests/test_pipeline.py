@@ -0,0 +1,86 @@
+import pytest
+from src.pipeline import run_dag
+
+
+# Stage functions (module level, so a process pool could run them too)
+def upper(src, dst, suffix=""):
+    with open(src) as fh, open(dst, "w") as out:
+        out.write(fh.read().upper() + suffix)
+
+
+def count_lines(src, dst):
+    with open(src) as fh, open(dst, "w") as out:
+        out.write(str(len(fh.read().splitlines())))
+
+
+@pytest.fixture
+def dag(tmp_path):
+    raw, upper_path, count_path = tmp_path / "raw.txt", tmp_path / "upper.txt", tmp_path / "count.txt"
+    raw.write_text("a\nb\n")
+    stages = {
+        "U": {"run": upper, "module": "pipeline", "inputs": [str(raw)], "outputs": [str(upper_path)]},
+        "N": {"run": count_lines, "module": "pipeline", "deps": ["U"],
+              "inputs": [str(upper_path)], "outputs": [str(count_path)]},
+    }
+    params = {"U": {"src": str(raw), "dst": str(upper_path)}, "N": {"src": str(upper_path), "dst": str(count_path)}}
+    return stages, params, tmp_path
+
+
+def run(dag, **kwargs):
+    stages, params, tmp_path = dag
+    results = run_dag(stages, ["N"], params, output_dir=str(tmp_path), jobs=1, **kwargs)
+    return {name: status for name, (status, _) in results.items()}
+
+
+def test_unchanged_stages_are_skipped(dag):
+    assert run(dag) == {"U": "ran", "N": "ran"}
+    assert run(dag) == {"U": "skipped", "N": "skipped"}
+    assert run(dag, force=True) == {"U": "ran", "N": "ran"}
+
+
+# A changed input reruns its stage; a downstream stage whose input came out the same stays skipped
+def test_changed_input_reruns_the_stage(dag):
+    stages, params, tmp_path = dag
+    run(dag)
+    (tmp_path / "raw.txt").write_text("a\nb\nc\n")
+    assert run(dag) == {"U": "ran", "N": "ran"}
+    assert (tmp_path / "count.txt").read_text() == "3"
+
+    (tmp_path / "raw.txt").write_text("A\nB\nC\n")
+    assert run(dag) == {"U": "ran", "N": "skipped"}
+
+
+def test_changed_params_rerun_the_stage(dag):
+    stages, params, tmp_path = dag
+    run(dag)
+    params["U"]["suffix"] = "!"
+    assert run(dag) == {"U": "ran", "N": "ran"}
+    assert (tmp_path / "upper.txt").read_text() == "A\nB\n!"
+    assert run(dag) == {"U": "skipped", "N": "skipped"}
+
+
+# An output edited by hand (or by another stage) makes its stage rerun and restore it
+def test_hand_edited_output_reruns(dag, capsys):
+    stages, params, tmp_path = dag
+    run(dag)
+    (tmp_path / "count.txt").write_text("99")
+    assert run(dag) == {"U": "skipped", "N": "ran"}
+    assert "N outputs changed since its last run" in capsys.readouterr().out
+    assert (tmp_path / "count.txt").read_text() == "2"
+
+    (tmp_path / "upper.txt").unlink()
+    assert run(dag) == {"U": "ran", "N": "skipped"}
+
+
+def test_two_stages_cannot_write_the_same_output(dag):
+    stages, params, tmp_path = dag
+    stages["N"]["outputs"] = stages["U"]["outputs"]
+    with pytest.raises(ValueError, match="both write"):
+        run(dag)
+    assert not (tmp_path / "upper.txt").exists()
+
+
+def test_failed_stage_blocks_its_dependents(dag):
+    stages, params, tmp_path = dag
+    (tmp_path / "raw.txt").unlink()
+    assert run(dag) == {"U": "failed", "N": "blocked"}
@@ -0,0 +1,105 @@
+import os
+import numpy as np
+import pytest
+from src import result_cache
+from src.result_cache import cached_topk, cached_family_scores, cache_stats, cache_dir_for, CACHE_ENV
+
+WEIGHTS = {"dimensional": 0.4, "grade_properties": 0.3, "categorical": 0.3}
+
+
+# Stand-in for load_feature_matrices: the cache only needs the store key and path
+def fake_matrices(output_dir, key="store-1"):
+    return {"key": key, "path": os.path.join(output_dir, ".feature_store", f"matrices-{key}")}
+
+
+def topk_arrays(seed, n=50, k=3):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, n, (n, k)), rng.random((n, k))
+
+
+class Compute:
+    def __init__(self, seed=0):
+        self.calls, self.seed = 0, seed
+
+    def __call__(self):
+        self.calls += 1
+        return topk_arrays(self.seed)
+
+
+@pytest.fixture(autouse=True)
+def cache_cap(monkeypatch):
+    monkeypatch.setenv(CACHE_ENV, "16")
+
+
+def test_second_lookup_hits(tmp_path):
+    matrices, compute = fake_matrices(str(tmp_path)), Compute()
+    first = cached_topk(matrices, WEIGHTS, 3, compute)
+    second = cached_topk(matrices, dict(reversed(WEIGHTS.items())), 3, compute)  # weight order does not matter
+    assert compute.calls == 1
+    for a, b in zip(first, second):
+        np.testing.assert_array_equal(a, b)
+
+    stats = cache_stats(cache_dir_for(matrices))
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+
+@pytest.mark.parametrize("change", ["weights", "k", "store"])
+def test_key_covers_inputs(tmp_path, change):
+    compute = Compute()
+    cached_topk(fake_matrices(str(tmp_path)), WEIGHTS, 3, compute)
+    weights = {**WEIGHTS, "dimensional": 0.5} if change == "weights" else WEIGHTS
+    k = 5 if change == "k" else 3
+    matrices = fake_matrices(str(tmp_path), "store-2" if change == "store" else "store-1")
+    cached_topk(matrices, weights, k, compute)
+    assert compute.calls == 2
+
+
+def test_rounded_weights_share_an_entry(tmp_path):
+    compute = Compute()
+    cached_topk(fake_matrices(str(tmp_path)), WEIGHTS, 3, compute)
+    cached_topk(fake_matrices(str(tmp_path)), {**WEIGHTS, "dimensional": 0.1 + 0.3}, 3, compute)
+    assert compute.calls == 1
+
+
+def test_zero_cap_disables_the_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv(CACHE_ENV, "0")
+    matrices, compute = fake_matrices(str(tmp_path)), Compute()
+    cached_topk(matrices, WEIGHTS, 3, compute)
+    cached_topk(matrices, WEIGHTS, 3, compute)
+    assert compute.calls == 2
+    assert not os.path.exists(cache_dir_for(matrices))
+
+
+# The cap fits two entries: the least recently used one goes first
+def test_lru_eviction(tmp_path, monkeypatch):
+    entry_bytes = sum(a.nbytes for a in topk_arrays(0))
+    monkeypatch.setenv(CACHE_ENV, str(2.5 * (entry_bytes + 1024) / (1 << 20)))
+    matrices = fake_matrices(str(tmp_path))
+    computes = {k: Compute(k) for k in [1, 2, 3]}
+
+    cached_topk(matrices, WEIGHTS, 1, computes[1])
+    cached_topk(matrices, WEIGHTS, 2, computes[2])
+    os.utime(os.path.join(cache_dir_for(matrices), f"topk-{result_cache._topk_key(matrices, WEIGHTS, 2)}",
+                          "meta.json"), (0, 0))  # k=2 is now the least recently used entry
+    cached_topk(matrices, WEIGHTS, 3, computes[3])
+    cached_topk(matrices, WEIGHTS, 1, computes[1])
+    cached_topk(matrices, WEIGHTS, 2, computes[2])
+    assert (computes[1].calls, computes[2].calls, computes[3].calls) == (1, 2, 1)
+    assert cache_stats(cache_dir_for(matrices))["evictions"] >= 1
+
+
+def test_family_scores(tmp_path, monkeypatch):
+    matrices = fake_matrices(str(tmp_path))
+    scores = np.random.default_rng(0).random((6, 6)).astype(np.float32)
+    calls = []
+    compute = lambda: calls.append(1) or scores
+
+    for _ in range(2):
+        np.testing.assert_array_equal(cached_family_scores(matrices, "grade", [0, 1, 2], 6, compute), scores)
+    assert len(calls) == 1
+    # A different spec grouping is a different entry
+    cached_family_scores(matrices, "grade", [0, 1], 6, compute)
+    assert len(calls) == 2
+
+    monkeypatch.setattr(result_cache, "MAX_FAMILY_SPECS", 5)
+    assert cached_family_scores(matrices, "grade", [0, 1, 2], 6, compute) is None
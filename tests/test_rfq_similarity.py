@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+import pytest
+from src.rfq_similarity import (
+    CAT_COLS, compute_top3, vectorized_similarity, weighted_topk, embedding_topk, fit_family_encoders,
+    categorical_codes, categorical_tile, categorical_pair_scores, categorical_onehot, parse_range_series, parse_range_value,
+)
+from src.feature_store import rfq_features
+from tests.conftest import RFQ_FILE, REFERENCE_FILE
+from tests.helpers import frame_topk, dense_similarity, dense_topk
+
+TOP_N = 3
+
+
+# Scores are float64 and rounded before ranking, so the top-k is the same array
+# whatever the tiling or dedupe path
+@pytest.mark.parametrize("dedupe", [True, False])
+@pytest.mark.parametrize("block_size", [1, 7, 1024])
+def test_weighted_topk_is_tiling_independent(matrices, dedupe, block_size):
+    weighted = np.asarray(matrices["weighted"])
+    expected_idx, expected_scores = weighted_topk(weighted, TOP_N, dedupe=False)
+    top_idx, top_scores = weighted_topk(weighted, TOP_N, block_size=block_size, dedupe=dedupe)
+    np.testing.assert_array_equal(top_idx, expected_idx)
+    np.testing.assert_array_equal(top_scores, expected_scores)
+
+
+def test_embedding_topk_matches_weighted_topk(matrices):
+    embeddings = {family: np.asarray(emb) for family, emb in matrices["embeddings"].items()}
+    for dedupe in [True, False]:
+        top_idx, top_scores = embedding_topk(embeddings, TOP_N, block_size=5, dedupe=dedupe)
+        expected_idx, expected_scores = weighted_topk(np.asarray(matrices["weighted"]), TOP_N)
+        np.testing.assert_array_equal(top_idx, expected_idx)
+        np.testing.assert_allclose(top_scores, expected_scores, rtol=0, atol=1e-12)
+
+
+# Against the original dense 0.4·cos(dim) + 0.3·cos(grade) + 0.3·cos(get_dummies)
+@pytest.mark.parametrize("block_size", [1, 1024])
+def test_vectorized_similarity_matches_dense_formula(feature_frame, block_size):
+    top_idx, top_scores = frame_topk(vectorized_similarity(feature_frame, TOP_N, block_size=block_size), TOP_N)
+    expected_idx, expected_scores = dense_topk(dense_similarity(feature_frame), TOP_N)
+    np.testing.assert_array_equal(top_idx, feature_frame["id"].to_numpy()[expected_idx])
+    np.testing.assert_allclose(top_scores, expected_scores, rtol=0, atol=1e-12)
+
+
+# compute_top3 returns the frame it wrote, or the top-k arrays on request
+def test_compute_top3_returns_the_written_frame(sample_files, tmp_path):
+    result = compute_top3(*sample_files, output_dir=str(tmp_path))
+    assert list(result.columns) == ["rfq_id", "match_id", "similarity_score"]
+    pd.testing.assert_frame_equal(result, pd.read_csv(tmp_path / "top3.csv", dtype={"rfq_id": str, "match_id": str}),
+                                  check_dtype=False)
+
+    top_idx, top_scores = compute_top3(*sample_files, output_dir=str(tmp_path), as_arrays=True)
+    np.testing.assert_allclose(top_scores, frame_topk(result, 3)[1])
+
+
+
+# The same comparison on the full data/rfq.csv
+def test_vectorized_similarity_matches_dense_formula_on_sample_data(references):
+    frame = rfq_features(pd.read_csv(RFQ_FILE), references).drop_duplicates("id").reset_index(drop=True)
+    frame["id"] = frame["id"].astype(str)
+    top_idx, top_scores = frame_topk(vectorized_similarity(frame, TOP_N), TOP_N)
+    expected_idx, expected_scores = dense_topk(dense_similarity(frame), TOP_N)
+    np.testing.assert_array_equal(top_idx, frame["id"].to_numpy()[expected_idx])
+    np.testing.assert_allclose(top_scores, expected_scores, rtol=0, atol=1e-12)
+
+
+# -------------------------------
+# Integer-coded categoricals
+# -------------------------------
+def categorical_frame(rows):
+    return pd.DataFrame(rows, columns=CAT_COLS)
+
+
+# Codes fitted on the corpus score like the cosine of pd.get_dummies(dummy_na=True)
+# over corpus and queries together, with NaN as its own level. Queries carry levels
+# unseen at fit time, which match no corpus row.
+def test_categorical_codes_match_get_dummies_cosine():
+    from sklearn.metrics.pairwise import cosine_similarity
+    corpus = categorical_frame([
+        ["zinc", "pickled", "coil", "a", "oiled"],
+        ["zinc", None, "sheet", "b", "oiled"],
+        [None, "pickled", "coil", None, None],
+        ["zinc", "pickled", "coil", "a", "dry"],
+        ["none", "rolled", "strip", "b", None],
+    ])
+    queries = categorical_frame([
+        ["zinc", "pickled", "coil", "a", "oiled"],
+        ["zinc", None, "plate", "c", None],            # unseen form and surface type
+        ["aluzinc", "brushed", "tube", "d", "waxed"],  # nothing seen before
+        [None, None, None, None, None],
+    ])
+    enc = fit_family_encoders(corpus, ["categorical"])["categorical"]
+    corpus_codes, query_codes = categorical_codes(corpus, enc), categorical_codes(queries, enc)
+    assert (query_codes[2] == -1).all() and (query_codes[1, 2:4] == -1).all()
+
+    dummies = pd.get_dummies(pd.concat([corpus, queries], ignore_index=True), dummy_na=True)
+    expected = cosine_similarity(dummies)
+    n = len(corpus)
+    np.testing.assert_allclose(categorical_tile(corpus_codes, corpus_codes), expected[:n, :n], rtol=0, atol=1e-12)
+    np.testing.assert_allclose(categorical_tile(query_codes, corpus_codes), expected[n:, :n], rtol=0, atol=1e-12)
+
+    rows, cols = np.divmod(np.arange(len(queries) * n), n)
+    np.testing.assert_allclose(categorical_pair_scores(query_codes[rows], corpus_codes[cols]),
+                               expected[n:, :n].ravel(), rtol=0, atol=1e-12)
+    onehot = categorical_onehot(query_codes, enc) @ categorical_onehot(corpus_codes, enc).T
+    np.testing.assert_allclose(onehot.toarray(), expected[n:, :n], rtol=0, atol=1e-12)
+
+
+# -------------------------------
+# Range parsing
+# -------------------------------
+# Hand-written edge cases: open ranges, single values, units, decimal commas,
+# malformed ranges, numbers that are not strings and missing values
+RANGE_EDGE_CASES = [
+    "0.20-0.25", " 0.20 - 0.25 ", "270-410 MPa", "≤0.40", "≥500 MPa", "-0.5", "0.5-", "-", "", "0.12",
+    "0,20-0,25", "0,5", "1-2-3", "1.2.3", "abc", "n/a", 0.3, 450, np.nan, None,
+]
+
+
+def test_parse_range_series_matches_parse_range_value():
+    references = pd.read_csv(REFERENCE_FILE, sep="\t")
+    grade_cols = ["Carbon (C)", "Manganese (Mn)", "Silicon (Si)", "Tensile strength (Rm)", "Yield strength (Re or Rp0.2)"]
+    raw = pd.concat([references[col] for col in grade_cols] + [pd.Series(RANGE_EDGE_CASES, dtype=object)],
+                    ignore_index=True)
+
+    parsed = parse_range_series(raw)
+    expected = pd.DataFrame([parse_range_value(value) for value in raw], columns=["min", "max", "mid"], dtype=float)
+    pd.testing.assert_frame_equal(parsed, expected)
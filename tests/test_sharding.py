@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+from src.sharding import assign_shards, sharded_topk, REMAINDER_SHARD
+from src.rfq_similarity import weighted_topk
+from src.topk import blocked_topk
+from tests.helpers import assert_same_topk
+
+TOP_N = 3
+
+
+def test_assign_shards_pools_small_groups():
+    key_df = pd.DataFrame({"Category": ["a"] * 5 + ["b"] * 3 + [None] * 4 + ["c"],
+                           "form": ["coils"] * 13})
+    shards = assign_shards(key_df, ["Category", "form"], min_shard_rows=4)
+    labels = [label for label, _ in shards]
+    assert labels == ["Category=a|form=coils", "Category=__missing__|form=coils", REMAINDER_SHARD]
+    np.testing.assert_array_equal(shards[-1][1], [5, 6, 7, 12])
+    assert sorted(np.concatenate([rows for _, rows in shards]).tolist()) == list(range(13))
+
+
+# Three interleaved shards, so every shard has rows all over the corpus
+@pytest.fixture(scope="module")
+def shards(matrices):
+    rows = np.arange(matrices["rows"])
+    return [(f"shard{s}", rows[rows % 3 == s]) for s in range(3)]
+
+
+# Re-searching every row across shards reproduces the unsharded top-k
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_cross_pass_everywhere_is_exact(matrices, shards, n_jobs):
+    top_idx, top_scores, report = sharded_topk(matrices, shards, TOP_N, cross_below=np.inf, n_jobs=n_jobs)
+    assert_same_topk(top_idx, top_scores, *weighted_topk(np.asarray(matrices["weighted"]), TOP_N))
+    assert report["pairs"].sum() == matrices["rows"] ** 2
+
+
+# Without the cross pass, every row's list is its shard's top-k
+def test_blocking_only_stays_in_shard(matrices, shards):
+    top_idx, top_scores, report = sharded_topk(matrices, shards, TOP_N, cross_below=-np.inf, n_jobs=1)
+    assert report["cross_rows"].sum() == 0
+    weighted = np.asarray(matrices["weighted"])
+    for _, rows in shards:
+        local = weighted[rows]
+        idx, scores = blocked_topk(lambda r, c: local[r] @ local[c].T, len(rows), TOP_N,
+                                   symmetric=True, self_score=0.0)
+        assert_same_topk(top_idx[rows], top_scores[rows], rows[idx], scores)
@@ -0,0 +1,129 @@
+import os
+import json
+import asyncio
+import pytest
+from src.similarity_service import SimilarityService, RequestError, MAX_K
+from src.inventory_matching import match_inventory
+from tests.conftest import DATA_DIR
+
+INVENTORY_FILE = os.path.join(os.path.dirname(DATA_DIR), "outputs", "inventory_dataset.csv")
+
+
+@pytest.fixture(scope="module")
+def service(sample_files, output_dir):
+    return SimilarityService(*sample_files, inventory_file=INVENTORY_FILE, output_dir=output_dir)
+
+
+# Raw RFQ rows as JSON specs (NaN -> null)
+@pytest.fixture(scope="module")
+def specs(rfq_sample):
+    return json.loads(rfq_sample.to_json(orient="records"))
+
+
+@pytest.mark.parametrize("body, message", [
+    (b"{not json", "not valid JSON"),
+    (b"{}", "expected"),
+    (json.dumps({"specs": []}).encode(), "expected"),
+    (json.dumps({"specs": [1, 2]}).encode(), "expected"),
+    (json.dumps({"spec": {}, "target": "suppliers"}).encode(), "target"),
+    (json.dumps({"spec": {}, "k": 0}).encode(), "k must be"),
+    (json.dumps({"spec": {}, "k": MAX_K + 1}).encode(), "k must be"),
+    (json.dumps({"spec": {}, "k": "3"}).encode(), "k must be"),
+])
+def test_invalid_requests_are_rejected(service, body, message):
+    with pytest.raises(RequestError, match=message):
+        asyncio.run(service.handle_similar(body))
+
+
+# A spec scores the same alone or micro-batched with others, for both targets
+@pytest.mark.parametrize("target", ["rfqs", "inventory"])
+def test_batched_scores_match_single_requests(service, specs, target):
+    batch = service.score(target, specs, 5)
+    single = [service.score(target, [spec], 5)[0] for spec in specs]
+    assert batch == single
+    assert any(batch)
+
+
+# Concurrent requests share batches and each gets its own k back. All requests
+# are queued before the batcher starts, so the batch window cannot split them.
+def test_micro_batcher_splits_results_per_request(service, specs):
+    async def run():
+        service.queue = asyncio.Queue()
+        requests = asyncio.gather(*[
+            service.submit(target, specs[i:i + 3], k) for i, (target, k) in
+            enumerate([("rfqs", 3), ("inventory", 2), ("rfqs", 1), ("inventory", 5), ("rfqs", 5)])
+        ])
+        while service.queue.qsize() < 5:
+            await asyncio.sleep(0)
+        batcher = asyncio.create_task(service._batcher())
+        try:
+            return await requests
+        finally:
+            batcher.cancel()
+
+    batches = service.counts["batches"]
+    results = asyncio.run(run())
+    assert service.counts["batches"] - batches == 2
+    for i, (target, k) in enumerate([("rfqs", 3), ("inventory", 2), ("rfqs", 1), ("inventory", 5), ("rfqs", 5)]):
+        assert results[i] == [matches[:k] for matches in service.score(target, specs[i:i + 3], 5)]
+
+
+# A spec whose id is in the corpus does not match itself; without the id it does
+def test_corpus_ids_are_excluded_from_their_own_matches(service, specs):
+    spec = specs[0]
+    with_id = service.score("rfqs", [spec], 3)[0]
+    without_id = service.score("rfqs", [{**spec, "id": None}], 3)[0]
+    assert spec["id"] not in [m["match_id"] for m in with_id]
+    assert spec["id"] in [m["match_id"] for m in without_id]
+    assert without_id[0]["similarity_score"] == pytest.approx(1.0)
+
+
+def test_inventory_scores_match_the_batch_pipeline(service, specs):
+    frame = service.engineer(specs)
+    frame["id"] = range(len(frame))
+    expected = match_inventory(frame, service.inventory, top_n=3)
+    results = service.score("inventory", specs, 3)
+    assert [(i, m["match_id"], m["similarity_score"]) for i, matches in enumerate(results) for m in matches] == \
+        list(expected[["rfq_id", "match_id", "similarity_score"]].itertuples(index=False, name=None))
+
+
+# /stats over HTTP counts /similar requests, errors and latencies
+def test_stats_endpoint(service, specs):
+    async def request(reader, writer, method, path, payload=None):
+        body = b"" if payload is None else json.dumps(payload).encode()
+        writer.write(f"{method} {path} HTTP/1.1\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        headers = {}
+        while (line := await reader.readline()) not in (b"\r\n", b""):
+            name, _, value = line.decode().partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return status, json.loads(await reader.readexactly(int(headers["content-length"])))
+
+    async def run():
+        service.queue = asyncio.Queue()
+        batcher = asyncio.create_task(service._batcher())
+        server = await asyncio.start_server(service.handle_connection, "127.0.0.1", 0)
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+        try:
+            responses = [
+                await request(reader, writer, "POST", "/similar", {"specs": specs[:2], "k": 2}),
+                await request(reader, writer, "POST", "/similar", {"spec": specs[3], "target": "inventory"}),
+                await request(reader, writer, "POST", "/similar", {"spec": specs[3], "k": 0}),
+                await request(reader, writer, "GET", "/stats"),
+            ]
+        finally:
+            writer.close()
+            server.close()
+            batcher.cancel()
+        return responses
+
+    before = service.stats()
+    first, second, bad, (status, stats) = asyncio.run(run())
+    assert (first[0], second[0], bad[0], status) == (200, 200, 400, 200)
+    assert len(first[1]["results"]) == 2 and all(len(matches) == 2 for matches in first[1]["results"])
+    assert stats["requests"] - before["requests"] == 3
+    assert stats["errors"] - before["errors"] == 1
+    assert stats["latency_ms"]["window"] == before["latency_ms"]["window"] + 3
+    assert stats["latency_ms"]["p50"] <= stats["latency_ms"]["p99"] <= stats["latency_ms"]["max"]
+    assert stats["corpus_rows"] == len(service.ids) and stats["inventory_rows"] == len(service.inventory)
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+from src.topk import select_topk, merge_topk, blocked_topk, blocked_topk_many, pairs_topk
+
+
+# Score matrix with many exact ties (values on a 0.1 grid)
+def tied_scores(n_rows, n_cols, seed=0, symmetric=False):
+    scores = np.round(np.random.default_rng(seed).random((n_rows, n_cols)), 1)
+    if symmetric:
+        scores = np.triu(scores) + np.triu(scores, 1).T
+    return scores
+
+
+# Brute force: stable sort on -score, so ties go to the lower column
+def brute_topk(scores, k):
+    order = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+    return order, np.take_along_axis(scores, order, axis=1)
+
+
+@pytest.mark.parametrize("k", [1, 3, 9, 30])
+def test_select_topk_matches_brute_force(k):
+    scores = tied_scores(12, 9)
+    idx, top = select_topk(scores, k, col_offset=5)
+    expected_idx, expected = brute_topk(scores, k)
+    np.testing.assert_array_equal(idx, expected_idx + 5)
+    np.testing.assert_array_equal(top, expected)
+
+
+def test_merge_topk_breaks_ties_by_index():
+    idx, scores = merge_topk(np.array([[7, 2]]), np.array([[0.5, 0.4]]), np.array([[1, 3]]), np.array([[0.5, 0.4]]), 3)
+    np.testing.assert_array_equal(idx, [[1, 7, 2]])
+    np.testing.assert_array_equal(scores, [[0.5, 0.5, 0.4]])
+
+
+@pytest.mark.parametrize("block_size", [1, 4, 7, 64])
+@pytest.mark.parametrize("symmetric", [False, True])
+@pytest.mark.parametrize("self_score", [None, 0.0, -np.inf])
+def test_blocked_topk_matches_brute_force(block_size, symmetric, self_score):
+    n, k = 23, 4
+    scores = tied_scores(n, n, symmetric=True)
+    expected_scores = scores.copy()
+    if self_score is not None:
+        np.fill_diagonal(expected_scores, self_score)
+
+    idx, top = blocked_topk(lambda rows, cols: scores[rows, cols].copy(), n, k,
+                            block_size=block_size, symmetric=symmetric, self_score=self_score)
+    expected_idx, expected = brute_topk(expected_scores, k)
+    np.testing.assert_array_equal(idx, expected_idx)
+    np.testing.assert_array_equal(top, expected)
+
+
+def test_blocked_topk_rectangular():
+    scores = tied_scores(10, 31, seed=1)
+    idx, top = blocked_topk(lambda rows, cols: scores[rows, cols], 10, 5, block_size=8, n_cols=31)
+    expected_idx, expected = brute_topk(scores, 5)
+    np.testing.assert_array_equal(idx, expected_idx)
+    np.testing.assert_array_equal(top, expected)
+
+
+# k larger than the candidates: self excluded leaves n - 1 per row
+def test_blocked_topk_caps_k():
+    scores = tied_scores(4, 4, symmetric=True)
+    idx, top = blocked_topk(lambda rows, cols: scores[rows, cols].copy(), 4, 10, symmetric=True, self_score=-np.inf)
+    assert idx.shape == (4, 3)
+    assert not (idx == np.arange(4)[:, None]).any()
+
+
+def test_blocked_topk_many_matches_single():
+    a, b = tied_scores(17, 17, seed=2, symmetric=True), tied_scores(17, 17, seed=3, symmetric=True)
+    many = blocked_topk_many(lambda rows, cols: [a[rows, cols].copy(), b[rows, cols].copy()], 2, 17, 3,
+                             block_size=5, symmetric=True, self_score=0.0)
+    for scores, (idx, top) in zip([a, b], many):
+        single = blocked_topk(lambda rows, cols: scores[rows, cols].copy(), 17, 3,
+                              block_size=5, symmetric=True, self_score=0.0)
+        np.testing.assert_array_equal(idx, single[0])
+        np.testing.assert_array_equal(top, single[1])
+
+
+def test_pairs_topk_matches_brute_force():
+    scores = tied_scores(9, 9, seed=4)
+    keep = np.random.default_rng(5).random(scores.shape) < 0.6
+    rows, cols = np.nonzero(keep)
+    out_rows, out_cols, out_scores = pairs_topk(rows, cols, scores[rows, cols], 2)
+
+    masked = np.where(keep, scores, -np.inf)
+    expected_idx, expected = brute_topk(masked, 2)
+    for row in range(9):
+        n_valid = min(2, keep[row].sum())
+        np.testing.assert_array_equal(out_cols[out_rows == row], expected_idx[row, :n_valid])
+        np.testing.assert_array_equal(out_scores[out_rows == row], expected[row, :n_valid])
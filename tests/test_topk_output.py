@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+from src.topk import topk_frame
+from src.topk_output import PARQUET_ENV, partition_path, write_topk, write_result_frame
+
+
+def topk_arrays(n=10, k=3, seed=0):
+    rng = np.random.default_rng(seed)
+    ids = np.array([f"rfq-{i}" for i in range(n)], dtype=object)
+    top_idx = np.argsort(rng.random((n, n)), axis=1)[:, :k]
+    top_scores = np.sort(rng.random((n, k)), axis=1)[:, ::-1]
+    return ids, top_idx, top_scores
+
+
+# Written in blocks, the CSV is byte for byte the to_csv of the whole long frame
+@pytest.mark.parametrize("block_rows", [1, 4, 100])
+def test_write_topk_matches_frame_to_csv(tmp_path, block_rows):
+    ids, top_idx, top_scores = topk_arrays()
+    write_topk(tmp_path / "top3.csv", ids, top_idx, top_scores, block_rows=block_rows)
+    topk_frame(ids, top_idx, top_scores).to_csv(tmp_path / "expected.csv", index=False)
+    assert (tmp_path / "top3.csv").read_bytes() == (tmp_path / "expected.csv").read_bytes()
+
+
+# Slots a row could not fill (index n) are left out
+def test_write_topk_drops_unfilled_slots(tmp_path):
+    ids, top_idx, top_scores = topk_arrays()
+    top_idx[2, 1:] = len(ids)
+    top_idx[7, 2] = len(ids)
+    top_scores[top_idx == len(ids)] = -np.inf
+    write_topk(tmp_path / "top3.csv", ids, top_idx, top_scores, block_rows=4)
+
+    result = pd.read_csv(tmp_path / "top3.csv")
+    assert len(result) == top_idx.size - 3
+    assert result.groupby("rfq_id").size().to_dict()["rfq-2"] == 1
+    assert np.isfinite(result["similarity_score"]).all()
+
+
+def test_empty_result_writes_the_header(tmp_path):
+    write_topk(tmp_path / "top3.csv", np.array([], dtype=object), np.empty((0, 3), dtype=np.int64), np.empty((0, 3)))
+    assert (tmp_path / "top3.csv").read_text() == "rfq_id,match_id,similarity_score\n"
+
+
+# One hive partition per scenario, one row group per block, alongside unchanged CSVs
+def test_parquet_dataset_is_partitioned_by_scenario(tmp_path, monkeypatch):
+    pq = pytest.importorskip("pyarrow.parquet")
+    monkeypatch.setenv(PARQUET_ENV, "1")
+    ids, top_idx, top_scores = topk_arrays()
+    write_topk(tmp_path / "top3.csv", ids, top_idx, top_scores, block_rows=4)
+    hybrid = topk_frame(*topk_arrays(seed=1))
+    write_result_frame(hybrid, tmp_path / "top3_hybrid.csv", block_rows=8)
+
+    assert pq.ParquetFile(partition_path(str(tmp_path), "top3")).num_row_groups == 3
+    assert pq.ParquetFile(partition_path(str(tmp_path), "top3_hybrid")).num_row_groups == 4
+    scenario = pd.read_parquet(tmp_path / "topk", filters=[("scenario", "=", "top3_hybrid")])
+    pd.testing.assert_frame_equal(scenario.drop(columns="scenario"), hybrid)
+    assert set(pd.read_parquet(tmp_path / "topk")["scenario"].astype(str)) == {"top3", "top3_hybrid"}
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / "top3.csv"), topk_frame(ids, top_idx, top_scores))
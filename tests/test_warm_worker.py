@@ -0,0 +1,51 @@
+import os
+import stat
+import socket
+import time
+import multiprocessing
+import pytest
+from src import warm_worker
+from src.warm_worker import serve, run_in_worker
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, "send_fds"), reason="needs descriptor passing")
+
+
+def _exit_with(argv):
+    raise SystemExit(int(argv[0]))
+
+
+def _serve(socket_path):
+    warm_worker.REQUEST_TIMEOUT = 0.2
+    serve(_exit_with, socket_path=socket_path, root=ROOT)
+
+
+@pytest.fixture
+def worker(tmp_path):
+    socket_path = str(tmp_path / "warm.sock")
+    process = multiprocessing.get_context("fork").Process(target=_serve, args=(socket_path,), daemon=True)
+    process.start()
+    deadline = time.time() + 30
+    while not os.path.exists(socket_path) and time.time() < deadline:
+        time.sleep(0.05)
+    yield socket_path
+    process.terminate()
+    process.join(timeout=5)
+
+
+def test_socket_is_owner_only(worker):
+    assert stat.S_IMODE(os.stat(worker).st_mode) == 0o600
+
+
+# A client that connects and sends nothing is dropped, and later runs still go through
+def test_idle_client_does_not_block(worker):
+    idle = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    idle.connect(worker)
+    socket.setdefaulttimeout(10)  # fail rather than hang if the worker is stuck
+    try:
+        assert run_in_worker(["3"], socket_path=worker) == 3
+        assert idle.recv(1) == b""
+    finally:
+        socket.setdefaulttimeout(None)
+        idle.close()
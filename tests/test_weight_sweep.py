@@ -0,0 +1,15 @@
+import numpy as np
+import pytest
+from src.ablation_analysis import weight_sweep, weight_grid, DEFAULT_WEIGHTS
+
+
+# The default weights are scored like the reference, whichever chunk they land in
+@pytest.mark.parametrize("n_jobs, chunk_size", [(1, 16), (1, 1), (2, 5)])
+def test_default_weights_agree_with_reference(matrices, n_jobs, chunk_size):
+    configs = weight_grid(0.1)
+    summary = weight_sweep(matrices, configs, block_size=7, n_jobs=n_jobs, chunk_size=chunk_size)
+    assert len(summary) == len(configs)
+    default = np.all([np.isclose(summary[f], w) for f, w in DEFAULT_WEIGHTS.items()], axis=0)
+    assert default.sum() == 1
+    assert summary.loc[default, "top1_agreement"].item() == 1.0
+    assert summary.loc[default, "overlap_at_k"].item() == 1.0